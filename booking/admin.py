@@ -1,7 +1,25 @@
 from django.contrib import admin
-from .models import Bus, Booking
+from .models import Bus, Booking, PaymentEvent, SeatInventory
+
+class BookingAdmin(admin.ModelAdmin):
+    list_display = ['booking_reference', 'user', 'bus', 'booking_date', 'seats_booked', 'payment_status']
+    list_filter = ['payment_status']
+    list_select_related = ['user', 'bus']
+    raw_id_fields = ['user', 'bus']
+
+class SeatInventoryAdmin(admin.ModelAdmin):
+    list_display = ['bus', 'date', 'seats_total', 'seats_held', 'seats_sold']
+    list_select_related = ['bus']
+    raw_id_fields = ['bus']
+
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'event', 'payment_id', 'order_id', 'received_at', 'processed_at', 'outcome']
+    list_filter = ['event', 'outcome']
+    search_fields = ['payment_id', 'order_id']
 
 admin.site.register(Bus)
-admin.site.register(Booking)
+admin.site.register(Booking, BookingAdmin)
+admin.site.register(SeatInventory, SeatInventoryAdmin)
+admin.site.register(PaymentEvent, PaymentEventAdmin)
 
 # Register your models here.
@@ -9,10 +9,36 @@ urlpatterns = [
     path('auth/refresh/', TokenRefreshView.as_view(), name='api_refresh'),
     path('buses/', BusListView.as_view(), name='api_bus_list'),
     path('buses/<int:pk>/', api_views.Bus_details, name='api_bus_detail'),
+    path('buses/<int:pk>/seatmap/', api_views.bus_seatmap, name='api_bus_seatmap'),
     path('buses/search/', api_views.search_buses, name='api_bus_search'),
     path('bookings',MyBookingsView.as_view(), name='api_my_bookings'),
     path('booking/create/', api_views.create_booking, name='api_create_booking'),
+    path('bookings/group/', api_views.create_group_booking, name='api_create_group_booking'),
     path('bookings/<int:pk>',api_views.booking_detail, name='api_booking_detail'),
     path('bookings/<int:pk>/modify/', api_views.modify_booking, name='api_modify_booking'),
     path('bookings/<int:pk>/cancel/', api_views.cancel_booking, name='api_cancel_booking'),
-]
\ No newline at end of file
+    path('routes/autocomplete/', api_views.route_autocomplete, name='api_route_autocomplete'),
+    path('journeys/search/', api_views.journey_search, name='api_journey_search'),
+    path('stats/availability-cache/', api_views.availability_cache_stats, name='api_availability_cache_stats'),
+]
+
+# Most queries a single request to each URL may run, enforced by
+# booking.testing in the test suite. Declare one for every new URL.
+QUERY_BUDGETS = {
+    'api_register': 4,
+    'api_login': 4,
+    'api_refresh': 3,
+    'api_bus_list': 3,
+    'api_bus_detail': 3,
+    'api_bus_seatmap': 2,
+    'api_bus_search': 3,
+    'api_my_bookings': 3,
+    'api_create_booking': 9,
+    'api_create_group_booking': 9,
+    'api_booking_detail': 3,
+    'api_modify_booking': 9,
+    'api_cancel_booking': 9,
+    'api_route_autocomplete': 4,
+    'api_journey_search': 6,
+    'api_availability_cache_stats': 2,
+}
@@ -1,16 +1,33 @@
+import base64
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models import Q, Sum
+from django.utils.decorators import method_decorator
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView, RetrieveAPIView
-from datetime import datetime
-from .models import Bus, Booking
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import Bus, Booking, SeatInventory
+from .cache import availability_cache
+from .conditional import (
+    bus_etag, bus_last_modified, catalogue_etag, catalogue_last_modified,
+    conditional, search_etag, search_last_modified,
+)
+from .routes import city_index, filter_route
+from .journeys import MAX_LAYOVER, connection_index
+from .pagination import BookingKeysetPagination, BusKeysetPagination
+from .inventory import apply_booking_change, get_available_seats_many
+from .bulk import create_group_bookings
+from .seatmap import SeatMap, SeatsUnavailable, claim_seats, release_seats
 from .serializers import (
-    UserSerializer, BusSerializer, BookingSerializer
+    UserSerializer, BusSerializer, BusAvailabilitySerializer, BookingSerializer, GroupBookingSerializer,
+    BUS_VALUES
 )
 
 @api_view(['POST'])
@@ -33,17 +50,60 @@ class BusListView(ListAPIView):
     queryset = Bus.objects.all()
     serializer_class = BusSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = BusKeysetPagination
+
+    @method_decorator(conditional(catalogue_etag, catalogue_last_modified))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        # Read-only hot path: plain .values() rows instead of model
+        # instances run through BusSerializer, same output.
+        queryset = BUS_VALUES.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(BUS_VALUES.many(page))
     
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@conditional(bus_etag, bus_last_modified)
 def Bus_details(request, pk):
-    try:
-        bus = Bus.objects.get(pk=pk)
-        serializer = BusSerializer(bus)
-        return Response(serializer.data)
-    except Bus.DoesNotExist:
+    bus = BUS_VALUES.values(Bus.objects.filter(pk=pk)).first()
+    if bus is None:
         return Response({'error':'Bus not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(BUS_VALUES.to_representation(bus))
     
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def bus_seatmap(request, pk):
+    try:
+        seat_date = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return Response({'error': 'date must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
+
+    row = SeatInventory.objects.filter(bus_id=pk, date=seat_date).values(
+        'seats_total', 'seats_held', 'seats_sold', 'seat_map'
+    ).first()
+    if row is None:
+        # Nothing booked on this departure yet
+        total_seats = Bus.objects.filter(pk=pk).values_list('total_seats', flat=True).first()
+        if total_seats is None:
+            return Response({'error': 'Bus not found'}, status=status.HTTP_404_NOT_FOUND)
+        row = {'seats_total': total_seats, 'seats_held': 0, 'seats_sold': 0, 'seat_map': b''}
+
+    seat_map = SeatMap(row['seat_map'])
+    taken = row['seats_held'] + row['seats_sold']
+    return Response({
+        'bus': pk,
+        'date': seat_date,
+        'total_seats': row['seats_total'],
+        'available_seats': row['seats_total'] - taken,
+        # Seats taken by bookings that did not pick seat numbers
+        'unassigned_seats': taken - seat_map.count(),
+        'taken': seat_map.taken(),
+        # Bit n - 1, most significant bit first, is set when seat n is taken
+        'seat_map': base64.b64encode(seat_map.to_bytes(row['seats_total'])).decode(),
+    })
+
 # class BusDetailView(RetrieveAPIView):
 #     queryset = Bus.objects.all()
 #     serializer_class = BusSerializer
@@ -51,18 +111,32 @@ def Bus_details(request, pk):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@conditional(search_etag, search_last_modified)
 def search_buses(request):
     source = request.GET.get('source','')
     destination = request.GET.get('destination','')
-    buses = Bus.objects.all()
+    buses = filter_route(Bus.objects.all(), source, destination)
+    
+    date_str = request.GET.get('date')
+    if date_str:
+        try:
+            search_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return Response({'error': 'date must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        search_date = None
     
-    if source:
-        buses = buses.filter(source__icontains=source)
-    if destination:
-        buses = buses.filter(destination__icontains=destination)
-    serializer = BusSerializer(buses, many=True)
+    paginator = BusKeysetPagination()
+    page = paginator.paginate_queryset(buses, request)
+    if search_date:
+        available = get_available_seats_many(page, search_date, include_held=True)
+        for bus in page:
+            bus.available_seats = available[bus.id]
+        serializer = BusAvailabilitySerializer(page, many=True)
+    else:
+        serializer = BusSerializer(page, many=True)
     
-    return Response({'count': buses.count(),'results':serializer.data})
+    return paginator.get_paginated_response(serializer.data)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -76,11 +150,20 @@ def create_booking(request):
     seats = serializer.validated_data['seats_booked']
 
     total_price = bus.price * seats
+    seat_numbers = serializer.validated_data.get('seat_numbers')
 
-    booking = serializer.save(
-        user=request.user,
-        total_price=total_price
-    )
+    try:
+        with transaction.atomic():
+            if seat_numbers:
+                claim_seats(bus, serializer.validated_data['booking_date'], seat_numbers)
+            booking = serializer.save(
+                user=request.user,
+                total_price=total_price,
+                hold_expires_at=timezone.now() + timedelta(seconds=settings.SEAT_HOLD_TTL)
+            )
+            apply_booking_change(booking)
+    except SeatsUnavailable as e:
+        return Response({'error': str(e), 'seat_numbers': e.seats}, status=status.HTTP_409_CONFLICT)
 
     return Response(
         {
@@ -90,24 +173,65 @@ def create_booking(request):
         status=status.HTTP_201_CREATED
     )
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_group_booking(request):
+    serializer = GroupBookingSerializer(data=request.data)
+
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    lines = serializer.validated_data['bookings']
+    buses = Bus.objects.in_bulk({line['bus'] for line in lines})
+    unknown = [{'bus': ['Bus not found']} if line['bus'] not in buses else {} for line in lines]
+    if any(unknown):
+        return Response({'bookings': unknown}, status=status.HTTP_400_BAD_REQUEST)
+
+    bookings, rejected = create_group_bookings(
+        request.user, lines, buses, serializer.validated_data['allow_partial']
+    )
+    # One serializer for all bookings, so its fields are built once
+    created = iter(BookingSerializer([booking for booking in bookings if booking], many=True).data)
+    results = []
+    for i, booking in enumerate(bookings):
+        if booking:
+            results.append({'line': i, 'status': 'created', 'booking': next(created)})
+        elif i in rejected:
+            results.append({'line': i, 'status': 'rejected', 'error': rejected[i]})
+        else:
+            results.append({'line': i, 'status': 'not_booked'})
+
+    if not any(bookings):
+        return Response({
+            'error': 'Not enough seats for some bookings, nothing was booked',
+            'results': results
+        }, status=status.HTTP_409_CONFLICT)
+    return Response(
+        {
+            'message': f'{len(bookings) - len(rejected)} of {len(bookings)} bookings created',
+            'results': results
+        },
+        status=status.HTTP_201_CREATED
+    )
+
 class MyBookingsView(APIView):
     permission_classes = [IsAuthenticated]
     def get(self, request):
-        bookings = Booking.objects.filter(user=request.user).exclude(payment_status='cancelled')
+        bookings = Booking.objects.filter(user=request.user).exclude(payment_status='cancelled').select_related('bus')
         
-        serializer = BookingSerializer(bookings, many=True)
+        paginator = BookingKeysetPagination()
+        page = paginator.paginate_queryset(bookings, request, view=self)
+        serializer = BookingSerializer(page, many=True)
         
-        return Response({
-            'count': bookings.count(),
-            'bookings': serializer.data
-        })
+        return paginator.get_paginated_response(serializer.data)
         
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def booking_detail(request, pk):
     try:
-        booking = Booking.objects.get(pk=pk, user=request.user)
+        booking = Booking.objects.select_related('bus').get(pk=pk, user=request.user)
         serializer = BookingSerializer(booking)
+        return Response(serializer.data)
     except Booking.DoesNotExist:
         return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -115,23 +239,43 @@ def booking_detail(request, pk):
 @permission_classes([IsAuthenticated])
 def modify_booking(request, pk):
     try:
-        booking = Booking.objects.get(pk=pk, user=request.user)
-    except Booking.DoesNotExist:
-        return Response({'error':'Booking not found'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    if booking.payment_status != 'pending':
-        return Response({'error': 'only pending bookings can be modified'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    serializer = BookingSerializer(booking, data=request.data)
-    
-    if not serializer.is_valid():
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    
-    seats = serializer.validated_data.get('seats_booked', booking.seats_booked)
-    serializer.save(
-        total_price=booking.bus.price * seats
-    )
-    
+        with transaction.atomic():
+            # Locked so a payment or the hold sweeper cannot change the
+            # booking between the status check and the inventory update
+            try:
+                booking = Booking.objects.select_for_update(of=('self',)).select_related('bus').get(
+                    pk=pk, user=request.user
+                )
+            except Booking.DoesNotExist:
+                return Response({'error':'Booking not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+            if booking.payment_status != 'pending':
+                return Response({'error': 'only pending bookings can be modified'}, status=status.HTTP_400_BAD_REQUEST)
+
+            serializer = BookingSerializer(booking, data=request.data)
+
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            old_seats = booking.seats_booked
+            old_departure = (booking.bus, booking.booking_date)
+            seats = serializer.validated_data.get('seats_booked', booking.seats_booked)
+            # Seats are picked when booking; a modified booking keeps its seat
+            # numbers only if it stays on the same departure with the same count
+            serializer.validated_data.pop('seat_numbers', None)
+            keeps_seats = (booking.bus_id, booking.booking_date) == (
+                serializer.validated_data['bus'].id, serializer.validated_data['booking_date']
+            ) and seats == old_seats
+            if not keeps_seats:
+                release_seats(booking.bus_id, booking.booking_date, booking.seat_numbers)
+            booking = serializer.save(
+                total_price=serializer.validated_data['bus'].price * seats,
+                seat_numbers=booking.seat_numbers if keeps_seats else []
+            )
+            apply_booking_change(booking, 'pending', old_seats, old_departure)
+    except SeatsUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+
     return Response({
         'message':'Booking modified successfully',
         'booking' : serializer.data
@@ -140,21 +284,68 @@ def modify_booking(request, pk):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def cancel_booking(request, pk):
-    try:
-        booking = Booking.objects.get(pk=pk, user=request.user)
-         
-        if booking.payment_status == 'pending':
-            booking.payment_status = 'cancelled'
-            booking.save()
-            return Response({
-                'message': 'Booking cancelled successfully',
-                'booking_reference': booking.booking_reference
-            })
-        else:
+    with transaction.atomic():
+        try:
+            booking = Booking.objects.select_for_update(of=('self',)).select_related('bus').get(
+                pk=pk, user=request.user
+            )
+        except Booking.DoesNotExist:
+            return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        if booking.payment_status != 'pending':
             return Response({
                 'error': 'Only pending bookings can be cancelled'
             }, status=status.HTTP_400_BAD_REQUEST)
-    except Booking.DoesNotExist:
-        return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
+        booking.payment_status = 'cancelled'
+        booking.save()
+        apply_booking_change(booking, 'pending', booking.seats_booked)
+    return Response({
+        'message': 'Booking cancelled successfully',
+        'booking_reference': booking.booking_reference
+    })
 
-             
\ No newline at end of file
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def availability_cache_stats(request):
+    return Response(availability_cache.stats())
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def route_autocomplete(request):
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'results': city_index.suggest(request.GET.get('q', ''), limit)})
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def journey_search(request):
+    source = request.GET.get('source', '')
+    destination = request.GET.get('destination', '')
+    if not source.strip() or not destination.strip():
+        return Response({'error': 'source and destination are required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        travel_date = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return Response({'error': 'date must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        after = datetime.strptime(request.GET.get('after', '00:00'), '%H:%M')
+    except ValueError:
+        return Response({'error': 'after must be in HH:MM format'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        max_transfers = int(request.GET.get('max_transfers', 2))
+        min_layover = int(request.GET.get('min_layover', settings.JOURNEY_MIN_LAYOVER))
+        limit = min(int(request.GET.get('limit', 5)), 20)
+    except ValueError:
+        return Response({'error': 'max_transfers, min_layover and limit must be numbers'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if not 0 <= max_transfers <= 2 or not 0 <= min_layover <= MAX_LAYOVER or limit < 1:
+        return Response({'error': f'max_transfers must be 0 to 2, min_layover 0 to {MAX_LAYOVER} and limit positive'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    results = connection_index.plan(
+        source, destination, travel_date, after=after.hour * 60 + after.minute,
+        max_transfers=max_transfers, min_layover=min_layover, limit=limit,
+    )
+    return Response({'source': source, 'destination': destination, 'date': travel_date, 'results': results})
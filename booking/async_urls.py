@@ -0,0 +1,19 @@
+from django.urls import path
+from . import async_views
+
+# Async twins of API endpoints, mounted under /api/async/. Served without a
+# thread per request only when the project runs under an ASGI server.
+urlpatterns = [
+    path('buses/<int:pk>/', async_views.bus_detail, name='async_bus_detail'),
+    path('buses/<int:pk>/availability/', async_views.bus_availability, name='async_bus_availability'),
+    path('buses/search/', async_views.search_buses, name='async_bus_search'),
+    path('bookings/<int:pk>/payment-order/', async_views.payment_order, name='async_payment_order'),
+]
+
+# Most queries a single request to each URL may run, see booking.testing
+QUERY_BUDGETS = {
+    'async_bus_detail': 1,
+    'async_bus_availability': 2,
+    'async_bus_search': 2,
+    'async_payment_order': 3,
+}
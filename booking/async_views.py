@@ -0,0 +1,136 @@
+"""
+Async versions of the read-heavy catalogue endpoints and of Razorpay order
+creation, for deployment under an ASGI server (see bus_booking/asgi.py).
+While one of these views waits on the database or the payment gateway the
+worker's event loop serves other requests, so a slow gateway no longer ties
+up a whole worker per payment.
+
+DRF views are sync only, so these are plain Django views that return the
+same JSON as their DRF counterparts in api_views. Authentication is the
+same JWT bearer token.
+"""
+from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from . import payments
+from .inventory import get_available_seats_many
+from .models import Booking, Bus
+from .pagination import BusKeysetPagination, InvalidCursor, akeyset_paginate, default_page_size
+from .renderers import FastJSONRenderer
+from .routes import filter_route
+from .serializers import BUS_VALUES
+
+renderer = FastJSONRenderer()
+
+
+def json_response(data, status=200):
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json')
+
+
+def error(message, status):
+    return json_response({'error': message}, status)
+
+
+async def authenticate(request):
+    """The user of a valid JWT bearer token, or None."""
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+@require_GET
+async def bus_detail(request, pk):
+    bus = await BUS_VALUES.values(Bus.objects.filter(pk=pk)).afirst()
+    if bus is None:
+        return error('Bus not found', 404)
+    return json_response(BUS_VALUES.to_representation(bus))
+
+
+@require_GET
+async def search_buses(request):
+    buses = filter_route(Bus.objects.all(), request.GET.get('source', ''), request.GET.get('destination', ''))
+    search_date = None
+    if request.GET.get('date'):
+        try:
+            search_date = parse_date(request.GET['date'])
+        except ValueError:
+            return error('date must be in YYYY-MM-DD format', 400)
+
+    try:
+        page_size = int(request.GET.get('page_size', default_page_size()))
+    except ValueError:
+        page_size = default_page_size()
+    page_size = max(1, min(page_size, BusKeysetPagination.max_page_size))
+    try:
+        page = await akeyset_paginate(
+            BUS_VALUES.values(buses), BusKeysetPagination.ordering, request.GET.get('cursor'), page_size
+        )
+    except InvalidCursor:
+        return error('Invalid cursor', 404)
+
+    results = BUS_VALUES.many(page)
+    if search_date:
+        # Availability reads go through the (sync) Redis cache
+        available = await sync_to_async(get_available_seats_many)(
+            [Bus(id=row['id'], total_seats=row['total_seats']) for row in page], search_date, include_held=True
+        )
+        for row in results:
+            row['available_seats'] = available[row['id']]
+
+    def link(cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(remove_query_param(request.build_absolute_uri(), 'count'), 'cursor', cursor)
+
+    return json_response({'next': link(page.next_cursor), 'previous': link(page.previous_cursor), 'results': results})
+
+
+@require_GET
+async def bus_availability(request, pk):
+    try:
+        seat_date = parse_date(request.GET.get('date', ''))
+    except ValueError:
+        return error('date must be in YYYY-MM-DD format', 400)
+    bus = await Bus.objects.only('id', 'total_seats').filter(pk=pk).afirst()
+    if bus is None:
+        return error('Bus not found', 404)
+    available = await sync_to_async(get_available_seats_many)([bus], seat_date, include_held=True)
+    return json_response({'bus': bus.id, 'date': seat_date, 'available_seats': available[bus.id]})
+
+
+@csrf_exempt
+@require_POST
+async def payment_order(request, pk):
+    """The Razorpay order to pay a pending booking with, created if it has none yet."""
+    user = await authenticate(request)
+    if user is None:
+        return error('Authentication credentials were not provided.', 401)
+    booking = await Booking.objects.filter(pk=pk, user=user).afirst()
+    if booking is None:
+        return error('Booking not found', 404)
+    if booking.payment_status != 'pending':
+        return error('Only pending bookings can be paid', 400)
+
+    try:
+        order_id = await payments.aensure_order(booking)
+    except payments.PaymentGatewayError:
+        return error('Payments are unavailable right now, please try again in a minute', 503)
+    return json_response({
+        'booking_reference': booking.booking_reference,
+        'razorpay_key_id': settings.RAZORPAY_KEY_ID,
+        'razorpay_order_id': order_id,
+        'amount': payments.order_amount(booking),
+        'currency': 'INR',
+    })
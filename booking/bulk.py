@@ -0,0 +1,93 @@
+"""
+Group bookings: many passenger lines, possibly on different buses and
+dates, booked in one transaction with a fixed number of queries however
+many lines there are. The inventory rows of every departure involved are
+locked together in one query, each line takes its seats from what is left
+in request order, the bookings go in with one bulk_create and the held
+seats are added with one UPDATE.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from .inventory import invalidate_availability
+from .models import Booking, SeatInventory
+from .references import new_booking_reference
+
+
+def lock_inventory(departures):
+    """
+    Return {(bus_id, date): SeatInventory} for the given {(bus_id, date): bus},
+    locked for this transaction. Rows are created first where missing, and
+    locked in id order so two group bookings cannot deadlock each other.
+    """
+    SeatInventory.objects.bulk_create([
+        SeatInventory(bus=bus, date=date, seats_total=bus.total_seats)
+        for (_, date), bus in departures.items()
+    ], ignore_conflicts=True)
+    # One condition per date rather than per departure keeps the query small
+    buses_by_date = defaultdict(list)
+    for bus_id, date in departures:
+        buses_by_date[date].append(bus_id)
+    match = Q()
+    for date, bus_ids in buses_by_date.items():
+        match |= Q(date=date, bus_id__in=bus_ids)
+    rows = SeatInventory.objects.select_for_update().filter(match).order_by('id')
+    return {(row.bus_id, row.date): row for row in rows}
+
+
+def create_group_bookings(user, lines, buses, allow_partial=False):
+    """
+    Book every line (validated BookingLineSerializer data) for user; buses
+    maps bus id to Bus. Returns (bookings, rejected), bookings holding the
+    created Booking for each line or None, rejected mapping a line's index
+    to the reason it could not be booked. Without allow_partial nothing is
+    created unless every line fits.
+    """
+    now = timezone.now()
+    departures = {(line['bus'], line['booking_date']): buses[line['bus']] for line in lines}
+    bookings = [None] * len(lines)
+    rejected = {}
+
+    with transaction.atomic():
+        inventory = lock_inventory(departures)
+        remaining = {key: row.available_seats for key, row in inventory.items()}
+        for i, line in enumerate(lines):
+            key = (line['bus'], line['booking_date'])
+            if line['seats_booked'] > remaining[key]:
+                rejected[i] = f'Only {max(remaining[key], 0)} seats available'
+                continue
+            remaining[key] -= line['seats_booked']
+            bus = buses[line['bus']]
+            bookings[i] = Booking(
+                user=user,
+                bus=bus,
+                booking_date=line['booking_date'],
+                seats_booked=line['seats_booked'],
+                total_price=bus.price * line['seats_booked'],
+                passenger_name=line['passenger_name'],
+                passenger_email=line['passenger_email'],
+                passenger_phone=line['passenger_phone'],
+                booking_reference=new_booking_reference(),
+                hold_expires_at=now + timedelta(seconds=settings.SEAT_HOLD_TTL),
+            )
+        created = [booking for booking in bookings if booking]
+        if not created or (rejected and not allow_partial):
+            return [None] * len(lines), rejected
+
+        Booking.objects.bulk_create(created)
+        held = defaultdict(int)
+        for booking in created:
+            held[inventory[booking.bus_id, booking.booking_date].id] += booking.seats_booked
+        # Likewise one WHEN per distinct seat count rather than per row
+        rows_by_seats = defaultdict(list)
+        for row_id, seats in held.items():
+            rows_by_seats[seats].append(row_id)
+        SeatInventory.objects.filter(id__in=held).update(seats_held=F('seats_held') + Case(
+            *(When(id__in=row_ids, then=Value(seats)) for seats, row_ids in rows_by_seats.items())
+        ))
+        for bus_id, date in {(booking.bus_id, booking.booking_date) for booking in created}:
+            invalidate_availability(bus_id, date)
+    return bookings, rejected
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class AvailabilityCache:
+    """
+    Caches the (seats_total, seats_held, seats_sold) counts of a departure,
+    keyed by bus and date. Every cache error is treated as a miss so callers
+    fall back to the database, and after an error the cache is skipped for
+    AVAILABILITY_CACHE_RETRY_AFTER seconds instead of waiting on a dead
+    Redis on every request.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._down_until = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(bus_id, date):
+        return f'availability:{bus_id}:{date.isoformat()}'
+
+    def _count(self, hits=0, misses=0, errors=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.errors += errors
+
+    def _available(self):
+        return time.monotonic() >= self._down_until
+
+    def _failed(self, operation, error):
+        self._count(errors=1)
+        self._down_until = time.monotonic() + settings.AVAILABILITY_CACHE_RETRY_AFTER
+        logger.warning('Availability cache %s failed, using the database: %s', operation, error)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        if self._available():
+            try:
+                found = caches[self.alias].get_many(keys)
+            except Exception as e:
+                self._failed('get', e)
+        self._count(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def set_many(self, values, timeout=None):
+        if not values or not self._available():
+            return
+        try:
+            caches[self.alias].set_many(values, timeout=timeout or settings.AVAILABILITY_CACHE_TTL)
+        except Exception as e:
+            self._failed('set', e)
+
+    def delete(self, key):
+        if not self._available():
+            return
+        try:
+            caches[self.alias].delete(key)
+        except Exception as e:
+            self._failed('delete', e)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.errors = 0
+        self._down_until = 0
+
+
+availability_cache = AvailabilityCache()
+
+
+CATALOGUE_VERSION_KEY = 'bus_catalogue:version'
+
+
+def new_catalogue_version():
+    # "<unix time>.<random>": the time doubles as the catalogue's Last-Modified
+    return f'{int(time.time())}.{uuid.uuid4().hex}'
+
+
+def catalogue_version_time(version):
+    try:
+        return int(version.split('.', 1)[0])
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_catalogue_version():
+    """
+    A token that changes whenever any Bus is created, edited or deleted, shared
+    by all processes through the cache. Returns None when the cache is down.
+    """
+    try:
+        version = caches['default'].get(CATALOGUE_VERSION_KEY)
+        if version is None:
+            version = new_catalogue_version()
+            if not caches['default'].add(CATALOGUE_VERSION_KEY, version, timeout=None):
+                version = caches['default'].get(CATALOGUE_VERSION_KEY)
+        return version
+    except Exception as e:
+        logger.warning('Could not read the catalogue version: %s', e)
+        return None
+
+
+def bump_catalogue_version():
+    try:
+        caches['default'].set(CATALOGUE_VERSION_KEY, new_catalogue_version(), timeout=None)
+    except Exception as e:
+        logger.warning('Could not bump the catalogue version: %s', e)
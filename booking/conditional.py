@@ -0,0 +1,114 @@
+"""
+ETag / Last-Modified validators for the bus catalogue endpoints, for use
+with django.views.decorators.http.condition. None of them loads Bus rows:
+the list and search endpoints use the catalogue version from the cache and
+the detail endpoint reads a single updated_at column.
+"""
+import functools
+import time
+from datetime import datetime, timezone
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from .cache import catalogue_version_time, get_catalogue_version
+from .models import Bus
+from .replicas import pin_to_primary
+
+
+def _memoize_on_request(attr):
+    # condition() calls the etag and last_modified functions separately;
+    # compute the state they share once per request.
+    def decorator(func):
+        def wrapper(request, *args, **kwargs):
+            if not hasattr(request, attr):
+                setattr(request, attr, func(request, *args, **kwargs))
+            return getattr(request, attr)
+        return wrapper
+    return decorator
+
+
+def _representation(request):
+    # The browsable API and JSON renderings of a resource need different tags
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer.format if renderer else 'json'
+
+
+@_memoize_on_request('_catalogue_state')
+def catalogue_state(request, *args, **kwargs):
+    """
+    (tag, last_modified) for the whole catalogue. Falls back to one aggregate
+    over Bus.updated_at when the cache is unavailable.
+    """
+    version = get_catalogue_version()
+    if version is not None:
+        stamp = catalogue_version_time(version)
+        if stamp is not None and time.time() - stamp <= settings.PRIMARY_PIN_SECONDS:
+            # A replica may not have the change behind a new version yet, and
+            # clients would keep its old rows under the new tag
+            pin_to_primary()
+        modified = datetime.fromtimestamp(stamp, tz=timezone.utc) if stamp is not None else None
+        return version, modified
+    state = Bus.objects.aggregate(modified=Max('updated_at'), count=Count('id'))
+    modified = state['modified']
+    return f"{state['count']}.{modified.timestamp() if modified else 0}", modified
+
+
+@_memoize_on_request('_bus_state')
+def bus_state(request, pk, *args, **kwargs):
+    modified = Bus.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    if modified is None:
+        return None, None
+    return f'{pk}.{modified.timestamp()}', modified
+
+
+def catalogue_etag(request, *args, **kwargs):
+    tag, _ = catalogue_state(request)
+    return f'{tag}.{_representation(request)}'
+
+
+def catalogue_last_modified(request, *args, **kwargs):
+    return catalogue_state(request)[1]
+
+
+def bus_etag(request, pk, *args, **kwargs):
+    tag, _ = bus_state(request, pk)
+    return f'{tag}.{_representation(request)}' if tag else None
+
+
+def bus_last_modified(request, pk, *args, **kwargs):
+    return bus_state(request, pk)[1]
+
+
+def search_etag(request, *args, **kwargs):
+    # Seat availability for a date changes with every booking, so only the
+    # date-less search is served conditionally.
+    if request.GET.get('date'):
+        return None
+    return catalogue_etag(request)
+
+
+def search_last_modified(request, *args, **kwargs):
+    if request.GET.get('date'):
+        return None
+    return catalogue_last_modified(request)
+
+
+def conditional(etag_func, last_modified_func):
+    """
+    condition() plus Cache-Control: no-cache, so clients keep the response
+    but revalidate it every time instead of guessing a freshness lifetime
+    from Last-Modified. Apply it below @api_view, or to APIView methods with
+    method_decorator, so it runs after authentication.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func, last_modified_func)(view)
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD') and response.has_header('ETag'):
+                patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,148 @@
+"""
+Booking confirmation emails. A completed booking whose confirmation_sent_at
+is empty is queued; send_confirmations() claims a batch of them, renders
+each from the compiled template and sends them all over one SMTP
+connection. Recipient domains are rate limited across workers through the
+cache, and failed messages are retried with exponential backoff.
+"""
+import logging
+import smtplib
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.html import strip_tags
+from . import metrics
+from .models import Booking
+
+logger = logging.getLogger(__name__)
+
+CONFIRMATION_TEMPLATE = 'booking/emails/booking_confirmation.html'
+
+# Errors after which the SMTP connection cannot be trusted for the next message
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, OSError)
+
+
+def queued_confirmations(now):
+    return Booking.objects.filter(
+        payment_status='completed',
+        confirmation_sent_at=None,
+        confirmation_attempts__lt=settings.EMAIL_MAX_ATTEMPTS,
+    ).filter(Q(confirmation_next_attempt_at=None) | Q(confirmation_next_attempt_at__lte=now))
+
+
+def claim_batch(batch_size, now):
+    """
+    Lease up to batch_size queued bookings to this worker by pushing their
+    next attempt time EMAIL_CLAIM_TIMEOUT seconds ahead, so the rows are
+    not locked while mail is sent. A worker that dies mid-batch leaves the
+    lease to run out and the emails are picked up again.
+    """
+    with transaction.atomic():
+        ids = list(
+            queued_confirmations(now).order_by('id')
+            .select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size]
+        )
+        Booking.objects.filter(id__in=ids).update(
+            confirmation_next_attempt_at=now + timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT)
+        )
+    return list(Booking.objects.filter(id__in=ids).select_related('bus').order_by('id'))
+
+
+def domain_allows(email, now):
+    """Count one message against its domain's per-minute limit; False when over it."""
+    domain = email.rpartition('@')[2].lower()
+    key = f"email_rate:{domain}:{now.strftime('%Y%m%d%H%M')}"
+    try:
+        cache.add(key, 0, timeout=60)
+        return cache.incr(key) <= settings.EMAIL_DOMAIN_RATE_LIMIT
+    except Exception as e:
+        logger.warning('Email rate limiter unavailable, not limiting: %s', e)
+        return True
+
+
+def build_message(booking, template, connection=None):
+    html_message = template.render({'booking': booking})
+    message = EmailMultiAlternatives(
+        f'Booking Confirmation - {booking.booking_reference}',
+        strip_tags(html_message),
+        settings.DEFAULT_FROM_EMAIL,
+        [booking.passenger_email],
+        connection=connection,
+    )
+    message.attach_alternative(html_message, 'text/html')
+    return message
+
+
+def send_confirmations(batch_size=None):
+    """Send one batch of queued confirmations. Returns (sent, deferred, failed)."""
+    now = timezone.now()
+    bookings = claim_batch(batch_size or settings.EMAIL_BATCH_SIZE, now)
+    if not bookings:
+        return 0, 0, 0
+
+    template = get_template(CONFIRMATION_TEMPLATE)
+    sent, deferred, failed = [], [], []
+    connection = get_connection()
+    try:
+        with metrics.timed('smtp', 'connect'):
+            connection.open()
+        for booking in bookings:
+            if not domain_allows(booking.passenger_email, now):
+                deferred.append(booking.id)
+                continue
+            try:
+                message = build_message(booking, template, connection)
+                with metrics.timed('smtp', 'send'):
+                    connection.send_messages([message])
+            except Exception as e:
+                logger.warning('Confirmation email for %s failed: %s', booking.booking_reference, e)
+                failed.append(booking.id)
+                if isinstance(e, CONNECTION_ERRORS):
+                    connection.close()
+                    connection.open()
+            else:
+                sent.append(booking.id)
+    except CONNECTION_ERRORS as e:
+        # Could not (re)connect: retry everything not sent yet
+        logger.warning('SMTP connection failed: %s', e)
+        done = set(sent) | set(deferred) | set(failed)
+        failed.extend(booking.id for booking in bookings if booking.id not in done)
+    finally:
+        connection.close()
+
+    record_results(sent, deferred, failed, timezone.now())
+    return len(sent), len(deferred), len(failed)
+
+
+def record_results(sent, deferred, failed, now):
+    Booking.objects.filter(id__in=sent).update(confirmation_sent_at=now, confirmation_next_attempt_at=None)
+    # Over the domain's rate limit: try again once the window has passed,
+    # without counting it as a failed attempt
+    Booking.objects.filter(id__in=deferred).update(
+        confirmation_next_attempt_at=now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    )
+    # Group failures by attempt number so each group's backoff is one UPDATE
+    attempts = Booking.objects.filter(id__in=failed).values_list('id', 'confirmation_attempts')
+    by_attempt = {}
+    for booking_id, attempt in attempts:
+        by_attempt.setdefault(attempt, []).append(booking_id)
+    for attempt, ids in by_attempt.items():
+        Booking.objects.filter(id__in=ids).update(
+            confirmation_attempts=F('confirmation_attempts') + 1,
+            confirmation_next_attempt_at=now + timedelta(seconds=settings.EMAIL_RETRY_BACKOFF * 2 ** attempt),
+        )
+
+
+def queue_confirmation_emails():
+    """Ask a worker to send queued confirmations soon; beat covers a missed request."""
+    from .tasks import send_confirmation_emails
+    try:
+        if cache.add('confirmation_emails:kick', 1, timeout=1):
+            send_confirmation_emails.delay()
+    except Exception as e:
+        logger.warning('Could not queue confirmation emails: %s', e)
@@ -0,0 +1,210 @@
+"""
+An in-memory stand-in for the parts of the Razorpay API this app uses, for
+tests and offline development. FakeRazorpayClient is a real razorpay.Client
+whose HTTP session is answered by a FakeGateway, and async_transport() does
+the same for the async views' httpx client, so timeouts, retries and error
+handling run the same code as in production. `manage.py
+fake_razorpay` serves the same gateway over HTTP; point RAZORPAY_BASE_URL
+at it.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import razorpay
+import requests
+from urllib.parse import urlsplit
+from django.conf import settings
+
+ORDERS_PATH = '/v1/orders'
+
+
+def _new_id(prefix):
+    return f'{prefix}_{uuid.uuid4().hex[:14]}'
+
+
+class FakeGateway:
+    """
+    Orders live in a dict. `fail_next` makes the next N calls fail with a
+    connection error and `latency` delays every call, to exercise timeouts,
+    retries and the circuit breaker.
+    """
+
+    def __init__(self, key_secret=None, latency=0):
+        self.key_secret = key_secret or settings.RAZORPAY_KEY_SECRET
+        self.latency = latency
+        self.fail_next = 0
+        self.calls = 0
+        self.orders = {}
+        self._lock = threading.Lock()
+
+    def should_fail(self):
+        with self._lock:
+            self.calls += 1
+            if self.fail_next:
+                self.fail_next -= 1
+                return True
+            return False
+
+    def handle(self, method, path, body=None):
+        """Return (status, payload) for an API call, after `latency` seconds."""
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(method, path, body)
+
+    def respond(self, method, path, body=None):
+        if method == 'post' and path == ORDERS_PATH:
+            return 200, self.create_order(body or {})
+        if method == 'get' and path.startswith(ORDERS_PATH + '/'):
+            order = self.orders.get(path[len(ORDERS_PATH) + 1:])
+            if order:
+                return 200, order
+        return 400, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': f'No route for {method.upper()} {path}'}}
+
+    def create_order(self, data):
+        if not isinstance(data.get('amount'), int) or data['amount'] < 100:
+            return {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'The amount must be at least INR 1.00'}}
+        order = {
+            'id': _new_id('order'),
+            'entity': 'order',
+            'amount': data['amount'],
+            'currency': data.get('currency', 'INR'),
+            'receipt': data.get('receipt'),
+            'status': 'created',
+            'created_at': int(time.time()),
+        }
+        with self._lock:
+            self.orders[order['id']] = order
+        return order
+
+    def pay(self, order_id):
+        """Simulate a completed checkout: the signed fields Razorpay posts back."""
+        payment_id = _new_id('pay')
+        signature = hmac.new(
+            self.key_secret.encode(), f'{order_id}|{payment_id}'.encode(), hashlib.sha256
+        ).hexdigest()
+        with self._lock:
+            self.orders[order_id]['status'] = 'paid'
+        return {
+            'razorpay_order_id': order_id,
+            'razorpay_payment_id': payment_id,
+            'razorpay_signature': signature,
+        }
+
+    def webhook(self, event, order_id, payment_id, secret=None):
+        """Body and headers of a webhook delivery for a payment, signed with secret."""
+        body = json.dumps({
+            'entity': 'event',
+            'event': event,
+            'payload': {'payment': {'entity': {
+                'id': payment_id, 'entity': 'payment', 'order_id': order_id,
+                'status': 'captured' if event != 'payment.failed' else 'failed',
+            }}},
+            'created_at': int(time.time()),
+        }).encode()
+        secret = secret or settings.RAZORPAY_WEBHOOK_SECRET
+        return body, {
+            'HTTP_X_RAZORPAY_SIGNATURE': hmac.new(secret.encode(), body, hashlib.sha256).hexdigest(),
+            'HTTP_X_RAZORPAY_EVENT_ID': _new_id('evt'),
+        }
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """Just enough of requests.Session for razorpay.Client.request()."""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def _send(self, method, url, data=None, timeout=None, **kwargs):
+        if self.gateway.should_fail():
+            raise requests.ConnectionError('Fake gateway connection failure')
+        if timeout is not None and self.gateway.latency > timeout:
+            raise requests.Timeout(f'Fake gateway did not answer within {timeout}s')
+        body = json.loads(data) if isinstance(data, str) else data
+        status, payload = self.gateway.handle(method, urlsplit(url).path, body)
+        if 'error' in payload:
+            status = 400
+        return FakeResponse(status, payload)
+
+    def get(self, url, **kwargs):
+        return self._send('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._send('post', url, **kwargs)
+
+
+class FakeRazorpayClient(razorpay.Client):
+    def __init__(self, gateway=None):
+        self.gateway = gateway or FakeGateway()
+        super().__init__(
+            session=FakeSession(self.gateway),
+            auth=(settings.RAZORPAY_KEY_ID, self.gateway.key_secret),
+        )
+
+
+def async_transport(gateway):
+    """An httpx transport answered by gateway, for payments.async_transport."""
+    async def handle(request):
+        if gateway.should_fail():
+            raise httpx.ConnectError('Fake gateway connection failure', request=request)
+        timeout = request.extensions.get('timeout', {}).get('read')
+        if timeout is not None and gateway.latency > timeout:
+            await asyncio.sleep(timeout)
+            raise httpx.ReadTimeout(f'Fake gateway did not answer within {timeout}s', request=request)
+        if gateway.latency:
+            await asyncio.sleep(gateway.latency)
+        body = json.loads(request.content) if request.content else None
+        status, payload = gateway.respond(request.method.lower(), request.url.path, body)
+        return httpx.Response(400 if 'error' in payload else status, json=payload)
+    return httpx.MockTransport(handle)
+
+
+def gateway_server(gateway, host='127.0.0.1', port=0, log=None):
+    """
+    A ThreadingHTTPServer answering Razorpay API calls from gateway. POST
+    /v1/orders/<order_id>/pay returns the signed fields to post to the
+    payment success page. Call serve_forever() to run it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def answer(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self.answer(*gateway.handle('get', self.path))
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if self.path.startswith(ORDERS_PATH + '/') and self.path.endswith('/pay'):
+                order_id = self.path[len(ORDERS_PATH) + 1:-len('/pay')]
+                if order_id in gateway.orders:
+                    return self.answer(200, gateway.pay(order_id))
+            status, payload = gateway.handle('post', self.path, body)
+            self.answer(400 if 'error' in payload else status, payload)
+
+        def log_message(self, format, *args):
+            if log:
+                log(format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,122 @@
+"""
+Bulk import of buses from CSV or NDJSON, as a pipeline of generators so a
+file of any size is read, validated and written a batch at a time:
+
+    read_rows() -> validate_rows() -> batched() -> upsert_buses()
+
+Rows are keyed by bus_number: an existing bus with the same number is
+updated in place, anything else is inserted. A row that fails validation is
+reported with its line number and skipped; the rest of the file carries on.
+"""
+import csv
+import json
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from .inventory import sync_seats_total
+from .models import Bus
+
+IMPORT_FIELDS = [
+    'bus_number', 'bus_name', 'source', 'destination', 'total_seats', 'price',
+    'departure_time', 'arrival_time', 'journey_duration',
+]
+UPDATE_FIELDS = [name for name in IMPORT_FIELDS if name != 'bus_number'] + ['updated_at']
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+class RowError(Exception):
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def read_rows(f, format):
+    """Yield (line number, dict) for every record in an open text file."""
+    if format == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, text in enumerate(f, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            yield line, RowError(line, f'invalid JSON: {e}')
+            continue
+        if not isinstance(row, dict):
+            row = RowError(line, 'expected a JSON object')
+        yield line, row
+
+
+def validate_rows(rows):
+    """
+    Turn rows into unsaved Bus objects, or RowErrors for rows that do not
+    validate. Uniqueness is left to the upsert, which would otherwise cost
+    a query per row.
+    """
+    for line, row in rows:
+        if isinstance(row, RowError):
+            yield row
+            continue
+        values = {name: row.get(name) for name in IMPORT_FIELDS}
+        for name, value in values.items():
+            if isinstance(value, str):
+                values[name] = value.strip()
+        bus = Bus(**values)
+        try:
+            bus.full_clean(exclude=['updated_at'], validate_unique=False, validate_constraints=False)
+        except ValidationError as e:
+            yield RowError(line, '; '.join(f'{field}: {" ".join(messages)}' for field, messages in e.message_dict.items()))
+            continue
+        bus.line = line
+        yield bus
+
+
+def batched(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def upsert_buses(buses):
+    """
+    Insert or update one batch of buses with a single statement. Returns how
+    many rows were written: a bus_number repeated within the batch counts
+    once, the last row winning, since one INSERT ... ON CONFLICT cannot
+    touch the same row twice. Departures of updated buses from today on
+    take the new seat count.
+    """
+    by_number = {bus.bus_number: bus for bus in buses}
+    with transaction.atomic():
+        Bus.objects.bulk_create(
+            list(by_number.values()),
+            update_conflicts=True,
+            unique_fields=['bus_number'],
+            update_fields=UPDATE_FIELDS,
+        )
+        # bulk_create sends no post_save, so the inventory is synced here
+        sync_seats_total(Bus.objects.filter(bus_number__in=list(by_number)).values('pk'))
+    return len(by_number)
+
+
+def import_buses(f, format, batch_size=1000, dry_run=False):
+    """
+    Import every row of an open file. Yields, per batch, (rows written,
+    RowErrors); a batch the database rejects is reported as errors for all
+    of its rows and the import moves on to the next one.
+    """
+    for batch in batched(validate_rows(read_rows(f, format)), batch_size):
+        buses = [item for item in batch if isinstance(item, Bus)]
+        errors = [item for item in batch if isinstance(item, RowError)]
+        written = 0
+        if buses and not dry_run:
+            try:
+                written = upsert_buses(buses)
+            except DatabaseError as e:
+                errors.extend(RowError(bus.line, f'not saved, batch failed: {e}') for bus in buses)
+        elif dry_run:
+            written = len(buses)
+        yield written, errors
@@ -0,0 +1,197 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+from .cache import availability_cache
+from .models import Booking, Bus, SeatInventory
+from .seatmap import SeatsUnavailable, release_seats
+
+# Which inventory column a booking's seats count against, by payment status.
+# Failed and cancelled bookings do not take seats.
+STATUS_COLUMNS = {
+    'pending': 'seats_held',
+    'completed': 'seats_sold',
+}
+
+
+def get_seat_counts(buses, date):
+    """
+    Return {bus_id: (seats_total, seats_held, seats_sold)} for the given
+    buses on a date, from the availability cache where possible and with a
+    single inventory query for the rest.
+    """
+    keys = {availability_cache.key(bus.id, date): bus for bus in buses}
+    counts = {keys[key].id: value for key, value in availability_cache.get_many(keys).items()}
+
+    missing = [bus for bus in keys.values() if bus.id not in counts]
+    if missing:
+        fresh = {bus.id: (bus.total_seats, 0, 0) for bus in missing}
+        db = router.db_for_read(SeatInventory)
+        rows = SeatInventory.objects.using(db).filter(bus__in=missing, date=date).values_list(
+            'bus_id', 'seats_total', 'seats_held', 'seats_sold'
+        )
+        for bus_id, *row in rows:
+            fresh[bus_id] = tuple(row)
+        # Counts from a replica can predate a change whose invalidation already
+        # ran, so they are only cached for as long as a replica may lag.
+        availability_cache.set_many({
+            availability_cache.key(bus_id, date): value for bus_id, value in fresh.items()
+        }, timeout=None if db == DEFAULT_DB_ALIAS else max(1, int(settings.REPLICA_MAX_LAG)))
+        counts.update(fresh)
+    return counts
+
+
+def get_available_seats_many(buses, date, include_held=False):
+    available = {}
+    for bus_id, (total, held, sold) in get_seat_counts(buses, date).items():
+        available[bus_id] = total - sold - (held if include_held else 0)
+    return available
+
+
+def get_available_seats(bus, date, include_held=False):
+    return get_available_seats_many([bus], date, include_held)[bus.id]
+
+
+def invalidate_availability(bus_id, date):
+    # Only drop the cached counts once the change is visible to other
+    # connections, otherwise a concurrent reader could re-cache old counts.
+    transaction.on_commit(lambda: availability_cache.delete(availability_cache.key(bus_id, date)))
+
+
+def adjust_inventory(bus, date, seats_held=0, seats_sold=0):
+    """
+    Atomically add the given deltas to the (bus, date) inventory row. When
+    they take seats, the UPDATE only matches while enough are left and
+    SeatsUnavailable is raised otherwise, so concurrent bookings can never
+    oversell a departure: the database checks and applies each one in a
+    single statement, against the latest committed counts.
+    """
+    updates = {}
+    if seats_held:
+        updates['seats_held'] = F('seats_held') + seats_held
+    if seats_sold:
+        updates['seats_sold'] = F('seats_sold') + seats_sold
+    if not updates:
+        return
+    rows = SeatInventory.objects.filter(bus=bus, date=date)
+    taken = seats_held + seats_sold
+    if taken > 0:
+        rows = rows.filter(seats_total__gte=F('seats_held') + F('seats_sold') + taken)
+
+    # No savepoint of its own: callers already wrap the booking write and
+    # this update in one transaction, and a failure here must undo both.
+    with transaction.atomic(savepoint=False):
+        if not rows.update(**updates):
+            SeatInventory.objects.get_or_create(
+                bus=bus, date=date, defaults={'seats_total': bus.total_seats}
+            )
+            if not rows.update(**updates):
+                available = SeatInventory.objects.filter(bus=bus, date=date).values_list(
+                    F('seats_total') - F('seats_held') - F('seats_sold'), flat=True
+                ).first()
+                raise SeatsUnavailable(f'Only {max(available or 0, 0)} seats available')
+        invalidate_availability(bus.id, date)
+
+
+def apply_booking_change(booking, old_status=None, old_seats=0, old_departure=None):
+    """
+    Move a booking's seats in the inventory from its previous state
+    (old_status, old_seats, and the (bus, date) old_departure if it moved)
+    to its current one. A new booking has no previous state. Raises
+    SeatsUnavailable if the departure it is on now cannot take its seats.
+    """
+    departures = {(booking.bus_id, booking.booking_date): booking.bus}
+    old_key = (booking.bus_id, booking.booking_date)
+    if old_departure:
+        old_bus, old_date = old_departure
+        old_key = (old_bus.id, old_date)
+        departures[old_key] = old_bus
+    deltas = defaultdict(lambda: defaultdict(int))
+    if old_status in STATUS_COLUMNS:
+        deltas[old_key][STATUS_COLUMNS[old_status]] -= old_seats
+    if booking.payment_status in STATUS_COLUMNS:
+        deltas[booking.bus_id, booking.booking_date][STATUS_COLUMNS[booking.payment_status]] += booking.seats_booked
+    # In key order, so two bookings moving between the same two departures
+    # lock their rows in the same order
+    for key in sorted(deltas):
+        adjust_inventory(departures[key], key[1], **deltas[key])
+    if old_status in STATUS_COLUMNS and booking.payment_status not in STATUS_COLUMNS:
+        release_seats(booking.bus_id, booking.booking_date, booking.seat_numbers)
+    elif old_status and booking.seat_numbers and booking.payment_status in STATUS_COLUMNS \
+            and old_status not in STATUS_COLUMNS:
+        # Paid after its hold expired: its seats may have gone to someone
+        # else meanwhile, so it keeps a seat count but no seat numbers
+        booking.seat_numbers = []
+        Booking.objects.filter(pk=booking.pk).update(seat_numbers=[])
+
+
+def release_booking(booking):
+    """Give back the seats of a booking that is about to be deleted."""
+    column = STATUS_COLUMNS.get(booking.payment_status)
+    if column:
+        adjust_inventory(booking.bus, booking.booking_date, **{column: -booking.seats_booked})
+        release_seats(booking.bus_id, booking.booking_date, booking.seat_numbers)
+
+
+def release_held_seats(held):
+    """Subtract {(bus_id, date): seats} from seats_held, one UPDATE per departure."""
+    for (bus_id, date), seats in held.items():
+        SeatInventory.objects.filter(bus_id=bus_id, date=date).update(seats_held=F('seats_held') - seats)
+        invalidate_availability(bus_id, date)
+
+
+def sync_seats_total(bus_ids):
+    """
+    Copy each bus's total_seats onto its inventory rows from today on, after
+    the seat count of the bus changed. Past departures keep the count they
+    ran with; a bus cut below the seats already taken just stops taking
+    bookings on those departures.
+    """
+    rows = list(
+        SeatInventory.objects.filter(bus_id__in=bus_ids, date__gte=timezone.localdate())
+        .exclude(seats_total=F('bus__total_seats'))
+        .values_list('id', 'bus_id', 'date')
+    )
+    SeatInventory.objects.filter(id__in=[row[0] for row in rows]).update(seats_total=Subquery(
+        Bus.objects.filter(pk=OuterRef('bus_id')).values('total_seats')[:1]
+    ))
+    for _, bus_id, date in rows:
+        invalidate_availability(bus_id, date)
+    return len(rows)
+
+
+def expire_holds(batch_size=1000, now=None):
+    """
+    Move pending bookings whose hold has run out to 'expired' and give their
+    seats back, batch_size rows per transaction so no lock is held for long.
+    Rows locked by a concurrent payment or modification are skipped and
+    picked up by a later run. Returns the number of bookings expired.
+    """
+    now = now or timezone.now()
+    expired = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Booking.objects.filter(payment_status='pending', hold_expires_at__lte=now)
+                .order_by('hold_expires_at')
+                .select_for_update(skip_locked=True)
+                .values_list('id', 'bus_id', 'booking_date', 'seats_booked', 'seat_numbers')[:batch_size]
+            )
+            if not rows:
+                break
+            held = defaultdict(int)
+            seat_numbers = defaultdict(list)
+            for _, bus_id, booking_date, seats, numbers in rows:
+                held[bus_id, booking_date] += seats
+                seat_numbers[bus_id, booking_date].extend(numbers)
+            Booking.objects.filter(id__in=[row[0] for row in rows]).update(
+                payment_status='expired', modified_at=now
+            )
+            release_held_seats(held)
+            for (bus_id, booking_date), numbers in seat_numbers.items():
+                release_seats(bus_id, booking_date, numbers)
+        expired += len(rows)
+        if len(rows) < batch_size:
+            break
+    return expired
@@ -0,0 +1,292 @@
+"""
+Journey planner: itineraries of up to three buses (two transfers) between
+two cities, over an in-memory timetable built from the Bus table.
+
+Every bus runs daily, so the timetable is one list per (source,
+destination) pair of departure minutes sorted by time, with the earliest
+arrival from each position onwards precomputed. Finding the earliest
+arrival on a pair from a given moment is then one bisect, whatever order
+fast and slow buses leave in. A search works in rounds, one per leg (as in
+RAPTOR): each round extends the cities reached in the previous one by one
+bus, keeping a city only when it is reached earlier than with fewer legs
+and earlier than the destination already is. Over a few hundred cities
+that is a few thousand bisects per search, independent of the number of
+buses. To offer several departures, the search is repeated from just after
+the first departure it found.
+
+The timetable is rebuilt when the shared catalogue version changes, by
+reloading only the buses saved since the last build, and at least every
+ROUTE_INDEX_MAX_AGE seconds when the cache is unavailable.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from .cache import get_catalogue_version
+from .inventory import get_available_seats_many
+from .models import Bus
+from .routes import normalize_city
+
+DAY = 24 * 60
+# Longest change of buses a search may ask for, and how long after the
+# search starts its last bus may leave (minutes)
+MAX_LAYOVER = DAY
+HORIZON = 4 * DAY
+FIELDS = (
+    'id', 'bus_number', 'bus_name', 'source', 'destination', 'total_seats', 'price',
+    'departure_time', 'arrival_time', 'journey_duration', 'updated_at',
+)
+DURATION = re.compile(r'^\s*(\d+)\s*hours?(?:\s+(\d+)\s*minutes?)?\s*$', re.IGNORECASE)
+# Buses saved up to this long before the last build started are reloaded
+# too, in case their transaction committed after it
+LOOKBACK = timedelta(minutes=1)
+
+
+def duration_minutes(departure, arrival, journey_duration):
+    """
+    Minutes from departure to arrival. The clock times give it modulo a day;
+    journey_duration ("26 hours 30 minutes") says how many days to add.
+    """
+    clock = (arrival.hour * 60 + arrival.minute - departure.hour * 60 - departure.minute) % DAY or DAY
+    match = DURATION.match(journey_duration or '')
+    if match:
+        stated = int(match[1]) * 60 + int(match[2] or 0)
+        if stated > DAY and stated % DAY == clock % DAY:
+            return stated
+    return clock
+
+
+class Route:
+    """The buses from one city to another, by departure minute of the day."""
+
+    __slots__ = ('departures', 'arrivals', 'bus_ids', 'best')
+
+    def __init__(self, buses):
+        buses = sorted(buses, key=lambda bus: (bus[0], bus[1], bus[2]))
+        self.departures = [departure for departure, _, _ in buses]
+        self.arrivals = [departure + duration for departure, duration, _ in buses]
+        self.bus_ids = [bus_id for _, _, bus_id in buses]
+        # best[i]: the bus arriving first among those leaving at or after
+        # departures[i]
+        self.best = [0] * len(buses)
+        for i in range(len(buses) - 1, -1, -1):
+            if i == len(buses) - 1 or self.arrivals[i] < self.arrivals[self.best[i + 1]]:
+                self.best[i] = i
+            else:
+                self.best[i] = self.best[i + 1]
+
+    def earliest(self, ready, same_day=False):
+        """
+        (arrival, departure, bus id) of the bus reaching the destination
+        first among those leaving at or after minute `ready` (counted from
+        midnight of the search date), or None. With same_day, only buses
+        leaving on the day `ready` falls in.
+        """
+        day, minute = divmod(ready, DAY)
+        i = bisect_left(self.departures, minute)
+        found = None
+        if i < len(self.best):
+            j = self.best[i]
+            found = (day * DAY + self.arrivals[j], day * DAY + self.departures[j], self.bus_ids[j])
+        if not same_day:
+            # Tomorrow's fastest bus can still beat a slow one today
+            j = self.best[0]
+            arrival = (day + 1) * DAY + self.arrivals[j]
+            if found is None or arrival < found[0]:
+                found = (arrival, (day + 1) * DAY + self.departures[j], self.bus_ids[j])
+        return found
+
+
+class ConnectionIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {bus id: (source key, destination key, departure, duration, row)}
+        self._buses = {}
+        # {source key: {destination key: Route}}
+        self._routes = {}
+        self._version = None
+        self._built_at = None
+        self._loaded_until = None
+
+    def invalidate(self):
+        # The next search rebuilds the whole timetable
+        self._built_at = None
+        self._loaded_until = None
+
+    def _is_stale(self, version):
+        if self._built_at is None:
+            return True
+        if version is None:
+            return time.monotonic() - self._built_at > settings.ROUTE_INDEX_MAX_AGE
+        return version != self._version
+
+    @staticmethod
+    def _entry(row):
+        departure, arrival = row['departure_time'], row['arrival_time']
+        return (
+            normalize_city(row['source']), normalize_city(row['destination']),
+            departure.hour * 60 + departure.minute,
+            duration_minutes(departure, arrival, row['journey_duration']),
+            row,
+        )
+
+    def refresh(self, version=None):
+        # From the primary: the index is kept until the catalogue version changes
+        buses = Bus.objects.using(DEFAULT_DB_ALIAS).order_by()
+        started = timezone.now()
+        with self._lock:
+            current, routes, loaded_until = self._buses, self._routes, self._loaded_until
+        changed = None
+        if loaded_until is not None:
+            rows = list(buses.filter(updated_at__gte=loaded_until - LOOKBACK).values(*FIELDS))
+            merged = {**current, **{row['id']: self._entry(row) for row in rows}}
+            # New buses are among the changed rows, so a count that does not
+            # match means some were deleted: rebuild everything
+            if len(merged) == buses.count():
+                changed = {(current[row['id']][0], current[row['id']][1]) for row in rows if row['id'] in current}
+                changed |= {(merged[row['id']][0], merged[row['id']][1]) for row in rows}
+        if changed is None:
+            rows = list(buses.values(*FIELDS))
+            merged = {row['id']: self._entry(row) for row in rows}
+            changed = {(source, destination) for source, destination, *_ in merged.values()}
+            routes = {}
+
+        by_pair = {pair: [] for pair in changed}
+        for bus_id, (source, destination, departure, duration, _) in merged.items():
+            if (source, destination) in by_pair:
+                by_pair[source, destination].append((departure, duration, bus_id))
+        routes = {source: dict(destinations) for source, destinations in routes.items()}
+        for (source, destination), pair_buses in by_pair.items():
+            if pair_buses:
+                routes.setdefault(source, {})[destination] = Route(pair_buses)
+            else:
+                routes.get(source, {}).pop(destination, None)
+
+        with self._lock:
+            self._buses, self._routes = merged, routes
+            self._loaded_until = started
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def _search(self, routes, origin, destination, start, max_legs, min_layover):
+        """
+        The earliest-arriving journey for each number of legs up to
+        max_legs, keeping only those that arrive earlier than any with
+        fewer legs and whose buses all leave within HORIZON of start. Each
+        is a list of (departure, arrival, bus id) legs.
+        """
+        best = {origin: start}
+        reached = {origin: None}
+        labels = []
+        journeys = []
+        for leg in range(max_legs):
+            labels.append({})
+            target = best.get(destination, float('inf'))
+            for city in reached:
+                ready = start if leg == 0 else labels[leg - 1][city][0] + min_layover
+                for next_city, route in routes.get(city, {}).items():
+                    if next_city == origin:
+                        continue
+                    found = route.earliest(ready, same_day=leg == 0)
+                    if found is None or found[1] > start + HORIZON or found[0] >= target \
+                            or found[0] >= best.get(next_city, float('inf')):
+                        continue
+                    label = labels[leg].get(next_city)
+                    if label is None or found[0] < label[0]:
+                        labels[leg][next_city] = found + (city,)
+            if not labels[leg]:
+                break
+            for city, label in labels[leg].items():
+                best[city] = min(best.get(city, float('inf')), label[0])
+            if destination in labels[leg]:
+                legs, city = [], destination
+                for back in range(leg, -1, -1):
+                    arrival, departure, bus_id, city = labels[back][city]
+                    legs.append((departure, arrival, bus_id))
+                journeys.append(legs[::-1])
+            reached = {city: None for city in labels[leg] if city != destination}
+        return journeys
+
+    def plan(self, source, destination, date, after=0, max_transfers=2, min_layover=None, limit=5):
+        """
+        Up to `limit` itineraries from source to destination leaving on
+        `date` no earlier than minute `after` of the day, ordered by
+        departure. Each is a dict with the departure and arrival datetimes,
+        transfers and its legs, each leg with its bus, date and the seats
+        still available on it.
+        """
+        version = get_catalogue_version()
+        if self._is_stale(version):
+            self.refresh(version)
+        if min_layover is None:
+            min_layover = settings.JOURNEY_MIN_LAYOVER
+        origin, target = normalize_city(source), normalize_city(destination)
+        with self._lock:
+            buses, routes = self._buses, self._routes
+        if origin == target or origin not in routes:
+            return []
+
+        found, seen = [], set()
+        while after < DAY and len(found) < limit:
+            journeys = self._search(routes, origin, target, after, max_transfers + 1, min_layover)
+            if not journeys:
+                break
+            for legs in journeys:
+                key = tuple(legs)
+                if key not in seen:
+                    seen.add(key)
+                    found.append(legs)
+            after = min(legs[0][0] for legs in journeys) + 1
+        found.sort(key=lambda legs: (legs[0][0], legs[-1][1], len(legs)))
+        return self._describe(found[:limit], buses, date)
+
+    def _describe(self, journeys, buses, date):
+        midnight = datetime.combine(date, datetime.min.time())
+        # Seats on each leg's bus on the day that leg leaves, one lookup per day
+        days = {}
+        for legs in journeys:
+            for departure, _, bus_id in legs:
+                days.setdefault(departure // DAY, set()).add(bus_id)
+        available = {}
+        for day, bus_ids in days.items():
+            day_buses = [Bus(id=bus_id, total_seats=buses[bus_id][4]['total_seats']) for bus_id in bus_ids]
+            counts = get_available_seats_many(day_buses, date + timedelta(days=day), include_held=True)
+            available.update({(day, bus_id): seats for bus_id, seats in counts.items()})
+
+        results = []
+        for legs in journeys:
+            described = []
+            previous_arrival = None
+            for departure, arrival, bus_id in legs:
+                row = buses[bus_id][4]
+                described.append({
+                    'bus': bus_id,
+                    'bus_number': row['bus_number'],
+                    'bus_name': row['bus_name'],
+                    'source': row['source'],
+                    'destination': row['destination'],
+                    'date': (date + timedelta(days=departure // DAY)).isoformat(),
+                    'departure': (midnight + timedelta(minutes=departure)).isoformat(),
+                    'arrival': (midnight + timedelta(minutes=arrival)).isoformat(),
+                    'layover_minutes': None if previous_arrival is None else departure - previous_arrival,
+                    'price': str(row['price']),
+                    'available_seats': available[departure // DAY, bus_id],
+                })
+                previous_arrival = arrival
+            results.append({
+                'departure': described[0]['departure'],
+                'arrival': described[-1]['arrival'],
+                'duration_minutes': legs[-1][1] - legs[0][0],
+                'transfers': len(legs) - 1,
+                'total_price': str(sum(buses[bus_id][4]['price'] for _, _, bus_id in legs)),
+                'available_seats': min(leg['available_seats'] for leg in described),
+                'legs': described,
+            })
+        return results
+
+
+connection_index = ConnectionIndex()
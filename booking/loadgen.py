@@ -0,0 +1,128 @@
+"""
+Helpers for the benchmark commands that run the app under a real HTTP
+server: start gunicorn or uvicorn on a free port, fire concurrent requests
+at it with httpx, and summarise throughput and latency.
+"""
+import asyncio
+import re
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+import httpx
+from django.conf import settings
+from django.core.management.base import CommandError
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def gunicorn(port, workers=2, threads=4):
+    return [
+        sys.executable, '-m', 'gunicorn', 'bus_booking.wsgi:application', '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers), '--threads', str(threads), '--worker-class', 'gthread', '--log-level', 'warning',
+    ]
+
+
+def uvicorn(port, workers=2):
+    return [
+        sys.executable, '-m', 'uvicorn', 'bus_booking.asgi:application', '--host', '127.0.0.1',
+        '--port', str(port), '--workers', str(workers), '--log-level', 'warning',
+    ]
+
+
+@contextmanager
+def running_server(command, port, env=None, timeout=30):
+    """Run a server command from the project directory until the block exits."""
+    process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise CommandError(f'Server exited with status {process.returncode}')
+            try:
+                httpx.get(f'http://127.0.0.1:{port}/api/async/buses/0/', timeout=1)
+                break
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise CommandError('Server did not start')
+                time.sleep(0.2)
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        process.terminate()
+        process.wait()
+
+
+class Result:
+    def __init__(self, statuses, latencies, elapsed):
+        self.statuses = statuses
+        self.latencies = sorted(latencies)
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return sum(1 for status in self.statuses if status is not None and status < 400)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        return self.latencies[min(len(self.latencies) - 1, int(len(self.latencies) * p))]
+
+    def as_dict(self):
+        return {
+            'requests': len(self.statuses),
+            'failed': len(self.statuses) - self.ok,
+            'rps': round(self.ok / self.elapsed, 2) if self.elapsed else 0.0,
+            'p50_ms': round(self.percentile(0.5) * 1000, 2),
+            'p95_ms': round(self.percentile(0.95) * 1000, 2),
+            'p99_ms': round(self.percentile(0.99) * 1000, 2),
+        }
+
+    def __str__(self):
+        return (
+            f'{self.ok / self.elapsed:,.1f} req/s, p50 {self.percentile(0.5) * 1000:.0f}ms, '
+            f'p95 {self.percentile(0.95) * 1000:.0f}ms, {len(self.statuses) - self.ok} failed'
+        )
+
+
+async def _fire(base_url, requests, concurrency, headers):
+    limit = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, headers=headers, timeout=120) as client:
+        async def one(method, path):
+            async with limit:
+                started = time.perf_counter()
+                try:
+                    status = (await client.request(method, path)).status_code
+                except httpx.HTTPError:
+                    status = None
+                return status, time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[one(method, path) for method, path in requests])
+        elapsed = time.perf_counter() - started
+    return Result([status for status, _ in results], [latency for _, latency in results], elapsed)
+
+
+def fire(base_url, requests, concurrency, headers=None):
+    """Send (method, path) requests, `concurrency` at a time, and time them."""
+    return asyncio.run(_fire(base_url, requests, concurrency, headers))
+
+
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_metrics(text):
+    """{(sample name, frozenset of label pairs): value} from Prometheus text."""
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[name, frozenset(LABEL.findall(labels or ''))] = float(value)
+    return samples
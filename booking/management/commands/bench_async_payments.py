@@ -0,0 +1,71 @@
+import os
+import threading
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import RefreshToken
+from booking import loadgen
+from booking.fake_razorpay import FakeGateway, gateway_server
+from booking.models import Booking, Bus
+from booking.references import new_booking_reference
+from booking.seed import seed_buses, seed_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare how many payment orders per second the async payment-order view serves under '
+        'gunicorn (WSGI, one thread per request) and uvicorn (ASGI) while the payment gateway is '
+        'slow. Runs both servers against the configured database and a local fake gateway; '
+        'the seeded bus, user and bookings are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--latency', type=float, default=0.5, help='Seconds the fake gateway takes per order')
+        parser.add_argument('--workers', type=int, default=2, help='Server processes for both servers')
+        parser.add_argument('--threads', type=int, default=4, help='Threads per gunicorn worker')
+
+    def handle(self, *args, **options):
+        gateway = gateway_server(FakeGateway(latency=options['latency']))
+        threading.Thread(target=gateway.serve_forever, daemon=True).start()
+        env = {**os.environ, 'RAZORPAY_BASE_URL': f'http://127.0.0.1:{gateway.server_address[1]}'}
+
+        workers, threads = options['workers'], options['threads']
+        servers = [
+            (f'WSGI gunicorn, {workers} workers x {threads} threads',
+             lambda port: loadgen.gunicorn(port, workers, threads)),
+            (f'ASGI uvicorn, {workers} workers', lambda port: loadgen.uvicorn(port, workers)),
+        ]
+
+        bus = seed_buses(1)[0]
+        user = seed_users(1)[0]
+        headers = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+        try:
+            self.stdout.write(
+                f"{options['requests']} payment orders, {options['concurrency']} at a time, "
+                f"gateway latency {options['latency']}s"
+            )
+            for name, command in servers:
+                requests = [
+                    ('POST', f'/api/async/bookings/{booking_id}/payment-order/')
+                    for booking_id in self.seed_bookings(bus, user, options['requests'])
+                ]
+                port = loadgen.free_port()
+                with loadgen.running_server(command(port), port, env) as base_url:
+                    result = loadgen.fire(base_url, requests, options['concurrency'], headers)
+                self.stdout.write(f'{name}: {result}')
+        finally:
+            Booking.objects.filter(bus=bus).delete()
+            Bus.objects.filter(pk=bus.pk).delete()
+            user.delete()
+            gateway.shutdown()
+
+    def seed_bookings(self, bus, user, count):
+        bookings = Booking.objects.bulk_create([
+            Booking(
+                user=user, bus=bus, booking_date=date.today() + timedelta(days=1), seats_booked=1,
+                total_price=bus.price, passenger_name='Bench Passenger', passenger_email='bench@example.com',
+                passenger_phone='+91-9000000000', booking_reference=new_booking_reference(),
+            ) for _ in range(count)
+        ])
+        return [booking.id for booking in bookings]
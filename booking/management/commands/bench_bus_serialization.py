@@ -0,0 +1,61 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from booking.models import Bus
+from booking.renderers import FastJSONRenderer
+from booking.seed import seed_buses
+from booking.serializers import BUS_VALUES, BusSerializer
+
+
+class RollbackSeed(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare objects/sec of BusSerializer with the DRF JSON renderer against the '
+        '.values() fast path with the orjson renderer, on the bus list query.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buses', type=int, default=5000,
+                            help='Buses to serialize; missing ones are seeded and rolled back afterwards')
+        parser.add_argument('--rounds', type=int, default=5, help='Best of this many rounds is reported')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                missing = options['buses'] - Bus.objects.count()
+                if missing > 0:
+                    self.stdout.write(f'Seeding {missing} buses (rolled back afterwards)...')
+                    seed_buses(missing)
+                self.report(options['buses'], options['rounds'])
+                raise RollbackSeed
+        except RollbackSeed:
+            pass
+
+    def report(self, count, rounds):
+        queryset = Bus.objects.order_by('departure_time', 'id')[:count]
+
+        def model_serializer():
+            return JSONRenderer().render(BusSerializer(list(queryset), many=True).data)
+
+        def fast_path():
+            return FastJSONRenderer().render(BUS_VALUES.many(BUS_VALUES.values(queryset)))
+
+        results = {}
+        for name, run in (('BusSerializer + JSONRenderer', model_serializer),
+                          ('.values() + FastJSONRenderer', fast_path)):
+            best = min(self.timed(run) for _ in range(rounds))
+            results[name] = best
+            self.stdout.write(f'{name:32} {count / best:>12,.0f} objects/sec  ({best * 1000:.1f} ms)')
+
+        baseline, fast = results.values()
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {baseline / fast:.1f}x'))
+
+    @staticmethod
+    def timed(run):
+        start = time.perf_counter()
+        run()
+        return time.perf_counter() - start
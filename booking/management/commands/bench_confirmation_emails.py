@@ -0,0 +1,80 @@
+import time
+from django.conf import settings
+from django.core.mail import send_mail
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.test import override_settings
+from django.utils import timezone
+from django.utils.html import strip_tags
+from booking.emails import CONFIRMATION_TEMPLATE, send_confirmations
+from booking.models import Booking
+from booking.seed import seed_bookings, seed_buses, seed_users
+from booking.smtp_sink import SMTPSink
+
+
+class RollbackSeed(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare emails/sec of one send_mail() connection per confirmation against the batched '
+        'pipeline, both sending to a local SMTP sink. Seeded data is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='Confirmation emails per run')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--connect-delay', type=float, default=0.05,
+                            help='Seconds the sink waits before greeting, standing in for TLS and AUTH')
+
+    def handle(self, *args, **options):
+        with SMTPSink(connect_delay=options['connect_delay']) as sink:
+            host, port = sink.address
+            with override_settings(
+                EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                EMAIL_HOST=host, EMAIL_PORT=port, EMAIL_USE_TLS=False,
+                EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                EMAIL_DOMAIN_RATE_LIMIT=10 ** 9,
+            ):
+                try:
+                    with transaction.atomic():
+                        self.run(sink, options['count'], options['batch_size'])
+                        raise RollbackSeed
+                except RollbackSeed:
+                    pass
+
+    def run(self, sink, count, batch_size):
+        buses = seed_buses(20)
+        users = seed_users(5)
+        seed_bookings(count, buses, users)
+        # Only the seeded bookings are queued for this run
+        Booking.objects.filter(payment_status='completed', confirmation_sent_at=None).update(
+            confirmation_sent_at=timezone.now()
+        )
+        queued = Booking.objects.filter(bus__in=buses, payment_status='completed')
+        count = queued.update(confirmation_sent_at=None)
+
+        start = time.perf_counter()
+        for booking in queued.select_related('bus'):
+            html_message = render_to_string(CONFIRMATION_TEMPLATE, {'booking': booking})
+            send_mail(f'Booking Confirmation - {booking.booking_reference}', strip_tags(html_message),
+                      settings.DEFAULT_FROM_EMAIL, [booking.passenger_email], html_message=html_message)
+        self.report('send_mail per email', count, time.perf_counter() - start, sink)
+
+        sink.connections = 0
+        start = time.perf_counter()
+        sent = 0
+        while True:
+            batch_sent, deferred, failed = send_confirmations(batch_size)
+            sent += batch_sent
+            if batch_sent + deferred + failed < batch_size:
+                break
+        self.report('batched, one connection', sent, time.perf_counter() - start, sink)
+
+    def report(self, name, count, elapsed, sink):
+        self.stdout.write(
+            f'{name:26} {count / elapsed:>8,.0f} emails/sec  '
+            f'({count} emails, {sink.connections} SMTP connections, {elapsed:.2f}s)'
+        )
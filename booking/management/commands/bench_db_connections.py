@@ -0,0 +1,104 @@
+import importlib.util
+import os
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from booking import loadgen
+from booking.models import Bus
+from booking.seed import seed_buses
+
+MODES = ['none', 'persistent', 'pool', 'pgbouncer']
+
+
+class Command(BaseCommand):
+    help = (
+        'Load the bus detail endpoint under gunicorn with each way of holding database connections '
+        '(none: a new connection per request, persistent, pool, pgbouncer) and report requests/sec '
+        'and the peak number of PostgreSQL connections. Needs PostgreSQL, e.g. the docker-compose db; '
+        'the pgbouncer mode needs a PgBouncer in transaction mode (docker compose --profile pgbouncer).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+        parser.add_argument('--modes', default='none,persistent,pool',
+                            help=f'Comma-separated, from {", ".join(MODES)}')
+        parser.add_argument('--pgbouncer', default='localhost:6432', metavar='HOST:PORT',
+                            help='Where PgBouncer listens, for the pgbouncer mode')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Connection counts come from pg_stat_activity, so this needs PostgreSQL')
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f'Unknown modes: {", ".join(sorted(unknown))}')
+
+        bus = seed_buses(1)[0]
+        requests = [('GET', f'/api/buses/{bus.id}/')] * options['requests']
+        try:
+            self.stdout.write(
+                f"{options['requests']} requests, {options['concurrency']} at a time, gunicorn "
+                f"{options['workers']} workers x {options['threads']} threads"
+            )
+            for mode in modes:
+                env = self.environment(mode, options)
+                if env is None:
+                    continue
+                port = loadgen.free_port()
+                with loadgen.running_server(
+                    loadgen.gunicorn(port, options['workers'], options['threads']), port, env
+                ) as base_url:
+                    with ConnectionSampler() as sampler:
+                        result = loadgen.fire(base_url, requests, options['concurrency'])
+                self.stdout.write(f'{mode:>10}: {result}, peak {sampler.peak} connections')
+        finally:
+            Bus.objects.filter(pk=bus.pk).delete()
+
+    def environment(self, mode, options):
+        env = {**os.environ, 'DB_POOL_MODE': mode, 'DB_CONN_MAX_AGE': '60'}
+        if mode == 'none':
+            env.update(DB_POOL_MODE='persistent', DB_CONN_MAX_AGE='0')
+        elif mode == 'pool':
+            if importlib.util.find_spec('psycopg_pool') is None:
+                self.stdout.write(self.style.WARNING('      pool: skipped, needs pip install "psycopg[binary,pool]"'))
+                return None
+            # One pooled connection per gunicorn thread is all a worker can use
+            env.setdefault('DB_POOL_MAX_SIZE', str(options['threads']))
+        elif mode == 'pgbouncer':
+            host, _, port = options['pgbouncer'].rpartition(':')
+            env.update(DB_HOST=host, DB_PORT=port)
+        return env
+
+
+class ConnectionSampler:
+    """Track the peak number of other connections to this database while the block runs."""
+
+    interval = 0.05
+
+    def __init__(self):
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def sample(self):
+        try:
+            with connection.cursor() as cursor:
+                while not self.stopped.wait(self.interval):
+                    cursor.execute(
+                        'SELECT count(*) FROM pg_stat_activity '
+                        'WHERE datname = current_database() AND pid <> pg_backend_pid()'
+                    )
+                    self.peak = max(self.peak, cursor.fetchone()[0])
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
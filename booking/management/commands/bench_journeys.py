@@ -0,0 +1,70 @@
+import random
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from booking.journeys import ConnectionIndex
+from booking.models import Bus
+from booking.seed import CITIES, seed_buses
+
+
+class RollbackSeed(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Time building the journey planner timetable, updating it after one bus changes, and '
+        'planning random trips between seeded cities (p50/p95/max ms per search).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buses', type=int, default=30000,
+                            help='Buses in the timetable; missing ones are seeded and rolled back afterwards')
+        parser.add_argument('--queries', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                missing = options['buses'] - Bus.objects.count()
+                if missing > 0:
+                    self.stdout.write(f'Seeding {missing} buses (rolled back afterwards)...')
+                    seed_buses(missing)
+                self.report(options['queries'])
+                raise RollbackSeed
+        except RollbackSeed:
+            pass
+
+    def report(self, queries):
+        # As if the catalogue had been loaded a while ago, so the update
+        # below only reloads the bus that changed
+        Bus.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        index = ConnectionIndex()
+        started = time.perf_counter()
+        index.refresh()
+        self.stdout.write(f'Full build of {Bus.objects.count()} buses: {(time.perf_counter() - started) * 1000:.0f} ms')
+
+        bus = Bus.objects.order_by('?').first()
+        bus.departure_time = bus.departure_time.replace(minute=(bus.departure_time.minute + 15) % 60)
+        bus.save()
+        started = time.perf_counter()
+        index.refresh()
+        self.stdout.write(f'Update after one bus changed: {(time.perf_counter() - started) * 1000:.0f} ms')
+
+        # Skip the catalogue version check: this times the search and the
+        # seat lookups only
+        index._is_stale = lambda version: False
+        travel_date = date.today() + timedelta(days=7)
+        timings, found = [], 0
+        for _ in range(queries):
+            source, destination = random.sample(CITIES, 2)
+            started = time.perf_counter()
+            found += len(index.plan(source, destination, travel_date, after=random.randrange(0, 18 * 60)))
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f'{queries} searches, {found / queries:.1f} itineraries each: '
+            f'p50 {timings[len(timings) // 2] * 1000:.1f} ms, p95 {timings[int(len(timings) * 0.95)] * 1000:.1f} ms, '
+            f'max {timings[-1] * 1000:.1f} ms'
+        ))
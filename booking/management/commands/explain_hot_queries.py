@@ -0,0 +1,117 @@
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from booking.models import Booking, SeatInventory
+from booking.seed import seed_bookings, seed_buses, seed_users
+
+EXECUTION_TIME = re.compile(r'Execution Time: ([\d.]+) ms')
+SCAN_NODE = re.compile(r'((?:Parallel )?(?:Seq Scan|Index Only Scan|Index Scan|Bitmap Heap Scan|Bitmap Index Scan|SEARCH|SCAN)[^\n(]*)')
+
+
+class RollbackIndexes(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Print EXPLAIN ANALYZE timings for the Booking hot queries, optionally after seeding '
+        'synthetic data and compared against the same queries without the Booking indexes. '
+        'Only run this against a development database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, metavar='BOOKINGS',
+                            help='Create this many synthetic bookings first')
+        parser.add_argument('--buses', type=int, default=500, help='Buses to create when seeding')
+        parser.add_argument('--users', type=int, default=1000, help='Users to create when seeding')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also run every query with the Booking indexes dropped (rolled back afterwards)')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['compare'] and connection.vendor != 'postgresql':
+            raise CommandError('--compare needs PostgreSQL, which can drop indexes inside a transaction')
+        if options['seed']:
+            self.seed(options)
+
+        sample = Booking.objects.exclude(order_id=None).order_by('?').values(
+            'bus_id', 'booking_date', 'user_id', 'order_id'
+        ).first()
+        if sample is None:
+            raise CommandError('No bookings with an order id to sample from, run with --seed first')
+
+        queries = self.hot_queries(sample)
+        with_indexes = self.run(queries)
+        without_indexes = self.run_without_indexes(queries) if options['compare'] else {}
+
+        for name in queries:
+            self.stdout.write(f'\n{name}')
+            self.stdout.write(f'  with indexes:    {self.describe(with_indexes[name])}')
+            if without_indexes:
+                self.stdout.write(f'  without indexes: {self.describe(without_indexes[name])}')
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                'EXPLAIN ANALYZE timings need PostgreSQL; only plans were collected'
+            ))
+
+    def seed(self, options):
+        self.stdout.write(f"Seeding {options['buses']} buses, {options['users']} users, "
+                          f"{options['seed']} bookings...")
+        buses = seed_buses(options['buses'])
+        users = seed_users(options['users'])
+        seed_bookings(options['seed'], buses, users)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Booking._meta.db_table}')
+
+    def hot_queries(self, sample):
+        departure = Booking.objects.filter(bus_id=sample['bus_id'], booking_date=sample['booking_date'])
+        return {
+            'departure seat totals': departure.filter(
+                payment_status__in=['pending', 'completed']
+            ).values('payment_status').annotate(total=Sum('seats_booked')),
+            'departure sold seats': departure.filter(
+                payment_status='completed'
+            ).values('bus').annotate(total=Sum('seats_booked')),
+            'payment order lookup': Booking.objects.filter(order_id=sample['order_id']),
+            'my bookings page': Booking.objects.filter(
+                user_id=sample['user_id'], payment_status='completed'
+            ).order_by('-booking_time')[:20],
+            'inventory lookup': SeatInventory.objects.filter(
+                bus_id=sample['bus_id'], date=sample['booking_date']
+            ),
+        }
+
+    def run(self, queries):
+        results = {}
+        for name, queryset in queries.items():
+            if connection.vendor == 'postgresql':
+                plan = queryset.explain(analyze=True)
+            else:
+                plan = queryset.explain()
+            if self.verbosity > 1:
+                self.stdout.write(f'\n== {name}\n{plan}')
+            results[name] = plan
+        return results
+
+    def run_without_indexes(self, queries):
+        # DDL is transactional on PostgreSQL, so dropping the indexes inside an
+        # atomic block and raising afterwards restores them untouched.
+        results = {}
+        try:
+            with transaction.atomic():
+                with connection.schema_editor(atomic=False) as editor:
+                    for index in Booking._meta.indexes:
+                        editor.remove_index(Booking, index)
+                results = self.run(queries)
+                raise RollbackIndexes
+        except RollbackIndexes:
+            pass
+        return results
+
+    def describe(self, plan):
+        timing = EXECUTION_TIME.search(plan)
+        scan = SCAN_NODE.search(plan)
+        scan = scan.group(1).strip() if scan else plan.splitlines()[0]
+        return f'{float(timing.group(1)):>10.3f} ms  {scan}' if timing else scan
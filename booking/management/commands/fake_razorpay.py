@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from booking.fake_razorpay import FakeGateway, gateway_server
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve a fake Razorpay orders API for offline development. Set RAZORPAY_BASE_URL to '
+        'http://localhost:<port>. POST /v1/orders/<order_id>/pay returns the signed fields to '
+        'post to the payment success page.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before every answer')
+
+    def handle(self, *args, **options):
+        server = gateway_server(FakeGateway(latency=options['latency']), port=options['port'], log=self.stdout.write)
+        self.stdout.write(f"Fake Razorpay listening on http://127.0.0.1:{options['port']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
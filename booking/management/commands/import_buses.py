@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from booking.cache import bump_catalogue_version
+from booking.imports import FORMATS, import_buses
+from booking.routes import city_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Create or update buses, keyed by bus_number, from CSV or NDJSON files ("-" reads stdin). '
+        'Columns: bus_number, bus_name, source, destination, total_seats, price, departure_time, '
+        'arrival_time, journey_duration. Rows that fail validation are reported and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                            help='File format; by default taken from the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Validate the files without saving anything')
+
+    def handle(self, *args, **options):
+        written = failed = 0
+        started = time.perf_counter()
+        for path in options['paths']:
+            format = options['format'] or FORMATS.get(os.path.splitext(path)[1].lower())
+            if not format:
+                raise CommandError(f'Cannot tell the format of {path}, pass --format')
+            f = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+            try:
+                for batch_written, errors in import_buses(f, format, options['batch_size'], options['dry_run']):
+                    written += batch_written
+                    failed += len(errors)
+                    for error in errors:
+                        self.stderr.write(f'{path}: {error}')
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'{written} rows imported, {failed} rejected')
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+        elapsed = time.perf_counter() - started
+
+        if written and not options['dry_run']:
+            # bulk_create sends no post_save, so tell caches the catalogue changed
+            bump_catalogue_version()
+            city_index.invalidate()
+
+        action = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {written} buses in {elapsed:.2f}s ({written / max(elapsed, 1e-9):,.0f} rows/s), '
+            f'{failed} rows rejected'
+        ))
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from io import StringIO
+import httpx
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from booking import loadgen
+from booking.fake_razorpay import FakeGateway, gateway_server
+from booking.models import Bus
+from booking.seed import seed_bookings, seed_buses, seed_users
+
+# Funnel steps in order, with the URL name that serves each one
+STEPS = {
+    'signup': 'api_register',
+    'web_login': 'login',
+    'web_search': 'search_buses',
+    'api_search': 'api_bus_search',
+    'book': 'api_create_booking',
+    'payment_order': 'async_payment_order',
+    'pay': 'razorpay_webhook',
+}
+
+
+class Funnel:
+    """One virtual user: sign up and log in once, then search, book and pay in a loop."""
+
+    def __init__(self, client, routes, webhook_secret, record):
+        self.client, self.routes, self.webhook_secret, self.record = client, routes, webhook_secret, record
+        self.gateway = FakeGateway()
+
+    async def step(self, name, method, url, expect=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.record(name, None, time.perf_counter() - started)
+            return None
+        # Report unexpected answers (a 409 for a full bus, say) as failures
+        status = response.status_code if response.status_code in expect else 599
+        self.record(name, status, time.perf_counter() - started)
+        return response if status != 599 else None
+
+    async def run(self, iterations):
+        username = f'load-{uuid.uuid4().hex[:12]}'
+        password = 'loadtest123'
+        response = await self.step('signup', 'POST', '/api/auth/register/', (201,), json={
+            'username': username, 'email': f'{username}@example.com', 'password': password,
+        })
+        if response is None:
+            return
+        auth = {'Authorization': f"Bearer {response.json()['access']}"}
+
+        await self.client.get('/login/')
+        await self.step('web_login', 'POST', '/login/', (302,), data={'username': username, 'password': password},
+                        headers={'X-CSRFToken': self.client.cookies.get('csrftoken', '')})
+
+        for _ in range(iterations):
+            bus_id, source, destination = random.choice(self.routes)
+            travel_date = (date.today() + timedelta(days=random.randrange(1, 30))).isoformat()
+            query = {'source': source, 'destination': destination, 'date': travel_date}
+            await self.step('web_search', 'GET', '/search/', params=query)
+            await self.step('api_search', 'GET', '/api/buses/search/', params=query, headers=auth)
+
+            response = await self.step('book', 'POST', '/api/booking/create/', (201,), headers=auth, json={
+                'bus': bus_id, 'booking_date': travel_date, 'seats_booked': random.randint(1, 2),
+                'passenger_name': 'Load Test', 'passenger_email': f'{username}@example.com',
+                'passenger_phone': '+91-9000000000',
+            })
+            if response is None:
+                continue
+            booking_id = response.json()['booking']['id']
+            response = await self.step('payment_order', 'POST', f'/api/async/bookings/{booking_id}/payment-order/',
+                                       headers=auth)
+            if response is None:
+                continue
+            body, headers = self.gateway.webhook(
+                'payment.captured', response.json()['razorpay_order_id'], f'pay_{uuid.uuid4().hex[:14]}',
+                secret=self.webhook_secret,
+            )
+            await self.step('pay', 'POST', '/payment/webhook/', content=body, headers={
+                'Content-Type': 'application/json',
+                'X-Razorpay-Signature': headers['HTTP_X_RAZORPAY_SIGNATURE'],
+                'X-Razorpay-Event-Id': headers['HTTP_X_RAZORPAY_EVENT_ID'],
+            })
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the booking funnel (sign up, log in, search on the web and API, book, get a '
+        'payment order, pay by webhook) with concurrent virtual users against gunicorn or uvicorn, '
+        'using a local fake Razorpay, a dummy email backend and tasks run inline. Reports requests/sec, '
+        'p50/p95/p99 latency and database queries per step and can save them as JSON to compare '
+        'runs across commits. Seeds data into the configured database; only run it against a '
+        'development database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buses', type=int, default=200, help='Buses to seed first (0 to use existing ones)')
+        parser.add_argument('--bookings', type=int, default=10000, help='Bookings to seed first')
+        parser.add_argument('--users', type=int, default=50, help='Concurrent virtual users')
+        parser.add_argument('--iterations', type=int, default=10, help='Search-book-pay rounds per user')
+        parser.add_argument('--server', choices=['gunicorn', 'uvicorn'], default='gunicorn')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Print the change against the results in this JSON file')
+
+    def handle(self, *args, **options):
+        self.seed(options)
+        routes = list(Bus.objects.values_list('id', 'source', 'destination'))
+        if not routes:
+            raise CommandError('No buses to book, seed some with --buses')
+
+        server = gateway_server(FakeGateway())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        token = uuid.uuid4().hex
+        env = {
+            **os.environ,
+            'RAZORPAY_BASE_URL': f'http://127.0.0.1:{server.server_address[1]}',
+            'RAZORPAY_WEBHOOK_SECRET': settings.RAZORPAY_WEBHOOK_SECRET or 'load-test-webhook-secret',
+            'EMAIL_BACKEND': 'django.core.mail.backends.dummy.EmailBackend',
+            'CELERY_TASK_ALWAYS_EAGER': 'True',
+            'METRICS_TOKEN': token,
+        }
+
+        port = loadgen.free_port()
+        if options['server'] == 'gunicorn':
+            command = loadgen.gunicorn(port, options['workers'], options['threads'])
+        else:
+            command = loadgen.uvicorn(port, options['workers'])
+        try:
+            with loadgen.running_server(command, port, env) as base_url:
+                before = self.scrape(base_url, token)
+                samples, elapsed = asyncio.run(self.drive(base_url, routes, env['RAZORPAY_WEBHOOK_SECRET'], options))
+                after = self.scrape(base_url, token)
+        finally:
+            server.shutdown()
+
+        results = self.summarise(samples, elapsed, before, after, options)
+        self.report(results)
+        if options['compare']:
+            self.compare(results, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def seed(self, options):
+        if not options['buses']:
+            return
+        self.stdout.write(f"Seeding {options['buses']} buses and {options['bookings']} bookings...")
+        buses = seed_buses(options['buses'])
+        if options['bookings']:
+            seed_bookings(options['bookings'], buses, seed_users(max(1, options['bookings'] // 20)))
+            # Seeded bookings bypass the inventory counters
+            call_command('reconcile_inventory', stdout=StringIO())
+
+    async def drive(self, base_url, routes, webhook_secret, options):
+        samples = {step: [] for step in STEPS}
+
+        def record(step, status, latency):
+            samples[step].append((status, latency))
+
+        async def user():
+            limits = httpx.Limits(max_connections=2)
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+                await Funnel(client, routes, webhook_secret, record).run(options['iterations'])
+
+        started = time.perf_counter()
+        await asyncio.gather(*[user() for _ in range(options['users'])])
+        return samples, time.perf_counter() - started
+
+    def scrape(self, base_url, token):
+        response = httpx.get(f'{base_url}/metrics', headers={'Authorization': f'Bearer {token}'}, timeout=30)
+        return loadgen.parse_metrics(response.text) if response.status_code == 200 else {}
+
+    def summarise(self, samples, elapsed, before, after, options):
+        def delta(sample, view):
+            key = (sample, frozenset({('view', view)}))
+            return after.get(key, 0) - before.get(key, 0)
+
+        steps = {}
+        for step, url_name in STEPS.items():
+            result = loadgen.Result([s for s, _ in samples[step]], [t for _, t in samples[step]], elapsed)
+            steps[step] = result.as_dict()
+            count = delta('http_request_db_queries_count', url_name)
+            steps[step]['db_queries'] = round(delta('http_request_db_queries_sum', url_name) / count, 2) if count else None
+
+        total = loadgen.Result(
+            [s for step in samples.values() for s, _ in step], [t for step in samples.values() for _, t in step], elapsed
+        )
+        return {
+            'commit': self.commit(),
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'config': {name: options[name] for name in (
+                'buses', 'bookings', 'users', 'iterations', 'server', 'workers', 'threads'
+            )},
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            'elapsed_s': round(elapsed, 2),
+            'steps': steps,
+            'total': total.as_dict(),
+        }
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def report(self, results):
+        self.stdout.write(
+            f"{results['config']['users']} users x {results['config']['iterations']} rounds on "
+            f"{results['config']['server']}, {results['elapsed_s']}s (commit {results['commit']})"
+        )
+        self.stdout.write(f"{'step':<14}{'requests':>9}{'failed':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+                          f"{'p99 ms':>9}{'queries':>9}")
+        for step, row in list(results['steps'].items()) + [('total', results['total'])]:
+            queries = row.get('db_queries')
+            self.stdout.write(
+                f"{step:<14}{row['requests']:>9}{row['failed']:>8}{row['rps']:>9.1f}{row['p50_ms']:>9.1f}"
+                f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{'' if queries is None else queries:>9}"
+            )
+
+    def compare(self, results, path):
+        with open(path) as f:
+            previous = json.load(f)
+        self.stdout.write(f"\nChange against {path} (commit {previous.get('commit')}):")
+        for step, row in list(results['steps'].items()) + [('total', results['total'])]:
+            old = previous['steps'].get(step) if step != 'total' else previous.get('total')
+            if not old:
+                continue
+            changes = []
+            for key, label in (('rps', 'req/s'), ('p95_ms', 'p95'), ('db_queries', 'queries')):
+                if row.get(key) is not None and old.get(key):
+                    changes.append(f'{label} {(row[key] - old[key]) / old[key]:+.0%}')
+            self.stdout.write(f"  {step:<14}{', '.join(changes)}")
@@ -0,0 +1,126 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from booking.inventory import invalidate_availability
+from booking.models import Booking, SeatInventory
+
+
+def booked_totals(bookings):
+    return bookings.filter(
+        payment_status__in=['pending', 'completed']
+    ).values('bus_id', 'booking_date').annotate(
+        held=Sum('seats_booked', filter=Q(payment_status='pending'), default=0),
+        sold=Sum('seats_booked', filter=Q(payment_status='completed'), default=0),
+        seats_total=F('bus__total_seats'),
+    ).order_by('bus_id', 'booking_date')
+
+
+class Command(BaseCommand):
+    help = 'Rebuild SeatInventory rows from the Booking table and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.checked = 0
+        self.drifted = 0
+
+        missing = self.create_missing_rows()
+        self.fix_existing_rows()
+
+        action = 'found' if self.dry_run else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {self.checked} departures: {self.drifted} drifted, '
+            f'{missing} missing rows ({action})'
+        ))
+
+    def create_missing_rows(self):
+        """Departures that have bookings but no inventory row yet."""
+        missing = 0
+        batch = []
+        for row in booked_totals(Booking.objects.all()).iterator(chunk_size=self.batch_size):
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                missing += self.create_batch(batch)
+                batch = []
+        if batch:
+            missing += self.create_batch(batch)
+        return missing
+
+    def create_batch(self, batch):
+        existing = set(SeatInventory.objects.filter(
+            bus_id__in={row['bus_id'] for row in batch},
+            date__in={row['booking_date'] for row in batch},
+        ).values_list('bus_id', 'date'))
+        new_rows = [
+            SeatInventory(
+                bus_id=row['bus_id'],
+                date=row['booking_date'],
+                seats_total=row['seats_total'],
+                seats_held=row['held'],
+                seats_sold=row['sold'],
+            )
+            for row in batch
+            if (row['bus_id'], row['booking_date']) not in existing
+        ]
+        for row in new_rows:
+            self.stdout.write(f'missing: bus {row.bus_id} on {row.date} '
+                              f'(held={row.seats_held}, sold={row.seats_sold})')
+        if new_rows and not self.dry_run:
+            SeatInventory.objects.bulk_create(new_rows, ignore_conflicts=True)
+            for row in new_rows:
+                invalidate_availability(row.bus_id, row.date)
+        return len(new_rows)
+
+    def fix_existing_rows(self):
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                # Locking the rows first means concurrent bookings wait for us
+                # instead of applying their deltas to a row we are rewriting.
+                rows = list(
+                    SeatInventory.objects.select_for_update()
+                    .filter(id__gt=last_id)
+                    .select_related('bus')
+                    .order_by('id')[:self.batch_size]
+                )
+                if not rows:
+                    return
+                last_id = rows[-1].id
+                self.fix_batch(rows)
+
+    def fix_batch(self, rows):
+        totals = {
+            (row['bus_id'], row['booking_date']): row
+            for row in booked_totals(Booking.objects.filter(
+                bus_id__in={row.bus_id for row in rows},
+                booking_date__in={row.date for row in rows},
+            ))
+        }
+        today = timezone.localdate()
+        changed = []
+        for inventory in rows:
+            self.checked += 1
+            actual = totals.get((inventory.bus_id, inventory.date), {'held': 0, 'sold': 0})
+            # Past departures keep the seat count they ran with, as in
+            # sync_seats_total()
+            seats_total = inventory.bus.total_seats if inventory.date >= today else inventory.seats_total
+            expected = (seats_total, actual['held'], actual['sold'])
+            current = (inventory.seats_total, inventory.seats_held, inventory.seats_sold)
+            if current == expected:
+                continue
+            self.drifted += 1
+            self.stdout.write(
+                f'drift: bus {inventory.bus_id} on {inventory.date} '
+                f'total/held/sold {current} -> {expected}'
+            )
+            inventory.seats_total, inventory.seats_held, inventory.seats_sold = expected
+            changed.append(inventory)
+        if changed and not self.dry_run:
+            SeatInventory.objects.bulk_update(changed, ['seats_total', 'seats_held', 'seats_sold'])
+            for inventory in changed:
+                invalidate_availability(inventory.bus_id, inventory.date)
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from booking.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local SMTP server that accepts and discards every message. Point EMAIL_HOST and '
+        'EMAIL_PORT at it (with EMAIL_USE_TLS=False) to test confirmation emails offline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--print', action='store_true', dest='print_messages',
+                            help='Print the headers of every message received')
+
+    def handle(self, *args, **options):
+        sink = SMTPSink(port=options['port'], keep=0)
+        if options['print_messages']:
+            received = sink.received
+
+            def print_received(sender, recipients, data):
+                received(sender, recipients, data)
+                headers = data.split(b'\r\n\r\n', 1)[0].decode(errors='replace')
+                self.stdout.write(f'--- from {sender} to {", ".join(recipients)}\n{headers}\n')
+            sink.received = print_received
+
+        self.stdout.write(f"SMTP sink listening on {sink.address[0]}:{sink.address[1]}")
+        with sink:
+            try:
+                while True:
+                    time.sleep(10)
+                    self.stdout.write(f'{sink.count} messages over {sink.connections} connections')
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,71 @@
+import heapq
+import multiprocessing
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand, CommandError
+from booking.references import get_generator
+
+
+def generate_to_file(path, count):
+    """Write count references to path, one per line; exit 1 if they ever stop increasing."""
+    generate = get_generator()
+    previous = ''
+    with open(path, 'w') as f:
+        for _ in range(count):
+            reference = generate()
+            if reference <= previous:
+                os._exit(1)
+            f.write(reference + '\n')
+            previous = reference
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate references from many forked processes at once, the way gunicorn and Celery '
+        'workers do, and check that none of them collide'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--count', type=int, default=250000, help='References per process')
+
+    def handle(self, *args, **options):
+        processes, count = options['processes'], options['count']
+        # Use the generator in the parent first, so every child inherits its state
+        get_generator()()
+        context = multiprocessing.get_context('fork')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, f'{i}.txt') for i in range(processes)]
+            workers = [context.Process(target=generate_to_file, args=(path, count)) for path in paths]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+            if any(worker.exitcode for worker in workers):
+                raise CommandError('A process generated references out of order')
+
+            # Every file is sorted, so merging them puts any duplicates side by side
+            total = collisions = 0
+            previous = None
+            files = [open(path) for path in paths]
+            try:
+                for reference in heapq.merge(*files):
+                    total += 1
+                    if reference == previous:
+                        collisions += 1
+                    previous = reference
+            finally:
+                for f in files:
+                    f.close()
+
+        summary = (
+            f'{total} references from {processes} processes in {elapsed:.2f}s '
+            f'({total / elapsed:,.0f}/s): {collisions} collisions'
+        )
+        if collisions or total != processes * count:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,152 @@
+import multiprocessing
+import random
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+from booking.inventory import apply_booking_change
+from booking.models import Booking, Bus, SeatInventory
+from booking.seatmap import SeatsUnavailable
+from booking.seed import seed_buses, seed_users
+from .reconcile_inventory import booked_totals
+
+
+def book(bus, user, travel_date, seats):
+    """What the booking views do: insert a held booking and take its seats."""
+    booking = Booking(
+        user=user, bus=bus, booking_date=travel_date, seats_booked=seats, total_price=bus.price * seats,
+        passenger_name='Stress Test', passenger_email=user.email, passenger_phone='+91-9000000000',
+    )
+    booking.start_hold()
+    with transaction.atomic():
+        booking.save()
+        apply_booking_change(booking)
+    return booking
+
+
+def settle(booking_id, new_status):
+    """Pay for or cancel a pending booking the way the views do, under its row lock."""
+    with transaction.atomic():
+        booking = Booking.objects.select_for_update(of=('self',)).select_related('bus').get(pk=booking_id)
+        if booking.payment_status != 'pending':
+            return False
+        old_status, booking.payment_status = booking.payment_status, new_status
+        booking.save()
+        apply_booking_change(booking, old_status, booking.seats_booked)
+    return True
+
+
+def hammer(bus, user, travel_date, options, counts, lock):
+    """One thread: book, then pay for or cancel some of the bookings."""
+    local = Counter()
+    try:
+        for _ in range(options['attempts']):
+            try:
+                booking = book(bus, user, travel_date, random.randint(1, options['max_seats']))
+            except SeatsUnavailable:
+                local['rejected'] += 1
+                continue
+            except DatabaseError:
+                local['errors'] += 1
+                continue
+            local['booked'] += 1
+            roll = random.random()
+            if roll < options['pay_ratio']:
+                new_status = 'completed'
+            elif roll < options['pay_ratio'] + options['cancel_ratio']:
+                new_status = 'cancelled'
+            else:
+                continue
+            try:
+                if settle(booking.id, new_status):
+                    local[new_status] += 1
+            except DatabaseError:
+                local['errors'] += 1
+    finally:
+        connections.close_all()
+    with lock:
+        counts.update(local)
+
+
+def run_process(bus_id, user_id, travel_date, options):
+    """One process: `threads` threads booking the same departure at once."""
+    bus, user = Bus.objects.get(pk=bus_id), User.objects.get(pk=user_id)
+    connections.close_all()
+    counts, lock = Counter(), threading.Lock()
+    threads = [
+        threading.Thread(target=hammer, args=(bus, user, travel_date, options, counts, lock))
+        for _ in range(options['threads'])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+class Command(BaseCommand):
+    help = (
+        'Book one departure from many processes and threads at once, paying for and cancelling '
+        'some of the bookings, then check it was never oversold and its inventory row matches its '
+        'bookings. Creates its own bus and user; only run it against a development database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=8, help='Threads per process')
+        parser.add_argument('--attempts', type=int, default=50, help='Booking attempts per thread')
+        parser.add_argument('--seats', type=int, default=40, help='Seats on the bus')
+        parser.add_argument('--max-seats', type=int, default=4, help='Most seats per booking')
+        parser.add_argument('--pay-ratio', type=float, default=0.5, help='Share of bookings paid for')
+        parser.add_argument('--cancel-ratio', type=float, default=0.2, help='Share of bookings cancelled')
+        parser.add_argument('--keep', action='store_true', help='Keep the bus and its bookings afterwards')
+
+    def handle(self, *args, **options):
+        bus = seed_buses(1)[0]
+        Bus.objects.filter(pk=bus.pk).update(total_seats=options['seats'])
+        user = seed_users(1)[0]
+        travel_date = date.today() + timedelta(days=7)
+        # Every process must open its own database connections
+        connections.close_all()
+
+        args = [(bus.pk, user.pk, travel_date, options)] * options['processes']
+        started = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(options['processes']) as pool:
+            results = pool.starmap(run_process, args)
+        elapsed = time.perf_counter() - started
+        counts = sum(results, Counter())
+
+        try:
+            self.verify(bus, travel_date, counts, elapsed, options)
+        finally:
+            if not options['keep']:
+                bus.delete()
+                user.delete()
+
+    def verify(self, bus, travel_date, counts, elapsed, options):
+        attempts = options['processes'] * options['threads'] * options['attempts']
+        row = SeatInventory.objects.get(bus=bus, date=travel_date)
+        booked = booked_totals(Booking.objects.filter(bus=bus, booking_date=travel_date)).first() \
+            or {'held': 0, 'sold': 0}
+        self.stdout.write(
+            f"{attempts} attempts from {options['processes']} processes x {options['threads']} threads "
+            f"in {elapsed:.2f}s ({attempts / elapsed:,.0f} attempts/s): {counts['booked']} booked "
+            f"({counts['booked'] / elapsed:,.0f}/s), {counts['rejected']} rejected as full, "
+            f"{counts['completed']} paid, {counts['cancelled']} cancelled, {counts['errors']} database errors"
+        )
+        self.stdout.write(
+            f'Inventory: {row.seats_total} seats, {row.seats_held} held, {row.seats_sold} sold; '
+            f"bookings: {booked['held']} held, {booked['sold']} sold"
+        )
+        if row.seats_held + row.seats_sold > row.seats_total or booked['held'] + booked['sold'] > row.seats_total:
+            raise CommandError(f'Oversold: {booked["held"] + booked["sold"]} seats taken of {row.seats_total}')
+        if (row.seats_held, row.seats_sold) != (booked['held'], booked['sold']):
+            raise CommandError('The inventory row does not match the bookings')
+        if counts['errors']:
+            # Lock timeouts on SQLite, deadlocks on PostgreSQL: rolled back, so
+            # they cannot oversell, but worth looking into
+            self.stdout.write(self.style.WARNING(f"{counts['errors']} attempts failed with database errors"))
+        self.stdout.write(self.style.SUCCESS('No seats oversold'))
@@ -0,0 +1,352 @@
+"""
+In-process metrics, served in the Prometheus text format at /metrics.
+
+Each process (web or Celery worker) aggregates into its own registry:
+recording a value is a bisect and a few additions under a lock, with no I/O,
+so instrumenting a request costs a few microseconds. A background thread
+publishes the process's totals to the cache every METRICS_PUBLISH_INTERVAL
+seconds, and /metrics adds up the totals of every live process, so one
+scrape covers all gunicorn and Celery workers. Totals of a process that
+stops are dropped after a few intervals, which Prometheus sees as a counter
+reset.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotFound
+from django.utils.crypto import constant_time_compare
+from .cache import availability_cache
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        _metrics[name] = self
+
+    def inc(self, *labels, value=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def merge(self, total, value):
+        return (total or 0) + value
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.values = {}
+        _metrics[name] = self
+
+    def observe(self, value, *labels):
+        with _lock:
+            self.add(value, labels)
+
+    def add(self, value, labels):
+        # Per-bucket counts (the last one is +Inf) followed by the sum. The
+        # caller holds _lock.
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [0] * (len(self.buckets) + 2)
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def merge(self, total, value):
+        return [a + b for a, b in zip(total, value)] if total else list(value)
+
+    def samples(self, labels, state):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), state):
+            cumulative += count
+            yield f'{self.name}_bucket', labels + (('le', _format(bound)),), cumulative
+        yield f'{self.name}_sum', labels, state[-1]
+        yield f'{self.name}_count', labels, cumulative
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Request latency by URL name', ('view', 'method', 'status'),
+)
+request_queries = Histogram(
+    'http_request_db_queries', 'Database queries per request', ('view',), QUERY_COUNT_BUCKETS,
+)
+request_db_time = Histogram(
+    'http_request_db_seconds', 'Time per request spent in database queries', ('view',),
+)
+external_call_duration = Histogram(
+    'external_call_duration_seconds', 'Calls to Razorpay and the SMTP server', ('service', 'operation', 'outcome'),
+)
+task_duration = Histogram(
+    'celery_task_duration_seconds', 'Celery task runtime', ('task', 'state'), TASK_BUCKETS,
+)
+task_queue_wait = Histogram(
+    'celery_task_queue_wait_seconds', 'Time from publishing a Celery task to a worker starting it', ('task',),
+    TASK_BUCKETS,
+)
+availability_cache_lookups = Counter(
+    'availability_cache_lookups_total', 'Availability cache lookups', ('result',),
+)
+
+
+def _format(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def snapshot():
+    """This process's totals as {metric name: {label values: value}}."""
+    stats = availability_cache.stats()
+    with _lock:
+        totals = {name: {labels: (list(value) if isinstance(value, list) else value)
+                         for labels, value in metric.values.items()}
+                  for name, metric in _metrics.items()}
+    totals[availability_cache_lookups.name] = {
+        (result,): stats[key] for result, key in (('hit', 'hits'), ('miss', 'misses'), ('error', 'errors'))
+    }
+    return totals
+
+
+def render(totals):
+    lines = []
+    for name, metric in _metrics.items():
+        values = totals.get(name)
+        if not values:
+            continue
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for label_values, value in sorted(values.items()):
+            labels = tuple(zip(metric.labels, label_values))
+            for sample, sample_labels, number in metric.samples(labels, value):
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in sample_labels)
+                lines.append(f'{sample}{{{label_text}}} {_format(number)}' if label_text else f'{sample} {_format(number)}')
+    return '\n'.join(lines) + '\n'
+
+
+def merge(snapshots):
+    totals = {}
+    for process_totals in snapshots:
+        for name, values in process_totals.items():
+            metric = _metrics.get(name)
+            if metric is None:
+                continue
+            merged = totals.setdefault(name, {})
+            for labels, value in values.items():
+                merged[tuple(labels)] = metric.merge(merged.get(tuple(labels)), value)
+    return totals
+
+
+class Publisher:
+    """
+    Publishes this process's snapshot to the cache under one of
+    METRICS_MAX_PROCESSES slots, claimed with cache.add() so two processes
+    never share one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.slot = None
+
+    @staticmethod
+    def slot_key(slot):
+        return f'metrics:slot:{slot}'
+
+    @staticmethod
+    def snapshot_key(slot):
+        return f'metrics:snapshot:{slot}'
+
+    def ensure_started(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self.slot = None
+                    threading.Thread(target=self.run, name='metrics-publisher', daemon=True).start()
+
+    def claim(self, owner, timeout):
+        if self.slot is not None and cache.get(self.slot_key(self.slot)) == owner:
+            cache.touch(self.slot_key(self.slot), timeout)
+            return self.slot
+        for slot in range(settings.METRICS_MAX_PROCESSES):
+            if cache.add(self.slot_key(slot), owner, timeout):
+                return slot
+        return None
+
+    def publish(self):
+        timeout = settings.METRICS_PUBLISH_INTERVAL * 3
+        self.slot = self.claim(f'{socket.gethostname()}:{os.getpid()}', timeout)
+        if self.slot is None:
+            logger.warning('No free metrics slot; raise METRICS_MAX_PROCESSES')
+            return
+        cache.set(self.snapshot_key(self.slot), snapshot(), timeout)
+
+    def run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                self.publish()
+            except Exception as e:  # the cache being down must not kill the thread
+                logger.warning('Could not publish metrics: %s', e)
+            time.sleep(settings.METRICS_PUBLISH_INTERVAL)
+
+    def collect(self):
+        """The totals of all live processes, with this one's taken live."""
+        keys = [self.snapshot_key(slot) for slot in range(settings.METRICS_MAX_PROCESSES) if slot != self.slot]
+        try:
+            others = list(cache.get_many(keys).values())
+        except Exception as e:
+            logger.warning('Could not read published metrics: %s', e)
+            others = []
+        return merge(others + [snapshot()])
+
+
+publisher = Publisher()
+
+
+# Database queries of the current request: [count, nanoseconds]
+_query_stats = ContextVar('metrics_query_stats', default=None)
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = _query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter_ns()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter_ns() - started
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class MetricsMiddleware:
+    """Records latency and database use per URL name. Keep it first in MIDDLEWARE."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started, stats, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+        self.record(request, response, started, stats)
+        return response
+
+    async def __acall__(self, request):
+        started, stats, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+        self.record(request, response, started, stats)
+        return response
+
+    def start(self):
+        publisher.ensure_started()
+        stats = [0, 0]
+        return time.perf_counter_ns(), stats, _query_stats.set(stats)
+
+    def record(self, request, response, started, stats):
+        elapsed = (time.perf_counter_ns() - started) / 1e9
+        match = request.resolver_match
+        view = (match.view_name if match else None) or 'unmatched'
+        with _lock:
+            request_duration.add(elapsed, (view, request.method, str(response.status_code)))
+            request_queries.add(stats[0], (view,))
+            request_db_time.add(stats[1] / 1e9, (view,))
+
+
+@contextmanager
+def timed(service, operation):
+    """Record how long the block's call to an external service takes."""
+    publisher.ensure_started()
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        external_call_duration.observe(time.perf_counter() - started, service, operation, outcome)
+
+
+def metrics_view(request):
+    # Hidden unless a scrape token is configured (or in development)
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        return HttpResponseNotFound()
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(render(publisher.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Celery: queue wait from a publish timestamp header, runtime per task
+_task_started = {}
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault('published_at', time.time())
+
+
+@task_prerun.connect
+def task_started(task_id=None, task=None, **kwargs):
+    publisher.ensure_started()
+    _task_started[task_id] = time.perf_counter()
+    published_at = task.request.get('published_at')
+    if published_at:
+        task_queue_wait.observe(max(0.0, time.time() - published_at), task.name)
+
+
+@task_postrun.connect
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        task_duration.observe(time.perf_counter() - started, task.name, state or 'UNKNOWN')
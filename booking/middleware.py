@@ -0,0 +1,60 @@
+import gzip
+import re
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+re_accepts_br = re.compile(r'\bbr\b')
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+
+def _compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=settings.RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=settings.RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Brotli or gzip compression for API JSON responses larger than
+    RESPONSE_COMPRESSION_MIN_SIZE bytes. Only JSON is compressed: HTML pages
+    carry the CSRF token, and compressing secrets next to user input opens
+    them up to BREACH. MiddlewareMixin makes it async-capable, so async views
+    under ASGI are not pushed onto a thread because of it.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not response.get('Content-Type', '').startswith('application/json'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+
+        accept = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and re_accepts_br.search(accept):
+            encoding = 'br'
+        elif re_accepts_gzip.search(accept):
+            encoding = 'gzip'
+        else:
+            return response
+
+        compressed = _compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The compressed body is no longer byte-for-byte the one the ETag
+        # was computed for.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:13
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0002_add_modification_attributes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('seats_total', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('seats_held', models.IntegerField(default=0)),
+                ('seats_sold', models.IntegerField(default=0)),
+                ('bus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory', to='booking.bus')),
+            ],
+            options={
+                'verbose_name_plural': 'Seat inventory',
+                'constraints': [models.UniqueConstraint(fields=('bus', 'date'), name='unique_inventory_per_departure')],
+            },
+        ),
+    ]
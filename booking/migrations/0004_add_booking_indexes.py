@@ -0,0 +1,31 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0003_add_seat_inventory'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['bus', 'booking_date', 'payment_status'], name='booking_departure_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('payment_status', 'completed')), fields=['bus', 'booking_date'], name='booking_departure_sold_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('order_id__isnull', False)), fields=['order_id'], name='booking_order_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-booking_time'], name='booking_user_time_idx'),
+        ),
+    ]
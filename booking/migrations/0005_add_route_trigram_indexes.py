@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# icontains compiles to UPPER(column::text) LIKE UPPER(%s) on PostgreSQL, so
+# trigram GIN indexes on the same expressions let route searches use an index
+# instead of scanning every bus. Other databases keep the plain scan.
+TRIGRAM_INDEXES = {
+    'bus_source_trgm_idx': 'source',
+    'bus_destination_trgm_idx': 'destination',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON booking_bus '
+            f'USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0004_add_booking_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
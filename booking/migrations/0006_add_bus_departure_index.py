@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0005_add_route_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bus',
+            index=models.Index(fields=['departure_time', 'id'], name='bus_departure_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0006_add_bus_departure_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:30
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def hold_existing_pending(apps, schema_editor):
+    # Bookings left pending before holds existed get one full hold period
+    # from now, after which the sweeper releases them.
+    Booking = apps.get_model('booking', 'Booking')
+    Booking.objects.filter(payment_status='pending', hold_expires_at=None).update(
+        hold_expires_at=timezone.now() + timedelta(seconds=settings.SEAT_HOLD_TTL)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0007_add_bus_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='payment_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Canceled'), ('expired', 'Expired')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('payment_status', 'pending')), fields=['hold_expires_at'], name='booking_hold_expiry_idx'),
+        ),
+        migrations.RunPython(hold_existing_pending, migrations.RunPython.noop),
+    ]
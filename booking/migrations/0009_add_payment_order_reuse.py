@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0008_add_seat_holds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='order_amount',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='order_created_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0009_add_payment_order_reuse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=100, unique=True)),
+                ('event', models.CharField(max_length=50)),
+                ('payment_id', models.CharField(blank=True, db_index=True, max_length=200, null=True)),
+                ('order_id', models.CharField(blank=True, max_length=200, null=True)),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('outcome', models.CharField(blank=True, max_length=20)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='payment_event_pending_idx')],
+            },
+        ),
+    ]
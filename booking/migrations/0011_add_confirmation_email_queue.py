@@ -0,0 +1,44 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:38
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_confirmed(apps, schema_editor):
+    # Completed bookings from before the queue already got their email
+    Booking = apps.get_model('booking', 'Booking')
+    Booking.objects.filter(payment_status='completed', confirmation_sent_at=None).update(
+        confirmation_sent_at=F('modified_at')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0010_add_payment_events'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='confirmation_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='confirmation_next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='confirmation_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('confirmation_sent_at__isnull', True), ('payment_status', 'completed')), fields=['id'], name='booking_confirmation_queue_idx'),
+        ),
+        migrations.RunPython(mark_existing_confirmed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0011_add_confirmation_email_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='seat_numbers',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='seatinventory',
+            name='seat_map',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+    ]
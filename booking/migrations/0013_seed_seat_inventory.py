@@ -0,0 +1,48 @@
+from django.db import migrations
+from booking.management.commands.reconcile_inventory import booked_totals
+
+BATCH_SIZE = 1000
+
+
+# SeatInventory started out empty, so bookings made before it existed did not
+# count against availability until reconcile_inventory was run by hand. Build
+# held and sold for every booked departure from its bookings, as that command
+# does, creating the rows that are missing.
+def seed_seat_inventory(apps, schema_editor):
+    Booking = apps.get_model('booking', 'Booking')
+    SeatInventory = apps.get_model('booking', 'SeatInventory')
+    db = schema_editor.connection.alias
+
+    def save(batch):
+        SeatInventory.objects.using(db).bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['bus', 'date'],
+            update_fields=['seats_held', 'seats_sold'],
+        )
+
+    batch = []
+    for row in booked_totals(Booking.objects.using(db)).iterator(chunk_size=BATCH_SIZE):
+        batch.append(SeatInventory(
+            bus_id=row['bus_id'],
+            date=row['booking_date'],
+            seats_total=row['seats_total'],
+            seats_held=row['held'],
+            seats_sold=row['sold'],
+        ))
+        if len(batch) >= BATCH_SIZE:
+            save(batch)
+            batch = []
+    if batch:
+        save(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0012_add_seat_maps'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_seat_inventory, migrations.RunPython.noop),
+    ]
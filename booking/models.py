@@ -1,8 +1,27 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
 
+class BusQuerySet(models.QuerySet):
+    def with_available_seats(self, date, include_held=False):
+        # Reads the per-departure SeatInventory row through a correlated
+        # subquery, so the whole result set costs one query. Departures
+        # without an inventory row have nothing booked yet.
+        taken = F('seats_sold') + F('seats_held') if include_held else F('seats_sold')
+        inventory = SeatInventory.objects.filter(
+            bus=OuterRef('pk'),
+            date=date
+        ).annotate(available=F('seats_total') - taken).values('available')[:1]
+        return self.annotate(
+            available_seats=Coalesce(Subquery(inventory), F('total_seats'))
+        )
+
 class Bus(models.Model):
     bus_name = models.CharField(max_length=200)
     bus_number = models.CharField(max_length=20, unique=True)
@@ -13,19 +32,27 @@ class Bus(models.Model):
     departure_time = models.TimeField()
     arrival_time = models.TimeField()
     journey_duration = models.CharField(max_length=50, help_text="e.g., 8 hours 30 minutes")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BusQuerySet.as_manager()
     
     def __str__(self):
         return f"{self.bus_name} ({self.bus_number})"
     
     class Meta:
         verbose_name_plural = "Buses"
+        indexes = [
+            # Keyset pagination order for bus listings
+            models.Index(fields=['departure_time', 'id'], name='bus_departure_idx'),
+        ]
         
 class Booking(models.Model):
     PAYMENT_STATUS =[
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
-        ('cancelled', 'Canceled')
+        ('cancelled', 'Canceled'),
+        ('expired', 'Expired'),
     ]
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     bus = models.ForeignKey(Bus, on_delete=models.CASCADE)
@@ -39,27 +66,111 @@ class Booking(models.Model):
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS, default='pending')
     payment_id = models.CharField(max_length=200, blank=True, null=True)
     order_id = models.CharField(max_length=200, blank=True, null=True)
+    # Amount in paise and creation time of order_id, to reuse the order
+    order_amount = models.PositiveIntegerField(blank=True, null=True)
+    order_created_at = models.DateTimeField(blank=True, null=True)
     payment_method = models.CharField(max_length=50, blank=True, null=True)
     booking_reference = models.CharField(max_length=20, unique=True)
     modified_at = models.DateTimeField(auto_now=True)
+    # Until when a pending booking's seats are held for payment
+    hold_expires_at = models.DateTimeField(blank=True, null=True)
+    # Confirmation email queue state, see booking.emails
+    confirmation_sent_at = models.DateTimeField(blank=True, null=True)
+    confirmation_attempts = models.PositiveSmallIntegerField(default=0)
+    confirmation_next_attempt_at = models.DateTimeField(blank=True, null=True)
+    # Seats chosen on the seat map; empty for bookings that only count seats
+    seat_numbers = models.JSONField(default=list, blank=True)
 
     def __str__(self):
         return f"{self.booking_reference} - {self.user.username}"
     
     def get_available_seats(bus, date):
-        booked = Booking.objects.filter(
-            bus=bus, 
-            booking_date=date,
-            payment_status='completed'
-        ).aggregate(total=models.Sum('seats_booked'))['total'] or 0
-        return bus.total_seats - booked
+        from .inventory import get_available_seats
+        return get_available_seats(bus, date, include_held=True)
     
+    class Meta:
+        indexes = [
+            # Per-departure seat totals by status (reconcile_inventory)
+            models.Index(fields=['bus', 'booking_date', 'payment_status'], name='booking_departure_status_idx'),
+            # Sold seats per departure only need the completed rows
+            models.Index(
+                fields=['bus', 'booking_date'],
+                name='booking_departure_sold_idx',
+                condition=models.Q(payment_status='completed'),
+            ),
+            # payment_success looks bookings up by Razorpay order
+            models.Index(
+                fields=['order_id'],
+                name='booking_order_id_idx',
+                condition=models.Q(order_id__isnull=False),
+            ),
+            # my_bookings lists a user's bookings newest first
+            models.Index(fields=['user', '-booking_time'], name='booking_user_time_idx'),
+            # Completed bookings still waiting for their confirmation email
+            models.Index(
+                fields=['id'],
+                name='booking_confirmation_queue_idx',
+                condition=models.Q(payment_status='completed', confirmation_sent_at__isnull=True),
+            ),
+            # The hold sweeper walks expired pending bookings oldest first
+            models.Index(
+                fields=['hold_expires_at'],
+                name='booking_hold_expiry_idx',
+                condition=models.Q(payment_status='pending'),
+            ),
+        ]
+
     def can_modify(self):
         return self.payment_status == 'pending'
+
+    def start_hold(self):
+        self.hold_expires_at = timezone.now() + timedelta(seconds=settings.SEAT_HOLD_TTL)
     
     def save(self, *args, **kwargs):
         if not self.booking_reference:
-            import random
-            import string
-            self.booking_reference = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-        super().save(*args, **kwargs)
\ No newline at end of file
+            from .references import new_booking_reference
+            self.booking_reference = new_booking_reference()
+        super().save(*args, **kwargs)
+
+class SeatInventory(models.Model):
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='inventory')
+    date = models.DateField()
+    seats_total = models.IntegerField(validators=[MinValueValidator(1)])
+    seats_held = models.IntegerField(default=0)
+    seats_sold = models.IntegerField(default=0)
+    # Bitmap of seats assigned to bookings, see booking.seatmap
+    seat_map = models.BinaryField(default=b'', blank=True)
+
+    def __str__(self):
+        return f"{self.bus.bus_number} on {self.date}: {self.seats_sold} sold, {self.seats_held} held"
+
+    @property
+    def available_seats(self):
+        return self.seats_total - self.seats_held - self.seats_sold
+
+    class Meta:
+        verbose_name_plural = "Seat inventory"
+        constraints = [
+            models.UniqueConstraint(fields=['bus', 'date'], name='unique_inventory_per_departure'),
+        ]
+
+class PaymentEvent(models.Model):
+    """A Razorpay webhook delivery, stored as received and applied later in batches."""
+    event_id = models.CharField(max_length=100, unique=True)
+    event = models.CharField(max_length=50)
+    payment_id = models.CharField(max_length=200, blank=True, null=True, db_index=True)
+    order_id = models.CharField(max_length=200, blank=True, null=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    # What applying the event did, e.g. 'completed' or 'duplicate'
+    outcome = models.CharField(max_length=20, blank=True)
+
+    def __str__(self):
+        return f"{self.event} {self.payment_id or self.event_id}"
+
+    class Meta:
+        indexes = [
+            # The consumer takes unprocessed events oldest first
+            models.Index(fields=['id'], name='payment_event_pending_idx', condition=models.Q(processed_at__isnull=True)),
+        ]
@@ -0,0 +1,195 @@
+import base64
+import json
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, previous_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def default_page_size():
+    return settings.REST_FRAMEWORK.get('PAGE_SIZE') or 10
+
+
+def _encode_cursor(values, backwards=False):
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    data = json.dumps({'v': values, 'b': backwards}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, model, fields):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = data['v']
+        backwards = bool(data.get('b'))
+        if len(values) != len(fields):
+            raise ValueError
+        return [model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(fields, values)], backwards
+    except Exception as e:
+        # Bad base64, bad JSON or values the model fields reject
+        raise InvalidCursor(str(e))
+
+
+def _seek(fields, values, backwards):
+    """(a, b) > (x, y) written out as a > x OR (a = x AND b > y), per direction."""
+    condition = Q()
+    for i, (name, descending) in enumerate(fields):
+        lookup = 'lt' if descending != backwards else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[i]})
+        for j in range(i):
+            step &= Q(**{fields[j][0]: values[j]})
+        condition |= step
+    return condition
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=None):
+    """
+    Return one KeysetPage of `queryset` ordered by `ordering`, e.g.
+    ('-booking_time', '-id'). The last field must be unique. The cost of a
+    page does not depend on how far into the result set it is, since each
+    cursor is turned into a WHERE clause instead of an OFFSET.
+    """
+    query = _KeysetQuery(queryset, ordering, cursor, page_size)
+    return query.page(list(query.queryset))
+
+
+async def akeyset_paginate(queryset, ordering, cursor=None, page_size=None):
+    """keyset_paginate() for async views."""
+    query = _KeysetQuery(queryset, ordering, cursor, page_size)
+    return query.page([row async for row in query.queryset])
+
+
+class _KeysetQuery:
+    def __init__(self, queryset, ordering, cursor, page_size):
+        self.page_size = page_size or default_page_size()
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.cursor = cursor
+        self.backwards = False
+        if cursor:
+            values, self.backwards = _decode_cursor(cursor, queryset.model, self.fields)
+            queryset = queryset.filter(_seek(self.fields, values, self.backwards))
+
+        if self.backwards:
+            queryset = queryset.order_by(*[name if descending else f'-{name}' for name, descending in self.fields])
+        else:
+            queryset = queryset.order_by(*ordering)
+        self.queryset = queryset[:self.page_size + 1]
+
+    def key(self, item):
+        if isinstance(item, dict):
+            return [item[name] for name, _ in self.fields]
+        return [getattr(item, name) for name, _ in self.fields]
+
+    def page(self, rows):
+        has_more = len(rows) > self.page_size
+        items = rows[:self.page_size]
+        if self.backwards:
+            items.reverse()
+
+        next_cursor = previous_cursor = None
+        if items:
+            if has_more or self.backwards:
+                next_cursor = _encode_cursor(self.key(items[-1]))
+            if (has_more and self.backwards) or (self.cursor and not self.backwards):
+                previous_cursor = _encode_cursor(self.key(items[0]), backwards=True)
+        return KeysetPage(items, next_cursor, previous_cursor)
+
+
+def estimated_count(queryset):
+    """
+    The planner's row estimate on PostgreSQL, which costs no table scan but
+    can be off for small or freshly changed tables. Other databases get an
+    exact count.
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF pagination over keyset_paginate(). The response has next/previous
+    links and, only when asked for with ?count=exact or ?count=approx, a
+    total count.
+    """
+    ordering = ('id',)
+    results_key = 'results'
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_query_param = 'count'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, default_page_size()))
+        except ValueError:
+            size = default_page_size()
+        return max(1, min(size, self.max_page_size))
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'approx':
+            return estimated_count(queryset)
+        return None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = self.get_count(queryset, request)
+        try:
+            self.page = keyset_paginate(
+                queryset,
+                self.ordering,
+                request.query_params.get(self.cursor_query_param),
+                self.get_page_size(request),
+            )
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return self.page.items
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(remove_query_param(url, self.count_query_param), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            self.results_key: data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
+
+class BookingKeysetPagination(KeysetPagination):
+    ordering = ('-booking_time', '-id')
+    results_key = 'bookings'
+
+
+class BusKeysetPagination(KeysetPagination):
+    ordering = ('departure_time', 'id')
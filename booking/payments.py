@@ -0,0 +1,371 @@
+"""
+Razorpay order handling and webhook processing. Orders are created at most
+once per booking and amount and then reused, every gateway call has a
+timeout and a bounded number of retries, and a circuit breaker stops calling
+the gateway for a while after repeated failures so worker threads do not
+pile up on it. Async views create orders through an httpx client with the
+same timeout, retries and breaker. Webhook deliveries are stored as PaymentEvent rows and
+applied to bookings in batches by a Celery task.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+import httpx
+import razorpay
+import requests
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from razorpay.errors import BadRequestError, GatewayError, ServerError
+from . import metrics
+from .inventory import STATUS_COLUMNS, adjust_inventory
+from .models import Booking, PaymentEvent
+from .seatmap import SeatsUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class CircuitOpenError(PaymentGatewayError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open every
+    call is refused for `reset_timeout` seconds, then one trial call is let
+    through: success closes the breaker again, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Half-open: let this call through, hold the rest back until
+                # it reports back
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
+
+
+def build_client():
+    return razorpay.Client(
+        auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET),
+        base_url=settings.RAZORPAY_BASE_URL,
+    )
+
+
+razorpay_client = build_client()
+breaker = CircuitBreaker(settings.RAZORPAY_BREAKER_THRESHOLD, settings.RAZORPAY_BREAKER_RESET_TIMEOUT)
+
+# Network trouble and 5xx responses are worth retrying; a rejected request
+# will be rejected again.
+RETRYABLE_ERRORS = (requests.RequestException, GatewayError, ServerError)
+
+
+def order_amount(booking):
+    return int(booking.total_price * 100)  # Convert to paise
+
+
+def has_valid_order(booking, amount):
+    if not booking.order_id or booking.order_amount != amount or booking.order_created_at is None:
+        return False
+    return timezone.now() - booking.order_created_at < timedelta(seconds=settings.RAZORPAY_ORDER_MAX_AGE)
+
+
+def create_order(amount, receipt):
+    retries = settings.RAZORPAY_RETRIES
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            raise CircuitOpenError('Payment gateway is unavailable')
+        try:
+            with metrics.timed('razorpay', 'order.create'):
+                order = razorpay_client.order.create({
+                    'amount': amount,
+                    'currency': 'INR',
+                    'receipt': receipt,
+                    'payment_capture': 1
+                }, timeout=settings.RAZORPAY_TIMEOUT)
+        except BadRequestError as e:
+            breaker.record_success()
+            raise PaymentGatewayError(str(e)) from e
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            logger.warning('Razorpay order create failed (attempt %d/%d): %s', attempt + 1, retries + 1, e)
+            if attempt == retries:
+                raise PaymentGatewayError(str(e)) from e
+            time.sleep(settings.RAZORPAY_RETRY_BACKOFF * 2 ** attempt)
+        else:
+            breaker.record_success()
+            return order
+
+
+def ensure_order(booking):
+    """
+    Return a Razorpay order id for the booking's current amount, creating an
+    order only when the booking has no usable one. When two requests race,
+    the first order stored wins and the other is discarded unused.
+    """
+    amount = order_amount(booking)
+    if has_valid_order(booking, amount):
+        return booking.order_id
+
+    order = create_order(amount, booking.booking_reference)
+    created_at = timezone.now()
+    stored = Booking.objects.filter(pk=booking.pk, order_id=booking.order_id).update(
+        order_id=order['id'], order_amount=amount, order_created_at=created_at
+    )
+    if stored:
+        booking.order_id, booking.order_amount, booking.order_created_at = order['id'], amount, created_at
+    else:
+        booking.refresh_from_db(fields=['order_id', 'order_amount', 'order_created_at'])
+    return booking.order_id
+
+
+# httpx clients for async views, one per event loop since a client cannot
+# be shared between loops. Tests set async_transport to answer from a fake.
+async_transport = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(
+            base_url=settings.RAZORPAY_BASE_URL,
+            auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET),
+            timeout=settings.RAZORPAY_TIMEOUT,
+            transport=async_transport,
+        )
+    return client
+
+
+async def acreate_order(amount, receipt):
+    """create_order() without blocking the event loop while the gateway answers."""
+    retries = settings.RAZORPAY_RETRIES
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            raise CircuitOpenError('Payment gateway is unavailable')
+        try:
+            with metrics.timed('razorpay', 'order.create'):
+                response = await async_client().post('/v1/orders', json={
+                    'amount': amount,
+                    'currency': 'INR',
+                    'receipt': receipt,
+                    'payment_capture': 1
+                })
+        except httpx.HTTPError as e:
+            error = e
+        else:
+            if response.status_code < 500:
+                breaker.record_success()
+                order = response.json()
+                if response.status_code != 200 or 'error' in order:
+                    raise PaymentGatewayError(order.get('error', {}).get('description', response.text))
+                return order
+            error = f'HTTP {response.status_code}'
+        breaker.record_failure()
+        logger.warning('Razorpay order create failed (attempt %d/%d): %s', attempt + 1, retries + 1, error)
+        if attempt == retries:
+            raise PaymentGatewayError(str(error))
+        await asyncio.sleep(settings.RAZORPAY_RETRY_BACKOFF * 2 ** attempt)
+
+
+async def aensure_order(booking):
+    """ensure_order() for async views."""
+    amount = order_amount(booking)
+    if has_valid_order(booking, amount):
+        return booking.order_id
+
+    order = await acreate_order(amount, booking.booking_reference)
+    created_at = timezone.now()
+    stored = await Booking.objects.filter(pk=booking.pk, order_id=booking.order_id).aupdate(
+        order_id=order['id'], order_amount=amount, order_created_at=created_at
+    )
+    if stored:
+        booking.order_id, booking.order_amount, booking.order_created_at = order['id'], amount, created_at
+    else:
+        await booking.arefresh_from_db(fields=['order_id', 'order_amount', 'order_created_at'])
+    return booking.order_id
+
+
+def verify_payment_signature(order_id, payment_id, signature):
+    razorpay_client.utility.verify_payment_signature({
+        'razorpay_order_id': order_id,
+        'razorpay_payment_id': payment_id,
+        'razorpay_signature': signature
+    })
+
+
+# Webhook events that mean the booking's order has been paid
+COMPLETING_EVENTS = {'payment.captured', 'order.paid'}
+
+
+def record_payment_event(body, signature, event_id=None):
+    """
+    Verify a webhook delivery and store it for apply_payment_events(). A
+    redelivered event (same X-Razorpay-Event-Id) is stored only once.
+    Raises ValueError for a body that is not a JSON event object.
+    """
+    if not settings.RAZORPAY_WEBHOOK_SECRET:
+        raise ImproperlyConfigured('RAZORPAY_WEBHOOK_SECRET is not set')
+    razorpay_client.utility.verify_webhook_signature(
+        body.decode(), signature or '', settings.RAZORPAY_WEBHOOK_SECRET
+    )
+    data = json.loads(body)
+    payment = data
+    for key in ('payload', 'payment', 'entity'):
+        payment = payment.get(key, {}) if isinstance(payment, dict) else None
+    if not isinstance(data, dict) or not isinstance(payment, dict):
+        raise ValueError('Webhook body is not a Razorpay event')
+    event = PaymentEvent(
+        event_id=event_id or f"{data.get('event')}:{payment.get('id')}",
+        event=data.get('event', ''),
+        payment_id=payment.get('id'),
+        order_id=payment.get('order_id'),
+        payload=data,
+    )
+    PaymentEvent.objects.bulk_create([event], ignore_conflicts=True)
+
+
+def apply_payment_events(batch_size=500):
+    """
+    Apply stored webhook events oldest first, batch_size per transaction.
+    Events locked by another consumer are skipped. Returns how many events
+    were processed.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                PaymentEvent.objects.filter(processed_at=None).order_by('id')
+                .select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not events:
+                break
+            _apply_batch(events)
+        processed += len(events)
+        if len(events) < batch_size:
+            break
+    return processed
+
+
+def _apply_batch(events):
+    from .emails import queue_confirmation_emails
+
+    now = timezone.now()
+    order_ids = {event.order_id for event in events if event.event in COMPLETING_EVENTS and event.order_id}
+    bookings = {
+        booking.order_id: booking
+        for booking in Booking.objects.select_for_update(of=('self',)).select_related('bus').filter(order_id__in=order_ids)
+    }
+
+    seen_payments = set()
+    completed = []
+    sold_out = []
+    refunds = []
+    departures = {}
+    deltas = defaultdict(lambda: defaultdict(int))
+    for event in events:
+        event.processed_at = now
+        booking = bookings.get(event.order_id)
+        if event.event not in COMPLETING_EVENTS:
+            event.outcome = 'ignored'
+        elif event.payment_id in seen_payments or (
+            booking and (booking.payment_status == 'completed' or booking.payment_id == event.payment_id)
+        ):
+            event.outcome = 'duplicate'
+        elif booking is None:
+            event.outcome = 'unknown_order'
+        else:
+            seen_payments.add(event.payment_id)
+            if booking.payment_status in STATUS_COLUMNS:
+                event.outcome = 'completed'
+                key = (booking.bus_id, booking.booking_date)
+                departures[key] = booking.bus
+                deltas[key][STATUS_COLUMNS[booking.payment_status]] -= booking.seats_booked
+                deltas[key]['seats_sold'] += booking.seats_booked
+            elif booking.payment_status == 'expired':
+                # Paid after its hold expired; see apply_booking_change(). It
+                # only gets its seats back if the departure still has them.
+                booking.seat_numbers = []
+                try:
+                    with transaction.atomic():
+                        adjust_inventory(booking.bus, booking.booking_date, seats_sold=booking.seats_booked)
+                    event.outcome = 'completed'
+                except SeatsUnavailable:
+                    event.outcome = 'sold_out'
+            else:
+                # Cancelled or failed before the payment came in: it stays
+                # that way, and keeps the payment id for the refund
+                event.outcome = 'refund'
+            if event.outcome == 'completed':
+                booking.payment_status = 'completed'
+                completed.append(booking)
+            elif event.outcome == 'sold_out':
+                booking.payment_status = 'failed'
+                sold_out.append(booking)
+            else:
+                refunds.append(booking)
+            booking.payment_id = event.payment_id
+            booking.payment_method = 'Razorpay'
+            booking.modified_at = now
+
+    if sold_out:
+        logger.warning('Refund needed, paid after the hold expired and sold out: %s',
+                       ', '.join(booking.payment_id for booking in sold_out))
+    if refunds:
+        logger.warning('Refund needed, paid for a cancelled or failed booking: %s',
+                       ', '.join(booking.payment_id for booking in refunds))
+    Booking.objects.bulk_update(
+        completed + sold_out + refunds,
+        ['payment_status', 'payment_id', 'payment_method', 'modified_at', 'seat_numbers'],
+    )
+    # In key order, so concurrent consumers lock inventory rows in the same
+    # order; see apply_booking_change()
+    for key in sorted(deltas):
+        adjust_inventory(departures[key], key[1], **deltas[key])
+    PaymentEvent.objects.bulk_update(events, ['processed_at', 'outcome'])
+    if completed:
+        transaction.on_commit(queue_confirmation_emails)
@@ -0,0 +1,238 @@
+"""
+Read replicas. ReplicaRouter sends reads of the bus catalogue and of seat
+availability to a PostgreSQL streaming replica and everything else to the
+primary ('default'). Those reads stay on the primary:
+
+- inside a transaction on the primary, where a read usually feeds a write;
+- for the rest of a request once it has written anything;
+- for PRIMARY_PIN_SECONDS after a request that wrote (a booking, payment or
+  change), so users always see their own writes even while the replicas
+  catch up. ReplicaPinMiddleware pins the client with a cookie and, for a
+  signed-in user, with a cache entry for their id, since API clients using
+  JWTs do not usually send cookies back.
+
+ReplicaMonitor measures each replica's lag in a background thread and keeps
+a replica out of rotation while it is unreachable, not receiving WAL from
+the primary, or more than REPLICA_MAX_LAG seconds behind. With no replica in rotation, or none
+configured (DB_REPLICAS), every query goes to the primary.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'primary_pin'
+PIN_CACHE_KEY = 'primary_pin:user:{}'
+
+# Models whose reads may be served by a replica
+REPLICA_MODELS = {'booking.bus', 'booking.seatinventory'}
+
+
+def _user_id(request):
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+class _RequestState:
+    def __init__(self, request=None, pinned=False):
+        self.request = request
+        self.pinned = pinned
+        self.wrote = False
+        self._user_checked = False
+
+    def user_pinned(self):
+        # Looked up on the first replica read rather than when the request
+        # comes in: JWT users are only authenticated once the view runs
+        if not self._user_checked and self.request is not None:
+            user_id = _user_id(self.request)
+            if user_id is not None:
+                self._user_checked = True
+                try:
+                    self.pinned = cache.get(PIN_CACHE_KEY.format(user_id)) is not None
+                except Exception:
+                    # Cannot tell, so play safe
+                    self.pinned = True
+        return self.pinned
+
+
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+def pin_to_primary():
+    """Send the rest of the current request's reads to the primary."""
+    state = _request_state.get()
+    if state is not None:
+        state.pinned = True
+
+
+def _on_primary():
+    state = _request_state.get()
+    if state is not None and (state.pinned or state.wrote or state.user_pinned()):
+        return True
+    return connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+def measure_lag(alias):
+    """
+    Seconds the replica is behind its primary; 0 when it has replayed
+    everything it received. None when it is not streaming WAL from the
+    primary: it has then replayed all it received, however stale that is.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_is_in_recovery(), '
+            "(SELECT status = 'streaming' FROM pg_stat_wal_receiver), "
+            'pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn(), '
+            'EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())'
+        )
+        in_recovery, streaming, caught_up, behind = cursor.fetchone()
+    if not in_recovery:
+        return 0.0
+    if not streaming:
+        return None
+    return 0.0 if caught_up else float(behind or 0)
+
+
+class ReplicaMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.lag = {}
+        self.healthy = []
+
+    def check(self):
+        lag = {}
+        for alias in settings.DATABASE_REPLICAS:
+            try:
+                lag[alias] = measure_lag(alias)
+                if lag[alias] is None:
+                    logger.warning('Replica %s is not receiving WAL from the primary', alias)
+            except DatabaseError as e:
+                lag[alias] = None
+                logger.warning('Replica %s is unreachable: %s', alias, e)
+                connections[alias].close()
+        healthy = [alias for alias, seconds in lag.items() if seconds is not None and seconds <= settings.REPLICA_MAX_LAG]
+        for alias in set(self.healthy) - set(healthy):
+            logger.warning('Taking replica %s out of rotation, lag %s', alias, lag[alias])
+        self.lag, self.healthy = lag, healthy
+
+    def run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:  # keep monitoring whatever happens
+                logger.exception('Replica lag check failed')
+            time.sleep(settings.REPLICA_LAG_CHECK_INTERVAL)
+
+    def start(self):
+        # Started lazily, and again in a process forked after the first start
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self.healthy = []
+                self._thread = threading.Thread(target=self.run, name='replica-monitor', daemon=True)
+                self._thread.start()
+
+    def choose(self):
+        """A replica in rotation, or None for the primary."""
+        if self._thread is None or self._pid != os.getpid():
+            self.start()
+        healthy = self.healthy
+        return random.choice(healthy) if healthy else None
+
+
+monitor = ReplicaMonitor()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or model._meta.label_lower not in REPLICA_MODELS:
+            return DEFAULT_DB_ALIAS
+        if _on_primary():
+            return DEFAULT_DB_ALIAS
+        return monitor.choose() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaPinMiddleware:
+    """
+    Tracks whether a request wrote to the primary and, if it did, keeps the
+    client's reads on the primary for PRIMARY_PIN_SECONDS: through a cookie,
+    and through a cache entry for the signed-in user.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state.wrote and settings.DATABASE_REPLICAS:
+            # Reading the session user may query the database
+            return await sync_to_async(self.finish)(state, response)
+        return response
+
+    def start(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        state = _RequestState(request, pinned=pinned_until > time.time())
+        return state, _request_state.set(state)
+
+    def finish(self, state, response):
+        if state.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, str(int(time.time() + settings.PRIMARY_PIN_SECONDS)),
+                max_age=settings.PRIMARY_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+            user_id = _user_id(state.request)
+            if user_id is not None:
+                try:
+                    cache.set(PIN_CACHE_KEY.format(user_id), 1, timeout=settings.PRIMARY_PIN_SECONDS)
+                except Exception as e:
+                    logger.warning('Could not pin user %s to the primary: %s', user_id, e)
+        return response
@@ -0,0 +1,82 @@
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from .cache import get_catalogue_version
+from .models import Bus
+
+
+def filter_route(buses, source='', destination=''):
+    """
+    Narrow a Bus queryset to a route. On PostgreSQL the substring matches are
+    served by the trigram indexes from migration 0005.
+    """
+    if source:
+        buses = buses.filter(source__icontains=source.strip())
+    if destination:
+        buses = buses.filter(destination__icontains=destination.strip())
+    return buses
+
+
+def normalize_city(name):
+    return ' '.join(name.split()).casefold()
+
+
+class CityIndex:
+    """
+    Sorted in-memory list of every city that appears as a bus source or
+    destination, for prefix lookups with bisect. The index is rebuilt when
+    the shared catalogue version changes, and at least every
+    ROUTE_INDEX_MAX_AGE seconds when the cache is unavailable.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._names = []
+        self._version = None
+        self._built_at = None
+
+    def invalidate(self):
+        self._built_at = None
+
+    def _is_stale(self, version):
+        if self._built_at is None:
+            return True
+        if version is None:
+            return time.monotonic() - self._built_at > settings.ROUTE_INDEX_MAX_AGE
+        return version != self._version
+
+    def refresh(self, version=None):
+        cities = {}
+        for field in ('source', 'destination'):
+            # From the primary: the index is kept until the catalogue version changes
+            for name in Bus.objects.using(DEFAULT_DB_ALIAS).order_by().values_list(field, flat=True).distinct():
+                cities.setdefault(normalize_city(name), ' '.join(name.split()))
+        keys = sorted(cities)
+        with self._lock:
+            self._keys = keys
+            self._names = [cities[key] for key in keys]
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def suggest(self, prefix, limit=10):
+        version = get_catalogue_version()
+        if self._is_stale(version):
+            self.refresh(version)
+
+        prefix = normalize_city(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            keys, names = self._keys, self._names
+        results = []
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix) and len(results) < limit:
+            results.append(names[i])
+            i += 1
+        return results
+
+
+city_index = CityIndex()
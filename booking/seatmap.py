@@ -0,0 +1,96 @@
+"""
+Seat maps. Each SeatInventory row keeps a bitmap of the seats assigned to
+bookings on that departure, one bit per seat, so a 50-seat bus costs seven
+bytes and checking a seat is one bit lookup.
+
+Seat maps sit on top of the seat counts rather than replacing them: a
+booking that picked no seats still takes seats_held or seats_sold but sets
+no bits. Claiming seats therefore needs the seats to be free on the map and
+enough unreserved seats left in the counts.
+"""
+from django.db import transaction
+from .models import SeatInventory
+
+
+class SeatsUnavailable(Exception):
+    def __init__(self, message, seats=()):
+        super().__init__(message)
+        self.seats = list(seats)
+
+
+class SeatMap:
+    """Bit n - 1 (most significant bit first) is set when seat n is assigned."""
+
+    def __init__(self, data=b''):
+        self.bits = bytearray(data or b'')
+
+    def is_taken(self, seat):
+        index = seat - 1
+        return index >> 3 < len(self.bits) and bool(self.bits[index >> 3] & 0x80 >> (index & 7))
+
+    def take(self, seats):
+        for seat in seats:
+            index = seat - 1
+            if index >> 3 >= len(self.bits):
+                self.bits.extend(bytes((index >> 3) + 1 - len(self.bits)))
+            self.bits[index >> 3] |= 0x80 >> (index & 7)
+
+    def release(self, seats):
+        for seat in seats:
+            if self.is_taken(seat):
+                index = seat - 1
+                self.bits[index >> 3] &= ~(0x80 >> (index & 7)) & 0xFF
+
+    def count(self):
+        return int.from_bytes(self.bits, 'big').bit_count()
+
+    def taken(self):
+        return [
+            byte_index * 8 + bit + 1
+            for byte_index, byte in enumerate(self.bits) if byte
+            for bit in range(8) if byte & 0x80 >> bit
+        ]
+
+    def to_bytes(self, seats=0):
+        """The bitmap, zero-padded to hold at least `seats` seats."""
+        return bytes(self.bits) + bytes(max(0, (seats + 7) // 8 - len(self.bits)))
+
+
+def lock_departure(bus, date):
+    SeatInventory.objects.get_or_create(bus=bus, date=date, defaults={'seats_total': bus.total_seats})
+    return SeatInventory.objects.select_for_update().get(bus=bus, date=date)
+
+
+def claim_seats(bus, date, seats):
+    """
+    Assign the given seat numbers on (bus, date) or raise SeatsUnavailable.
+    The inventory row stays locked until the caller's transaction ends, so
+    the caller can record the booking and its seat counts before anyone
+    else claims from the same departure.
+    """
+    with transaction.atomic(savepoint=False):
+        row = lock_departure(bus, date)
+        missing = [seat for seat in seats if not 1 <= seat <= row.seats_total]
+        if missing:
+            raise SeatsUnavailable(f'This bus has seats 1 to {row.seats_total}', missing)
+        seat_map = SeatMap(row.seat_map)
+        taken = [seat for seat in seats if seat_map.is_taken(seat)]
+        if taken:
+            raise SeatsUnavailable('Some of these seats are already taken', taken)
+        if len(seats) > row.available_seats:
+            raise SeatsUnavailable(f'Only {max(row.available_seats, 0)} seats available')
+        seat_map.take(seats)
+        SeatInventory.objects.filter(pk=row.pk).update(seat_map=seat_map.to_bytes())
+
+
+def release_seats(bus_id, date, seats):
+    """Clear seat numbers a booking no longer holds from the departure's map."""
+    if not seats:
+        return
+    with transaction.atomic(savepoint=False):
+        row = SeatInventory.objects.select_for_update().filter(bus_id=bus_id, date=date).first()
+        if row is None:
+            return
+        seat_map = SeatMap(row.seat_map)
+        seat_map.release(seats)
+        SeatInventory.objects.filter(pk=row.pk).update(seat_map=seat_map.to_bytes())
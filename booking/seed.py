@@ -0,0 +1,127 @@
+"""Synthetic data for benchmarks and query-plan checks. Never run against production."""
+import random
+import uuid
+from datetime import date, time, timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from .inventory import STATUS_COLUMNS, invalidate_availability
+from .models import Bus, Booking, SeatInventory
+from .references import new_booking_reference
+
+CITIES = [
+    'Delhi', 'Mumbai', 'Bengaluru', 'Chennai', 'Kolkata', 'Hyderabad', 'Pune', 'Ahmedabad',
+    'Jaipur', 'Lucknow', 'Kanpur', 'Nagpur', 'Indore', 'Bhopal', 'Patna', 'Vadodara',
+    'Surat', 'Goa', 'Mysuru', 'Coimbatore', 'Kochi', 'Madurai', 'Visakhapatnam', 'Agra',
+]
+
+STATUS_WEIGHTS = [('completed', 70), ('pending', 15), ('failed', 5), ('cancelled', 10)]
+
+
+def seed_buses(count, batch_size=2000, rng=random):
+    prefix = uuid.uuid4().hex[:6].upper()
+    buses = []
+    for i in range(count):
+        source, destination = rng.sample(CITIES, 2)
+        departure = rng.randrange(0, 24 * 60, 15)
+        duration = rng.randrange(120, 16 * 60, 15)
+        arrival = (departure + duration) % (24 * 60)
+        buses.append(Bus(
+            bus_name=f'{source} {destination} Express',
+            bus_number=f'S{prefix}-{i:06d}',
+            source=source,
+            destination=destination,
+            total_seats=rng.choice([30, 36, 40, 45, 50]),
+            price=Decimal(rng.randrange(300, 3000, 50)),
+            departure_time=time(departure // 60, departure % 60),
+            arrival_time=time(arrival // 60, arrival % 60),
+            journey_duration=f'{duration // 60} hours {duration % 60} minutes',
+        ))
+    return Bus.objects.bulk_create(buses, batch_size=batch_size)
+
+
+def seed_users(count, password='loadtest123'):
+    prefix = uuid.uuid4().hex[:6]
+    users = [User(username=f'seed_{prefix}_{i}', email=f'seed_{prefix}_{i}@example.com') for i in range(count)]
+    hashed = User(username='template')
+    hashed.set_password(password)
+    for user in users:
+        user.password = hashed.password
+    return User.objects.bulk_create(users, batch_size=2000)
+
+
+def seed_bookings(count, buses, users, days=60, batch_size=5000, rng=random):
+    """
+    Create `count` bookings spread over the next `days` days, with the
+    SeatInventory rows to match. A booking that would overfill its
+    departure is seeded as cancelled instead. Returns the number created.
+    """
+    statuses = [status for status, _ in STATUS_WEIGHTS]
+    weights = [weight for _, weight in STATUS_WEIGHTS]
+    today = date.today()
+    sent_at = timezone.now()
+    # {(bus_id, date): {'seats_total': ..., 'seats_held': ..., 'seats_sold': ...}}
+    inventory = {}
+    created = 0
+    while created < count:
+        picks = []
+        for _ in range(min(batch_size, count - created)):
+            bus = rng.choice(buses)
+            travel_date = today + timedelta(days=rng.randrange(days))
+            picks.append((bus, travel_date, rng.randint(1, 4), rng.choices(statuses, weights)[0]))
+        load_inventory(inventory, {(bus, travel_date) for bus, travel_date, _, _ in picks})
+
+        batch, changed = [], set()
+        for bus, travel_date, seats, payment_status in picks:
+            counts = inventory[bus.id, travel_date]
+            column = STATUS_COLUMNS.get(payment_status)
+            if column and counts['seats_held'] + counts['seats_sold'] + seats > counts['seats_total']:
+                payment_status, column = 'cancelled', None
+            if column:
+                counts[column] += seats
+                changed.add((bus.id, travel_date))
+            batch.append(Booking(
+                user=rng.choice(users),
+                bus=bus,
+                booking_date=travel_date,
+                seats_booked=seats,
+                total_price=bus.price * seats,
+                passenger_name='Seed Passenger',
+                passenger_email='seed@example.com',
+                passenger_phone='+91-9000000000',
+                payment_status=payment_status,
+                order_id=f'order_{uuid.uuid4().hex[:14]}' if payment_status != 'pending' else None,
+                booking_reference=new_booking_reference(),
+                # Keep seeded bookings out of the confirmation email queue
+                confirmation_sent_at=sent_at if payment_status == 'completed' else None,
+            ))
+        with transaction.atomic():
+            Booking.objects.bulk_create(batch, batch_size=batch_size)
+            SeatInventory.objects.bulk_create(
+                [SeatInventory(bus_id=bus_id, date=day, **inventory[bus_id, day]) for bus_id, day in changed],
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['bus', 'date'],
+                update_fields=['seats_held', 'seats_sold'],
+            )
+            for bus_id, day in changed:
+                invalidate_availability(bus_id, day)
+        created += len(batch)
+    return created
+
+
+def load_inventory(inventory, departures):
+    """Add the seat counts of the (bus, date) departures not yet in `inventory`."""
+    missing = {(bus.id, day): bus for bus, day in departures if (bus.id, day) not in inventory}
+    if not missing:
+        return
+    for (bus_id, day), bus in missing.items():
+        inventory[bus_id, day] = {'seats_total': bus.total_seats, 'seats_held': 0, 'seats_sold': 0}
+    rows = SeatInventory.objects.filter(
+        bus_id__in={bus_id for bus_id, _ in missing}, date__in={day for _, day in missing}
+    ).values('bus_id', 'date', 'seats_total', 'seats_held', 'seats_sold')
+    for row in rows:
+        key = (row.pop('bus_id'), row.pop('date'))
+        if key in missing:
+            inventory[key] = row
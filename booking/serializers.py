@@ -1,21 +1,90 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import models
+from decimal import Decimal
 from .models import Bus, Booking
 
 class BusSerializer(serializers.ModelSerializer):
     class Meta:
         model = Bus
-        fields = '__all__'
+        exclude = ['updated_at']
+
+class ValuesSerializer:
+    """
+    Read-only fast path for hot list endpoints: turns .values() dicts into
+    the same output a ModelSerializer would give, without building a
+    serializer field per object. Only plain, decimal, date and time
+    columns are supported.
+    """
+    def __init__(self, model, fields):
+        self.fields = list(fields)
+        self.converters = []
+        for name in self.fields:
+            field = model._meta.get_field(name)
+            if isinstance(field, models.DecimalField):
+                self.converters.append((name, self.decimal_converter(field.decimal_places)))
+            elif isinstance(field, (models.DateField, models.TimeField)):
+                self.converters.append((name, lambda value: value.isoformat()))
+
+    @staticmethod
+    def decimal_converter(places):
+        exponent = Decimal(1).scaleb(-places)
+        return lambda value: str(value.quantize(exponent))
+
+    def values(self, queryset):
+        return queryset.values(*self.fields)
+
+    def to_representation(self, row):
+        for name, convert in self.converters:
+            if row[name] is not None:
+                row[name] = convert(row[name])
+        return row
+
+    def many(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+BUS_VALUES = ValuesSerializer(Bus, [
+    'id', 'bus_name', 'bus_number', 'source', 'destination', 'total_seats',
+    'price', 'departure_time', 'arrival_time', 'journey_duration',
+])
+
+class BusAvailabilitySerializer(BusSerializer):
+    available_seats = serializers.IntegerField(read_only=True)
         
 class BookingSerializer(serializers.ModelSerializer):
     bus_name = serializers.CharField(source ='bus.bus_name', read_only=True)
+    # Optional: pick seats on the seat map, one per seat booked
+    seat_numbers = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
     class Meta:
         model = Booking
         fields = ['id', 'booking_reference', 'bus', 'bus_name', 
             'booking_date', 'seats_booked', 'passenger_name',
             'passenger_email', 'passenger_phone', 'total_price',
-            'payment_status']
-        read_only_fields = ['booking_reference','total_price','payment_status']
+            'payment_status', 'hold_expires_at', 'seat_numbers']
+        read_only_fields = ['booking_reference','total_price','payment_status','hold_expires_at']
+
+    def validate(self, data):
+        seat_numbers = data.get('seat_numbers')
+        if seat_numbers:
+            if len(set(seat_numbers)) != len(seat_numbers):
+                raise serializers.ValidationError({'seat_numbers': 'Each seat can only be picked once'})
+            if len(seat_numbers) != data.get('seats_booked'):
+                raise serializers.ValidationError({'seat_numbers': 'Pick one seat for every seat booked'})
+        return data
+        
+class BookingLineSerializer(serializers.ModelSerializer):
+    # A plain id: the buses of all lines are fetched in one query afterwards
+    bus = serializers.IntegerField(min_value=1)
+    class Meta:
+        model = Booking
+        fields = ['bus', 'booking_date', 'seats_booked', 'passenger_name',
+            'passenger_email', 'passenger_phone']
+
+class GroupBookingSerializer(serializers.Serializer):
+    bookings = BookingLineSerializer(many=True, allow_empty=False, max_length=settings.GROUP_BOOKING_MAX_LINES)
+    # Book the lines that fit instead of nothing when some do not
+    allow_partial = serializers.BooleanField(default=False)
         
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import bump_catalogue_version
+from .inventory import sync_seats_total
+from .models import Bus
+from .routes import city_index
+
+
+@receiver([post_save, post_delete], sender=Bus)
+def bus_changed(sender, instance, signal, created=False, **kwargs):
+    city_index.invalidate()
+    bump_catalogue_version()
+    if signal is post_save and not created:
+        # A new seat count applies to the departures still to come
+        sync_seats_total([instance.pk])
@@ -0,0 +1,96 @@
+"""
+A minimal SMTP server that accepts every message and keeps it in memory,
+for testing and benchmarking email sending without a real mail server.
+Run it with `manage.py smtp_sink`, or start one in-process with
+SMTPSink().start().
+"""
+import socketserver
+import threading
+import time
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        sink = self.server.sink
+        sink.connections += 1
+        if sink.connect_delay:
+            time.sleep(sink.connect_delay)
+        self.reply('220 smtp-sink ready')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 smtp-sink')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for raw in self.rfile:
+                    if raw in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(raw)
+                sink.received(sender, recipients, b''.join(data))
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            else:
+                self.reply('502 Command not implemented')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SMTPSink:
+    def __init__(self, host='127.0.0.1', port=0, keep=1000, connect_delay=0):
+        self.server = _Server((host, port), _Handler)
+        self.server.sink = self
+        self.keep = keep
+        # Seconds before the greeting, to stand in for TLS and AUTH round trips
+        self.connect_delay = connect_delay
+        self.messages = []
+        self.count = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def received(self, sender, recipients, data):
+        with self._lock:
+            self.count += 1
+            if len(self.messages) < self.keep:
+                self.messages.append((sender, recipients, data))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
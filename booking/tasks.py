@@ -1,73 +1,60 @@
 from celery import shared_task
-from django.core.mail import send_mail
 from django.conf import settings
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.db import DatabaseError
+
+# Batch tasks retry on database trouble with jittered exponential backoff;
+# they are safe to run again since every batch is claimed with SKIP LOCKED.
+BATCH_RETRY = {
+    'autoretry_for': (DatabaseError,),
+    'retry_backoff': True,
+    'retry_backoff_max': 60,
+    'retry_jitter': True,
+    'max_retries': 5,
+}
+
+@shared_task(**BATCH_RETRY)
+def send_confirmation_emails():
+    from .emails import send_confirmations
+
+    # Work through the queue a batch at a time
+    total_sent = 0
+    while True:
+        sent, deferred, failed = send_confirmations(settings.EMAIL_BATCH_SIZE)
+        total_sent += sent
+        if sent + deferred + failed < settings.EMAIL_BATCH_SIZE:
+            break
+    return f"Sent {total_sent} confirmation emails"
 
 @shared_task
 def send_booking_confirmation_email(booking_id):
+    # Kept for messages queued before confirmations were batched; the
+    # booking is already in the email queue once it is completed.
+    return send_confirmation_emails()
+
+@shared_task(**BATCH_RETRY)
+def expire_seat_holds():
+    from .inventory import expire_holds
+
+    expired = expire_holds(batch_size=settings.SEAT_HOLD_SWEEP_BATCH_SIZE)
+    return f"Expired {expired} seat holds"
+
+@shared_task(bind=True, max_retries=3)
+def create_payment_order(self, booking_id):
     from .models import Booking
-    
+    from .payments import PaymentGatewayError, ensure_order
+
+    booking = Booking.objects.filter(id=booking_id, payment_status='pending').first()
+    if booking is None:
+        return "Booking is no longer pending"
     try:
-        booking = Booking.objects.get(id=booking_id)
-        subject = f'Booking Confirmation - {booking.booking_reference}'
-        
-        html_message = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd;">
-                <h2 style="color: #2563eb; text-align: center;">🚌 Bus Booking Confirmed!</h2>
-                
-                <div style="background: #f3f4f6; padding: 15px; border-radius: 8px; margin: 20px 0;">
-                    <h3 style="margin-top: 0;">Booking Details</h3>
-                    <p><strong>Booking Reference:</strong> {booking.booking_reference}</p>
-                    <p><strong>Passenger Name:</strong> {booking.passenger_name}</p>
-                    <p><strong>Bus:</strong> {booking.bus.bus_name} ({booking.bus.bus_number})</p>
-                    <p><strong>Route:</strong> {booking.bus.source} → {booking.bus.destination}</p>
-                    <p><strong>Journey Date:</strong> {booking.booking_date.strftime('%d %B %Y')}</p>
-                    <p><strong>Departure Time:</strong> {booking.bus.departure_time.strftime('%I:%M %p')}</p>
-                    <p><strong>Arrival Time:</strong> {booking.bus.arrival_time.strftime('%I:%M %p')}</p>
-                    <p><strong>Duration:</strong> {booking.bus.journey_duration}</p>
-                    <p><strong>Seats Booked:</strong> {booking.seats_booked}</p>
-                </div>
-                
-                <div style="background: #d1fae5; padding: 15px; border-radius: 8px; margin: 20px 0;">
-                    <h3 style="margin-top: 0; color: #065f46;">Payment Details</h3>
-                    <p><strong>Total Amount Paid:</strong> ₹{booking.total_price}</p>
-                    <p><strong>Payment Status:</strong> {booking.payment_status.upper()}</p>
-                    <p><strong>Payment ID:</strong> {booking.payment_id}</p>
-                    <p><strong>Payment Method:</strong> {booking.payment_method or 'Online Payment'}</p>
-                </div>
-                
-                <div style="background: #fef3c7; padding: 15px; border-radius: 8px; margin: 20px 0;">
-                    <h4 style="margin-top: 0;">Important Instructions:</h4>
-                    <ul>
-                        <li>Please carry a valid ID proof while boarding</li>
-                        <li>Reach the boarding point 15 minutes before departure</li>
-                        <li>Keep this booking reference handy: <strong>{booking.booking_reference}</strong></li>
-                    </ul>
-                </div>
-                
-                <p style="text-align: center; color: #666; margin-top: 30px;">
-                    Thank you for choosing our service!<br>
-                    <small>This is an automated email. Please do not reply.</small>
-                </p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        plain_message = strip_tags(html_message)
-        
-        send_mail(
-            subject,
-            plain_message,
-            settings.DEFAULT_FROM_EMAIL,
-            [booking.passenger_email],
-            html_message=html_message,
-            fail_silently=False,
-        )
-        
-        return f"Email sent successfully to {booking.passenger_email}"
-    except Exception as e:
-        return f"Error sending email: {str(e)}"
\ No newline at end of file
+        return ensure_order(booking)
+    except PaymentGatewayError as e:
+        # The payment page creates the order itself if this never succeeds
+        raise self.retry(exc=e, countdown=settings.RAZORPAY_BREAKER_RESET_TIMEOUT)
+
+@shared_task(**BATCH_RETRY)
+def process_payment_events():
+    from .payments import apply_payment_events
+
+    processed = apply_payment_events(batch_size=settings.PAYMENT_EVENTS_BATCH_SIZE)
+    return f"Processed {processed} payment events"
@@ -0,0 +1,54 @@
+"""
+Query budget harness for the test suite.
+
+Every named URL in booking/urls.py, booking/api_urls.py and
+booking/async_urls.py declares the most queries one request to it may run,
+in the QUERY_BUDGETS dict next to its urlpatterns. Tests check requests against those numbers with
+QueryBudgetMixin.assertQueryBudget() or the @query_budget decorator, so an
+N+1 regression fails the suite instead of reaching production.
+"""
+import functools
+from contextlib import contextmanager
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def collect_query_budgets():
+    from . import api_urls, async_urls, urls
+    budgets = {}
+    for module in (urls, api_urls, async_urls):
+        budgets.update(module.QUERY_BUDGETS)
+    return budgets
+
+
+def url_names():
+    from . import api_urls, async_urls, urls
+    return {pattern.name for module in (urls, api_urls, async_urls) for pattern in module.urlpatterns if pattern.name}
+
+
+def _budget_failure(url_name, budget, queries):
+    lines = '\n'.join(f"  {i}. {query['sql']}" for i, query in enumerate(queries, 1))
+    return f'{url_name} ran {len(queries)} queries, budget is {budget}:\n{lines}'
+
+
+class QueryBudgetMixin:
+    @contextmanager
+    def assertQueryBudget(self, url_name):
+        budgets = collect_query_budgets()
+        if url_name not in budgets:
+            self.fail(f'No query budget declared for URL name {url_name!r}')
+        with CaptureQueriesContext(connection) as ctx:
+            yield ctx
+        if len(ctx.captured_queries) > budgets[url_name]:
+            self.fail(_budget_failure(url_name, budgets[url_name], ctx.captured_queries))
+
+
+def query_budget(url_name):
+    """Fail the decorated test if its body runs more queries than url_name allows."""
+    def decorator(test):
+        @functools.wraps(test)
+        def wrapper(self, *args, **kwargs):
+            with QueryBudgetMixin.assertQueryBudget(self, url_name):
+                return test(self, *args, **kwargs)
+        return wrapper
+    return decorator
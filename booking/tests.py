@@ -1,16 +1,72 @@
 import unittest
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.core.cache import cache
+from unittest import mock
 from django.urls import reverse
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from rest_framework import status
-from booking.models import Bus, Booking
-from datetime import date, time
+from django.apps import apps as django_apps
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ImproperlyConfigured
+from booking.models import Bus, Booking, PaymentEvent, SeatInventory
+from booking.cache import availability_cache
+from booking.routes import city_index
+from booking.journeys import connection_index
+from booking.cache import get_catalogue_version
+from booking.renderers import FastJSONRenderer
+from booking.fake_razorpay import FakeGateway, FakeRazorpayClient, async_transport
+from booking.payments import (
+    CircuitBreaker, CircuitOpenError, PaymentGatewayError, apply_payment_events, ensure_order
+)
+from django.core import mail
+from django.conf import settings
+from django.core.mail import get_connection
+from booking.emails import send_confirmations
+from booking.smtp_sink import SMTPSink
+from booking.references import MAX_SEQUENCE, TimeOrderedReferenceGenerator
+from booking.seatmap import SeatMap
+from booking.seed import seed_bookings, seed_buses
+from booking.management.commands.reconcile_inventory import booked_totals
+from booking import loadgen, metrics
+from booking.tasks import create_payment_order, expire_seat_holds
+from kombu.exceptions import OperationalError as BrokerError
+from booking.replicas import (
+    PIN_COOKIE, ReplicaMonitor, ReplicaPinMiddleware, ReplicaRouter, measure_lag, monitor as replica_monitor,
+)
+import smtplib
+from booking.serializers import BUS_VALUES, BusSerializer
+from rest_framework.renderers import JSONRenderer
+from booking.testing import QueryBudgetMixin, collect_query_budgets, query_budget, url_names
+from rest_framework_simplejwt.tokens import RefreshToken
+from booking.inventory import apply_booking_change, expire_holds, get_available_seats, release_booking
+from django.utils import timezone
+from io import StringIO
+import weakref
+import runpy
+from django.test import AsyncClient
+from datetime import date, time, timedelta
 from decimal import Decimal
+import asyncio
+import base64
+import gzip
+import hashlib
+import importlib
+import hmac
 import json
+import os
+import tempfile
 
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+@override_settings(CACHES=LOCMEM_CACHES)
 class BaseTestcase(TestCase):
     def setUp(self):
+        cache.clear()
+        availability_cache.reset_stats()
         self.user = User.objects.create_user(
             username='testuser',
             password='testpass123',
@@ -100,7 +156,936 @@ class SearchBusesViewTest(BaseTestcase):
         })
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Test Express')
+
+class SeatAvailabilityTest(BaseTestcase):
+    def add_buses(self, count):
+        for i in range(count):
+            Bus.objects.create(
+                bus_number=f'EXTRA-{i:03d}',
+                bus_name=f'Extra Express {i}',
+                source='Delhi',
+                destination='Mumbai',
+                total_seats=30,
+                price=Decimal('900.00'),
+                departure_time=time(10, 0),
+                arrival_time=time(22, 0),
+                journey_duration='12 hours'
+            )
+
+    def count_search_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('search_buses'), {
+                'source': 'Delhi',
+                'date': '2025-01-15'
+            })
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_with_available_seats(self):
+        apply_booking_change(self.booking)
+        buses = Bus.objects.with_available_seats(self.booking.booking_date)
+        self.assertEqual(buses.get(id=self.bus.id).available_seats, 40)
+        buses = Bus.objects.with_available_seats(self.booking.booking_date, include_held=True)
+        self.assertEqual(buses.get(id=self.bus.id).available_seats, 38)
+
+    def test_search_query_count_is_constant(self):
+        self.client.login(username='testuser', password='testpass123')
+        baseline = self.count_search_queries()
+        self.add_buses(50)
+        self.assertEqual(self.count_search_queries(), baseline)
+
+    def test_api_search_with_date(self):
+        self.booking.payment_status = 'completed'
+        self.booking.save()
+        apply_booking_change(self.booking)
+        response = self.api_client.get(reverse('api_bus_search'), {
+            'source': 'Delhi',
+            'date': self.booking.booking_date.isoformat()
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['available_seats'], 38)
+
+class SeatInventoryTest(BaseTestcase):
+    def inventory(self):
+        return SeatInventory.objects.get(bus=self.bus, date=self.booking.booking_date)
+
+    def test_booking_lifecycle(self):
+        apply_booking_change(self.booking)
+        self.assertEqual((self.inventory().seats_held, self.inventory().seats_sold), (2, 0))
+
+        self.booking.payment_status = 'completed'
+        self.booking.save()
+        apply_booking_change(self.booking, 'pending', 2)
+        self.assertEqual((self.inventory().seats_held, self.inventory().seats_sold), (0, 2))
+        self.assertEqual(get_available_seats(self.bus, self.booking.booking_date), 38)
+
+    def test_release_booking(self):
+        apply_booking_change(self.booking)
+        release_booking(self.booking)
+        self.assertEqual(self.inventory().seats_held, 0)
+
+    def test_web_booking_updates_inventory(self):
+        self.client.login(username='testuser', password='testpass123')
+        self.client.post(reverse('book_bus', kwargs={'bus_id': self.bus.id}) + '?date=2025-01-15', {
+            'seats_booked': 3,
+            'passenger_name': 'New User',
+            'passenger_phone': '+91-9876543210'
+        })
+        inventory = SeatInventory.objects.get(bus=self.bus, date=date(2025, 1, 15))
+        self.assertEqual(inventory.seats_held, 3)
+
+    def test_api_modify_moves_seats_to_the_new_departure(self):
+        apply_booking_change(self.booking)
+        new_date = self.booking.booking_date + timedelta(days=1)
+        self.api_client.force_authenticate(user=self.user)
+        response = self.api_client.put(reverse('api_modify_booking', kwargs={'pk': self.booking.id}), {
+            'bus': self.bus.id, 'booking_date': new_date.isoformat(), 'seats_booked': 3,
+            'passenger_name': 'Test User', 'passenger_email': 'test@example.com', 'passenger_phone': '+91-9876543210',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.inventory().seats_held, 0)
+        self.assertEqual(SeatInventory.objects.get(bus=self.bus, date=new_date).seats_held, 3)
+
+    def test_new_seat_count_applies_to_future_departures(self):
+        today = timezone.localdate()
+        for day in (today - timedelta(days=1), today + timedelta(days=1)):
+            SeatInventory.objects.create(bus=self.bus, date=day, seats_total=40, seats_held=2)
+        get_available_seats(self.bus, today + timedelta(days=1))
+
+        self.bus.total_seats = 30
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bus.save()
+        self.assertEqual(SeatInventory.objects.get(bus=self.bus, date=today - timedelta(days=1)).seats_total, 40)
+        self.assertEqual(SeatInventory.objects.get(bus=self.bus, date=today + timedelta(days=1)).seats_total, 30)
+        self.assertEqual(get_available_seats(self.bus, today + timedelta(days=1), include_held=True), 28)
+
+    def test_api_cancel_releases_seats(self):
+        apply_booking_change(self.booking)
+        self.api_client.force_authenticate(user=self.user)
+        self.api_client.post(f'/api/bookings/{self.booking.id}/cancel/')
+        self.assertEqual(self.inventory().seats_held, 0)
+
+    def test_reconcile_inventory(self):
+        out = StringIO()
+        call_command('reconcile_inventory', stdout=out)
+        self.assertIn('1 missing rows', out.getvalue())
+        self.assertEqual(self.inventory().seats_held, 2)
+
+        SeatInventory.objects.filter(bus=self.bus).update(seats_held=7)
+        out = StringIO()
+        call_command('reconcile_inventory', '--dry-run', stdout=out)
+        self.assertIn('1 drifted', out.getvalue())
+        self.assertEqual(self.inventory().seats_held, 7)
+
+        call_command('reconcile_inventory', stdout=StringIO())
+        self.assertEqual(self.inventory().seats_held, 2)
+
+    def test_migration_seeds_inventory_from_existing_bookings(self):
+        migration = importlib.import_module('booking.migrations.0013_seed_seat_inventory')
+        paid = Booking.objects.create(
+            user=self.user, bus=self.bus, booking_date=self.booking.booking_date, seats_booked=3,
+            total_price=Decimal('3600.00'), passenger_name='Paid', passenger_email='paid@example.com',
+            passenger_phone='+91-9876543210', payment_status='completed',
+        )
+        SeatInventory.objects.create(bus=self.bus, date=paid.booking_date + timedelta(days=1), seats_total=40)
+
+        migration.seed_seat_inventory(django_apps, mock.Mock(connection=connection))
+        self.assertEqual((self.inventory().seats_total, self.inventory().seats_held, self.inventory().seats_sold), (40, 2, 3))
+        self.assertEqual(SeatInventory.objects.count(), 2)
+
+    def test_reconcile_keeps_the_seat_count_of_past_departures(self):
+        past, future = timezone.localdate() - timedelta(days=1), timezone.localdate() + timedelta(days=1)
+        for day in (past, future):
+            SeatInventory.objects.create(bus=self.bus, date=day, seats_total=40)
+        Bus.objects.filter(pk=self.bus.pk).update(total_seats=30)
+
+        out = StringIO()
+        call_command('reconcile_inventory', stdout=out)
+        self.assertIn('1 drifted', out.getvalue())
+        self.assertEqual(SeatInventory.objects.get(bus=self.bus, date=past).seats_total, 40)
+        self.assertEqual(SeatInventory.objects.get(bus=self.bus, date=future).seats_total, 30)
+
+    def test_cannot_take_more_seats_than_are_left(self):
+        apply_booking_change(self.booking)
+        SeatInventory.objects.filter(bus=self.bus).update(seats_sold=37)
+        self.api_client.force_authenticate(user=self.user)
+        response = self.api_client.post(reverse('api_create_booking'), {
+            'bus': self.bus.id, 'booking_date': self.booking.booking_date.isoformat(), 'seats_booked': 2,
+            'passenger_name': 'Late User', 'passenger_email': 'late@example.com', 'passenger_phone': '+91-9876543210',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['error'], 'Only 1 seats available')
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual((self.inventory().seats_held, self.inventory().seats_sold), (2, 37))
         
+@unittest.skipUnless(connection.vendor == 'postgresql', 'needs concurrent writers')
+class ConcurrentBookingTest(TransactionTestCase):
+    def test_one_departure_is_never_oversold(self):
+        out = StringIO()
+        call_command('stress_bookings', processes=2, threads=4, attempts=20, seats=30, stdout=out)
+        self.assertIn('No seats oversold', out.getvalue())
+
+class SeatHoldTest(BaseTestcase):
+    def add_pending(self, count, expires):
+        bookings = []
+        for i in range(count):
+            booking = Booking.objects.create(
+                user=self.user, bus=self.bus, booking_date=self.booking.booking_date,
+                seats_booked=1, total_price=Decimal('1200.00'), passenger_name=f'Hold {i}',
+                passenger_email='hold@example.com', passenger_phone='+91-9876543210',
+                hold_expires_at=expires
+            )
+            apply_booking_change(booking)
+            bookings.append(booking)
+        return bookings
+
+    def test_booking_starts_hold(self):
+        self.api_client.force_authenticate(user=self.user)
+        response = self.api_client.post(reverse('api_create_booking'), {
+            'bus': self.bus.id, 'booking_date': '2025-01-15', 'seats_booked': 1,
+            'passenger_name': 'API User', 'passenger_email': 'api@example.com',
+            'passenger_phone': '+91-9876543210'
+        }, format='json')
+        booking = Booking.objects.get(id=response.data['booking']['id'])
+        self.assertGreater(booking.hold_expires_at, timezone.now())
+
+    def test_expire_holds_in_batches(self):
+        stale = self.add_pending(3, timezone.now() - timedelta(minutes=1))
+        live = self.add_pending(1, timezone.now() + timedelta(minutes=10))
+        booking_date = self.booking.booking_date
+        self.assertEqual(get_available_seats(self.bus, booking_date, include_held=True), 36)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_holds(batch_size=2), 3)
+        self.assertEqual(
+            set(Booking.objects.filter(payment_status='expired').values_list('id', flat=True)),
+            {booking.id for booking in stale}
+        )
+        self.assertEqual(Booking.objects.get(id=live[0].id).payment_status, 'pending')
+        self.assertEqual(get_available_seats(self.bus, booking_date, include_held=True), 39)
+        self.assertEqual(expire_holds(), 0)
+
+    def test_search_counts_live_holds(self):
+        apply_booking_change(self.booking)
+        response = self.api_client.get(reverse('api_bus_search'), {
+            'source': 'Delhi', 'date': self.booking.booking_date.isoformat()
+        })
+        self.assertEqual(response.data['results'][0]['available_seats'], 38)
+
+    def test_expired_booking_cannot_be_paid(self):
+        self.booking.payment_status = 'expired'
+        self.booking.save()
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(reverse('payment', kwargs={'booking_id': self.booking.id}))
+        self.assertRedirects(response, reverse('home'))
+
+@override_settings(RAZORPAY_RETRY_BACKOFF=0, CELERY_TASK_ALWAYS_EAGER=True)
+class PaymentOrderTest(BaseTestcase):
+    def setUp(self):
+        super().setUp()
+        self.gateway = FakeGateway()
+        patcher = mock.patch('booking.payments.razorpay_client', FakeRazorpayClient(self.gateway))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('booking.payments.breaker', CircuitBreaker(3, 30))
+        self.breaker = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(self.user)
+
+    def test_payment_page_reuses_order(self):
+        url = reverse('payment', kwargs={'booking_id': self.booking.id})
+        first = self.client.get(url).context['razorpay_order_id']
+        second = self.client.get(url).context['razorpay_order_id']
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.gateway.orders), 1)
+        self.assertEqual(Booking.objects.get(id=self.booking.id).order_amount, 240000)
+
+    def test_new_order_when_amount_changes(self):
+        first = ensure_order(self.booking)
+        self.booking.total_price = Decimal('3600.00')
+        self.booking.save()
+        second = ensure_order(self.booking)
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.gateway.orders[second]['amount'], 360000)
+
+    def test_retries_then_circuit_opens(self):
+        self.gateway.fail_next = 2
+        self.assertTrue(ensure_order(self.booking))
+        self.assertEqual(self.gateway.calls, 3)
+
+        self.gateway.fail_next = 10
+        self.booking.order_id = None
+        with self.assertRaises(PaymentGatewayError):
+            ensure_order(self.booking)
+        self.assertEqual(self.breaker.state, 'open')
+        calls = self.gateway.calls
+        with self.assertRaises(CircuitOpenError):
+            ensure_order(self.booking)
+        self.assertEqual(self.gateway.calls, calls)
+
+        Booking.objects.filter(id=self.booking.id).update(order_id=None)
+        response = self.client.get(reverse('payment', kwargs={'booking_id': self.booking.id}))
+        self.assertRedirects(response, reverse('booking_review', kwargs={'booking_id': self.booking.id}))
+
+    def test_offline_booking_and_payment(self):
+        Booking.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('book_bus', kwargs={'bus_id': self.bus.id}) + '?date=2025-01-15', {
+                'seats_booked': 1,
+                'passenger_name': 'Offline User',
+                'passenger_phone': '+91-9876543210'
+            })
+        booking = Booking.objects.get()
+        # Created by the Celery task right after booking
+        self.assertIsNotNone(booking.order_id)
+        response = self.client.get(reverse('payment', kwargs={'booking_id': booking.id}))
+        self.assertEqual(response.context['razorpay_order_id'], booking.order_id)
+        self.assertEqual(len(self.gateway.orders), 1)
+
+        response = self.client.post(reverse('payment_success'), self.gateway.pay(booking.order_id))
+        self.assertRedirects(response, reverse('booking_success', kwargs={'booking_id': booking.id}))
+        self.assertEqual(Booking.objects.get(id=booking.id).payment_status, 'completed')
+
+    def test_paying_for_a_cancelled_booking_does_not_complete_it(self):
+        order_id = ensure_order(self.booking)
+        Booking.objects.filter(id=self.booking.id).update(payment_status='cancelled')
+        response = self.client.post(reverse('payment_success'), self.gateway.pay(order_id))
+        self.assertRedirects(response, reverse('payment_failed'))
+        booking = Booking.objects.get(id=self.booking.id)
+        self.assertEqual(booking.payment_status, 'cancelled')
+        self.assertTrue(booking.payment_id)
+        self.assertFalse(SeatInventory.objects.filter(bus=self.bus, seats_sold__gt=0).exists())
+
+    def test_booking_goes_through_when_the_broker_is_down(self):
+        Booking.objects.all().delete()
+        broker_down = mock.patch.object(create_payment_order, 'delay', side_effect=BrokerError('broker down'))
+        with broker_down, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('book_bus', kwargs={'bus_id': self.bus.id}) + '?date=2025-01-15', {
+                'seats_booked': 1,
+                'passenger_name': 'Offline User',
+                'passenger_phone': '+91-9876543210'
+            })
+        booking = Booking.objects.get()
+        self.assertRedirects(response, reverse('payment', kwargs={'booking_id': booking.id}))
+        # The payment page creates the order instead
+        response = self.client.get(reverse('payment', kwargs={'booking_id': booking.id}))
+        self.assertEqual(response.context['razorpay_order_id'], Booking.objects.get(id=booking.id).order_id)
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET='whsec_test')
+class PaymentWebhookTest(BaseTestcase):
+    def setUp(self):
+        super().setUp()
+        self.gateway = FakeGateway()
+        self.booking.order_id = 'order_webhook'
+        self.booking.save()
+        apply_booking_change(self.booking)
+
+    def deliver(self, event='payment.captured', order_id='order_webhook', payment_id='pay_1', **headers):
+        body, signed = self.gateway.webhook(event, order_id, payment_id)
+        return self.client.post(reverse('razorpay_webhook'), body, content_type='application/json',
+                                **{**signed, **headers})
+
+    def test_webhook_only_stores_event(self):
+        response = self.deliver()
+        self.assertEqual(response.status_code, 200)
+        event = PaymentEvent.objects.get()
+        self.assertEqual((event.payment_id, event.order_id, event.processed_at), ('pay_1', 'order_webhook', None))
+        self.assertEqual(Booking.objects.get(id=self.booking.id).payment_status, 'pending')
+
+    def test_rejects_bad_signature(self):
+        response = self.deliver(HTTP_X_RAZORPAY_SIGNATURE='forged')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_rejects_signed_bodies_that_are_not_events(self):
+        for body in [[], {'event': 'payment.captured', 'payload': None}, {'payload': {'payment': {'entity': 'x'}}}]:
+            body = json.dumps(body).encode()
+            signature = hmac.new(b'whsec_test', body, hashlib.sha256).hexdigest()
+            response = self.client.post(reverse('razorpay_webhook'), body, content_type='application/json',
+                                        HTTP_X_RAZORPAY_SIGNATURE=signature)
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_redelivery_is_stored_once(self):
+        body, headers = self.gateway.webhook('payment.captured', 'order_webhook', 'pay_1')
+        for _ in range(2):
+            self.client.post(reverse('razorpay_webhook'), body, content_type='application/json', **headers)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_batch_completes_bookings_once(self):
+        self.deliver(payment_id='pay_1')
+        self.deliver(event='order.paid', payment_id='pay_1')
+        self.deliver(event='payment.failed', payment_id='pay_2')
+        self.deliver(order_id='order_missing', payment_id='pay_3')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(apply_payment_events(batch_size=3), 4)
+        booking = Booking.objects.get(id=self.booking.id)
+        self.assertEqual((booking.payment_status, booking.payment_id), ('completed', 'pay_1'))
+        inventory = SeatInventory.objects.get(bus=self.bus, date=self.booking.booking_date)
+        self.assertEqual((inventory.seats_held, inventory.seats_sold), (0, 2))
+        self.assertEqual(
+            list(PaymentEvent.objects.order_by('id').values_list('outcome', flat=True)),
+            ['completed', 'duplicate', 'ignored', 'unknown_order']
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(apply_payment_events(), 0)
+
+    def test_late_payment_for_a_sold_out_departure_fails(self):
+        Booking.objects.filter(id=self.booking.id).update(payment_status='expired')
+        SeatInventory.objects.filter(bus=self.bus).update(seats_held=0, seats_sold=39)
+        self.deliver(payment_id='pay_late')
+        self.deliver(event='order.paid', payment_id='pay_late')
+
+        apply_payment_events()
+        booking = Booking.objects.get(id=self.booking.id)
+        self.assertEqual((booking.payment_status, booking.payment_id), ('failed', 'pay_late'))
+        inventory = SeatInventory.objects.get(bus=self.bus, date=self.booking.booking_date)
+        self.assertEqual((inventory.seats_held, inventory.seats_sold), (0, 39))
+        self.assertEqual(
+            list(PaymentEvent.objects.order_by('id').values_list('outcome', flat=True)), ['sold_out', 'duplicate']
+        )
+
+    def test_payment_for_a_cancelled_booking_is_refunded(self):
+        Booking.objects.filter(id=self.booking.id).update(payment_status='cancelled')
+        self.deliver(payment_id='pay_cancelled')
+
+        apply_payment_events()
+        booking = Booking.objects.get(id=self.booking.id)
+        self.assertEqual((booking.payment_status, booking.payment_id), ('cancelled', 'pay_cancelled'))
+        self.assertFalse(SeatInventory.objects.filter(bus=self.bus, seats_sold__gt=0).exists())
+        self.assertEqual(PaymentEvent.objects.get().outcome, 'refund')
+
+class ConfirmationEmailTest(BaseTestcase):
+    def complete(self, email='test@example.com'):
+        booking = Booking.objects.create(
+            user=self.user, bus=self.bus, booking_date=self.booking.booking_date, seats_booked=1,
+            total_price=Decimal('1200.00'), passenger_name='Paid User', passenger_email=email,
+            passenger_phone='+91-9876543210', payment_status='completed', payment_id='pay_mail'
+        )
+        return booking
+
+    def test_batch_sends_over_one_connection(self):
+        bookings = [self.complete(f'user{i}@example.com') for i in range(3)]
+        with mock.patch('booking.emails.get_connection', wraps=get_connection) as connect:
+            self.assertEqual(send_confirmations(), (3, 0, 0))
+        connect.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn(bookings[0].booking_reference, mail.outbox[0].subject)
+        self.assertIn('Test Express', mail.outbox[0].alternatives[0][0])
+        self.assertFalse(Booking.objects.filter(id__in=[b.id for b in bookings], confirmation_sent_at=None).exists())
+        self.assertEqual(send_confirmations(), (0, 0, 0))
+
+    @override_settings(EMAIL_DOMAIN_RATE_LIMIT=1)
+    def test_domain_rate_limit_defers(self):
+        self.complete('a@slowmail.com')
+        deferred = self.complete('b@slowmail.com')
+        self.assertEqual(send_confirmations(), (1, 1, 0))
+        deferred.refresh_from_db()
+        self.assertIsNone(deferred.confirmation_sent_at)
+        self.assertEqual(deferred.confirmation_attempts, 0)
+        self.assertGreater(deferred.confirmation_next_attempt_at, timezone.now())
+
+    def test_failures_back_off(self):
+        booking = self.complete()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=smtplib.SMTPRecipientsRefused({})):
+            self.assertEqual(send_confirmations(), (0, 0, 1))
+        booking.refresh_from_db()
+        self.assertEqual(booking.confirmation_attempts, 1)
+        self.assertGreater(booking.confirmation_next_attempt_at, timezone.now() + timedelta(seconds=20))
+        self.assertEqual(send_confirmations(), (0, 0, 0))
+
+    def test_smtp_sink(self):
+        self.complete()
+        with SMTPSink() as sink:
+            host, port = sink.address
+            with self.settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                               EMAIL_HOST=host, EMAIL_PORT=port, EMAIL_USE_TLS=False,
+                               EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD=''):
+                self.complete('second@example.com')
+                self.assertEqual(send_confirmations(), (2, 0, 0))
+        self.assertEqual((sink.count, sink.connections), (2, 1))
+
+class CeleryRoutingTest(unittest.TestCase):
+    def test_every_task_has_a_queue(self):
+        from bus_booking.celery import app
+        tasks = {name for name in app.tasks if name.startswith('booking.')}
+        self.assertIn('booking.tasks.expire_seat_holds', tasks)
+        self.assertEqual(tasks - set(settings.CELERY_TASK_ROUTES), set())
+        self.assertTrue(app.conf.task_acks_late)
+        self.assertTrue(app.conf.task_ignore_result)
+
+class BookingReferenceTest(BaseTestcase):
+    def test_references_sort_in_creation_order(self):
+        ticks = iter([5_000_000, 5_000_000, 3_000_000, 9_000_000])
+        generate = TimeOrderedReferenceGenerator(host_id=1, clock=lambda: next(ticks))
+        references = [generate() for _ in range(4)]
+        self.assertEqual(references, sorted(references))
+        self.assertEqual(len(set(references)), 4)
+        self.assertTrue(all(len(reference) == 18 for reference in references))
+
+    def test_full_sequence_moves_to_next_millisecond(self):
+        generate = TimeOrderedReferenceGenerator(host_id=1, clock=lambda: 7_000_000)
+        references = [generate() for _ in range(MAX_SEQUENCE + 2)]
+        self.assertEqual(len(set(references)), MAX_SEQUENCE + 2)
+        self.assertEqual(references[-1][:9], TimeOrderedReferenceGenerator(host_id=1, clock=lambda: 8_000_000)()[:9])
+
+    def test_hosts_do_not_share_references(self):
+        first = TimeOrderedReferenceGenerator(host_id=1, clock=lambda: 7_000_000)
+        second = TimeOrderedReferenceGenerator(host_id=2, clock=lambda: 7_000_000)
+        self.assertNotEqual(first(), second())
+
+    @override_settings(BOOKING_REFERENCE_HOST_ID=None)
+    def test_processes_without_a_host_id_pick_random_nodes(self):
+        nodes = {TimeOrderedReferenceGenerator(clock=lambda: 7_000_000)()[9:15] for _ in range(20)}
+        self.assertEqual(len(nodes), 20)
+
+    def test_booking_save_uses_configured_generator(self):
+        booking = Booking.objects.create(
+            user=self.user, bus=self.bus, booking_date=self.booking.booking_date, seats_booked=1,
+            total_price=Decimal('1200.00'), passenger_name='Ref', passenger_email='ref@example.com',
+            passenger_phone='+91-9876543210'
+        )
+        self.assertEqual(len(booking.booking_reference), 18)
+        with override_settings(BOOKING_REFERENCE_GENERATOR='booking.references.RandomReferenceGenerator'):
+            booking = Booking.objects.create(
+                user=self.user, bus=self.bus, booking_date=self.booking.booking_date, seats_booked=1,
+                total_price=Decimal('1200.00'), passenger_name='Ref', passenger_email='ref@example.com',
+                passenger_phone='+91-9876543210'
+            )
+        self.assertEqual(len(booking.booking_reference), 10)
+
+    def test_stress_command_across_processes(self):
+        out = StringIO()
+        call_command('stress_booking_references', '--processes', '4', '--count', '20000', stdout=out)
+        self.assertIn('80000 references from 4 processes', out.getvalue())
+        self.assertIn(': 0 collisions', out.getvalue())
+
+class ExplainHotQueriesCommandTest(BaseTestcase):
+    def test_seed_and_explain(self):
+        out = StringIO()
+        call_command('explain_hot_queries', '--seed', '200', '--buses', '5', '--users', '5', stdout=out)
+        for name in ['departure seat totals', 'payment order lookup', 'my bookings page']:
+            self.assertIn(name, out.getvalue())
+        self.assertEqual(Booking.objects.count(), 201)
+
+    def test_seeded_bookings_match_the_inventory(self):
+        buses = seed_buses(2)
+        seed_bookings(150, buses, [self.user], days=2, batch_size=40)
+        self.assertEqual(Booking.objects.filter(bus__in=buses).count(), 150)
+        booked = {
+            (row['bus_id'], row['booking_date']): (row['held'], row['sold'])
+            for row in booked_totals(Booking.objects.filter(bus__in=buses))
+        }
+        rows = SeatInventory.objects.filter(bus__in=buses)
+        self.assertEqual({(row.bus_id, row.date): (row.seats_held, row.seats_sold) for row in rows}, booked)
+        for row in rows:
+            self.assertLessEqual(row.seats_held + row.seats_sold, row.seats_total)
+
+class ImportBusesCommandTest(BaseTestcase):
+    HEADER = 'bus_number,bus_name,source,destination,total_seats,price,departure_time,arrival_time,journey_duration\n'
+
+    def import_file(self, suffix, content, *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_buses', f.name, '--batch-size', '2', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_creates_and_updates_by_bus_number(self):
+        version = get_catalogue_version()
+        out, err = self.import_file('.csv', self.HEADER + (
+            'TEST-001,Test Express,Delhi,Mumbai,40,1350.00,09:00,21:30,12 hours 30 minutes\n'
+            'IMP-001,Pink City Express,Delhi,Jaipur,36,650,07:15,12:45,5 hours 30 minutes\n'
+            'IMP-002,Lake City Express,Delhi,Udaipur,30,900,20:00,08:00,12 hours\n'
+        ))
+        self.assertIn('Imported 3 buses', out)
+        self.assertEqual(err, '')
+        self.bus.refresh_from_db()
+        self.assertEqual(self.bus.price, Decimal('1350.00'))
+        self.assertEqual(Bus.objects.get(bus_number='IMP-001').departure_time, time(7, 15))
+        self.assertEqual(Bus.objects.count(), 3)
+        self.assertNotEqual(get_catalogue_version(), version)
+
+    def test_reimport_with_a_new_seat_count_updates_future_departures(self):
+        travel_date = timezone.localdate() + timedelta(days=3)
+        SeatInventory.objects.create(bus=self.bus, date=travel_date, seats_total=40, seats_sold=5)
+        get_available_seats(self.bus, travel_date)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_file('.csv', self.HEADER + (
+                'TEST-001,Test Express,Delhi,Mumbai,45,1200.00,09:00,21:30,12 hours 30 minutes\n'
+            ))
+        self.assertEqual(SeatInventory.objects.get(bus=self.bus, date=travel_date).seats_total, 45)
+        self.assertEqual(get_available_seats(self.bus, travel_date), 40)
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        out, err = self.import_file('.ndjson', '\n'.join([
+            '{"bus_number": "IMP-010", "bus_name": "Good", "source": "Pune", "destination": "Goa", '
+            '"total_seats": 40, "price": 800, "departure_time": "22:00", "arrival_time": "08:00", '
+            '"journey_duration": "10 hours"}',
+            '{"bus_number": "IMP-011", "bus_name": "No seats", "source": "Pune", "destination": "Goa", '
+            '"total_seats": 0, "price": 800, "departure_time": "22:00", "arrival_time": "08:00", '
+            '"journey_duration": "10 hours"}',
+            'not json',
+            '{"bus_number": "IMP-012", "bus_name": "Also good", "source": "Goa", "destination": "Pune", '
+            '"total_seats": 40, "price": 800, "departure_time": "09:00", "arrival_time": "19:00", '
+            '"journey_duration": "10 hours"}',
+        ]))
+        self.assertIn('Imported 2 buses', out)
+        self.assertIn('2 rows rejected', out)
+        self.assertIn('line 2: total_seats', err)
+        self.assertIn('line 3: invalid JSON', err)
+        self.assertEqual(
+            set(Bus.objects.filter(bus_number__startswith='IMP').values_list('bus_number', flat=True)),
+            {'IMP-010', 'IMP-012'}
+        )
+
+    def test_dry_run_saves_nothing(self):
+        out, _ = self.import_file('.csv', self.HEADER + (
+            'IMP-020,Dry Run,Delhi,Agra,40,400,06:00,10:00,4 hours\n'
+        ), '--dry-run')
+        self.assertIn('Validated 1 buses', out)
+        self.assertFalse(Bus.objects.filter(bus_number='IMP-020').exists())
+
+class DatabaseSettingsTest(unittest.TestCase):
+    def load_settings(self, **env):
+        with mock.patch.dict(os.environ, env):
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'bus_booking', 'settings.py'))['DATABASES']['default']
+
+    def test_persistent_connections_with_health_checks_by_default(self):
+        database = self.load_settings()
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+        self.assertNotIn('pool', database['OPTIONS'])
+
+    def test_pool_mode(self):
+        database = self.load_settings(DB_POOL_MODE='pool', DB_POOL_MAX_SIZE='16')
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool']['max_size'], 16)
+
+    def test_pgbouncer_mode_disables_server_side_cursors(self):
+        self.assertTrue(self.load_settings(DB_POOL_MODE='pgbouncer')['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.load_settings(DB_POOL_MODE='sometimes')
+
+    def test_benchmark_needs_postgres(self):
+        with self.assertRaisesRegex(CommandError, 'needs PostgreSQL'):
+            call_command('bench_db_connections', stdout=StringIO())
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], PRIMARY_PIN_SECONDS=10, REPLICA_MAX_LAG=5)
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        patcher = mock.patch.object(replica_monitor, 'choose', return_value='replica1')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, view, **cookies):
+        factory = RequestFactory()
+        for name, value in cookies.items():
+            factory.cookies[name] = value
+        return ReplicaPinMiddleware(view)(factory.get('/'))
+
+    def test_catalogue_and_availability_reads_go_to_a_replica(self):
+        self.assertEqual(self.router.db_for_read(Bus), 'replica1')
+        self.assertEqual(self.router.db_for_read(SeatInventory), 'replica1')
+        self.assertEqual(self.router.db_for_read(Booking), 'default')
+        self.assertEqual(self.router.db_for_write(Bus), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'booking'))
+
+    def test_no_replica_in_rotation_reads_the_primary(self):
+        replica_monitor.choose.return_value = None
+        self.assertEqual(self.router.db_for_read(Bus), 'default')
+
+    def test_request_reads_its_own_writes_and_pins_the_client(self):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Bus))
+            self.router.db_for_write(Booking)
+            reads.append(self.router.db_for_read(Bus))
+            return HttpResponse()
+
+        response = self.request(view)
+        self.assertEqual(reads, ['replica1', 'default'])
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+
+        pinned = self.request(
+            lambda request: HttpResponse(self.router.db_for_read(Bus)), **{PIN_COOKIE: response.cookies[PIN_COOKIE].value}
+        )
+        self.assertEqual(pinned.content, b'default')
+        self.assertNotIn(PIN_COOKIE, pinned.cookies)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_user_is_pinned_without_the_cookie(self):
+        user = mock.Mock(pk=7, is_authenticated=True)
+
+        def view(write):
+            def handle(request):
+                # As DRF does once it has authenticated a JWT
+                request.user = user
+                if write:
+                    self.router.db_for_write(Booking)
+                return HttpResponse(self.router.db_for_read(Bus))
+            return handle
+
+        self.request(view(write=True))
+        self.assertEqual(self.request(view(write=False)).content, b'default')
+        user.pk = 8
+        self.assertEqual(self.request(view(write=False)).content, b'replica1')
+
+    def test_replica_without_a_wal_receiver_is_unhealthy(self):
+        def lag(row):
+            replica = mock.MagicMock(vendor='postgresql')
+            replica.cursor.return_value.__enter__.return_value.fetchone.return_value = row
+            with mock.patch('booking.replicas.connections', {'replica1': replica}):
+                return measure_lag('replica1')
+
+        self.assertEqual(lag((True, True, False, 2.5)), 2.5)
+        self.assertEqual(lag((True, True, True, 600.0)), 0.0)
+        self.assertIsNone(lag((True, False, True, 600.0)))
+        self.assertIsNone(lag((True, None, None, None)))
+        with mock.patch('booking.replicas.measure_lag', return_value=None), \
+                self.assertLogs('booking.replicas', 'WARNING') as logs:
+            monitor = ReplicaMonitor()
+            monitor.check()
+        self.assertIn('not receiving WAL', logs.output[0])
+        self.assertEqual(monitor.healthy, [])
+
+    def test_expired_pin_reads_replicas_again(self):
+        response = self.request(
+            lambda request: HttpResponse(self.router.db_for_read(Bus)), **{PIN_COOKIE: str(int(timezone.now().timestamp()) - 1)}
+        )
+        self.assertEqual(response.content, b'replica1')
+
+    def test_lagging_or_unreachable_replicas_leave_rotation(self):
+        monitor = ReplicaMonitor()
+        lag = {'replica1': 0.4, 'replica2': 30.0}
+        with mock.patch('booking.replicas.measure_lag', side_effect=lag.get):
+            monitor.check()
+        self.assertEqual(monitor.healthy, ['replica1'])
+
+        def unreachable(alias):
+            raise OperationalError('connection refused')
+        with mock.patch('booking.replicas.measure_lag', side_effect=unreachable), \
+                mock.patch('booking.replicas.connections'), self.assertLogs('booking.replicas', 'WARNING') as logs:
+            monitor.check()
+        self.assertIn('out of rotation', logs.output[-1])
+        self.assertEqual(monitor.healthy, [])
+        self.assertEqual(monitor.lag, {'replica1': None, 'replica2': None})
+
+class MetricsTest(BaseTestcase):
+    def scrape(self, token='scrape'):
+        with self.settings(METRICS_TOKEN='scrape'):
+            return self.client.get(reverse('metrics'), HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_request_latency_and_queries_per_url_name(self):
+        before = metrics.snapshot()[metrics.request_queries.name].get(('api_bus_list',), [0] * 13)
+        self.api_client.force_authenticate(self.user)
+        self.api_client.get(reverse('api_bus_list'))
+        after = metrics.snapshot()[metrics.request_queries.name][('api_bus_list',)]
+        self.assertEqual(sum(after[:-1]) - sum(before[:-1]), 1)
+        self.assertGreater(after[-1], before[-1])
+
+        body = self.scrape().content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="api_bus_list",method="GET",status="200",le="+Inf"}', body)
+        self.assertIn('http_request_db_seconds_count{view="api_bus_list"}', body)
+        self.assertIn('availability_cache_lookups_total{result="hit"}', body)
+
+    def test_endpoint_needs_the_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        self.assertEqual(self.scrape(token='wrong').status_code, 401)
+        self.assertEqual(self.scrape()['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+
+    def test_external_calls_record_their_outcome(self):
+        gateway = FakeGateway()
+        gateway.fail_next = 1
+        with mock.patch('booking.payments.razorpay_client', FakeRazorpayClient(gateway)), \
+                self.settings(RAZORPAY_RETRIES=0), self.assertRaises(PaymentGatewayError):
+            ensure_order(self.booking)
+        calls = metrics.snapshot()[metrics.external_call_duration.name]
+        self.assertIn(('razorpay', 'order.create', 'error'), calls)
+
+    def test_celery_task_runtime(self):
+        key = ('booking.tasks.expire_seat_holds', 'SUCCESS')
+        before = metrics.snapshot()[metrics.task_duration.name].get(key, [0] * 13)
+        # Runs in this process whatever the broker settings, and still
+        # sends task_prerun and task_postrun
+        expire_seat_holds.apply()
+        after = metrics.snapshot()[metrics.task_duration.name][key]
+        self.assertEqual(sum(after[:-1]) - sum(before[:-1]), 1)
+
+    def test_processes_are_added_up(self):
+        one = {metrics.request_duration.name: {('home', 'GET', '200'): [1] + [0] * 11 + [0.004]},
+               metrics.availability_cache_lookups.name: {('hit',): 3}}
+        two = {metrics.request_duration.name: {('home', 'GET', '200'): [0, 2] + [0] * 10 + [0.016]},
+               metrics.availability_cache_lookups.name: {('hit',): 4}}
+        totals = metrics.merge([one, two])
+        self.assertEqual(totals[metrics.availability_cache_lookups.name][('hit',)], 7)
+        body = metrics.render(totals)
+        self.assertIn('http_request_duration_seconds_bucket{view="home",method="GET",status="200",le="0.005"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="home",method="GET",status="200",le="0.01"} 3', body)
+        self.assertIn('http_request_duration_seconds_count{view="home",method="GET",status="200"} 3', body)
+
+    def test_load_test_reads_the_rendered_metrics(self):
+        totals = {metrics.request_queries.name: {('api_bus_search',): [0, 0, 4] + [0] * 9 + [8]}}
+        samples = loadgen.parse_metrics(metrics.render(totals))
+        self.assertEqual(samples['http_request_db_queries_count', frozenset({('view', 'api_bus_search')})], 4)
+        self.assertEqual(samples['http_request_db_queries_sum', frozenset({('view', 'api_bus_search')})], 8)
+
+        result = loadgen.Result([200] * 99 + [None], [i / 1000 for i in range(100)], elapsed=2)
+        self.assertEqual(result.as_dict(), {
+            'requests': 100, 'failed': 1, 'rps': 49.5, 'p50_ms': 50.0, 'p95_ms': 95.0, 'p99_ms': 99.0,
+        })
+
+class RouteAutocompleteTest(BaseTestcase):
+    def setUp(self):
+        super().setUp()
+        city_index.invalidate()
+
+    def test_prefix_lookup(self):
+        response = self.api_client.get(reverse('api_route_autocomplete'), {'q': 'mu'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], ['Mumbai'])
+
+    def test_index_refreshes_when_buses_change(self):
+        self.assertEqual(city_index.suggest('pu'), [])
+        Bus.objects.create(
+            bus_number='TEST-002',
+            bus_name='Deccan Queen',
+            source='Mumbai',
+            destination='Pune',
+            total_seats=40,
+            price=Decimal('500.00'),
+            departure_time=time(7, 0),
+            arrival_time=time(10, 0),
+            journey_duration='3 hours'
+        )
+        self.assertEqual(city_index.suggest('pu'), ['Pune'])
+
+    def test_search_matches_substring(self):
+        response = self.api_client.get(reverse('api_bus_search'), {'source': 'elh'})
+        self.assertEqual(response.data['results'][0]['bus_name'], 'Test Express')
+
+class JourneyPlannerTest(BaseTestcase):
+    def setUp(self):
+        super().setUp()
+        connection_index.invalidate()
+        self.travel_date = date.today() + timedelta(days=3)
+        self.to_jaipur = self.add_bus('TEST-002', 'Delhi', 'Jaipur', time(6, 0), time(11, 0))
+        self.quick_change = self.add_bus('TEST-003', 'Jaipur', 'Mumbai', time(11, 20), time(18, 0))
+        self.to_mumbai = self.add_bus('TEST-004', 'Jaipur', 'Mumbai', time(12, 0), time(20, 0))
+
+    def add_bus(self, number, source, destination, departure, arrival, duration='5 hours'):
+        return Bus.objects.create(
+            bus_number=number, bus_name=f'{source} {destination}', source=source, destination=destination,
+            total_seats=40, price=Decimal('500.00'), departure_time=departure, arrival_time=arrival,
+            journey_duration=duration,
+        )
+
+    def plan(self, **kwargs):
+        results = connection_index.plan('delhi ', 'Mumbai', self.travel_date, **kwargs)
+        return [[leg['bus'] for leg in result['legs']] for result in results]
+
+    def test_transfers_that_arrive_earlier_than_the_direct_bus(self):
+        self.assertEqual(self.plan(), [[self.to_jaipur.id, self.to_mumbai.id], [self.bus.id]])
+        self.assertEqual(self.plan(min_layover=15), [[self.to_jaipur.id, self.quick_change.id], [self.bus.id]])
+        self.assertEqual(self.plan(max_transfers=0), [[self.bus.id]])
+        self.assertEqual(self.plan(after=7 * 60), [[self.bus.id]])
+
+    def test_connection_on_the_next_day(self):
+        self.add_bus('TEST-005', 'Mumbai', 'Goa', time(22, 0), time(6, 0), duration='32 hours')
+        results = connection_index.plan('Delhi', 'Goa', self.travel_date)
+        self.assertEqual(len(results), 1)
+        # The direct bus makes the 22:00 connection, so the change in Jaipur
+        # would not arrive any earlier
+        legs = results[0]['legs']
+        self.assertEqual([leg['bus'] for leg in legs], [self.bus.id, Bus.objects.get(bus_number='TEST-005').id])
+        self.assertEqual(legs[1]['layover_minutes'], 30)
+        self.assertEqual(legs[1]['arrival'], f'{self.travel_date + timedelta(days=2)}T06:00:00')
+        self.assertEqual(results[0]['duration_minutes'], 45 * 60)
+
+        # Arrives in Goa at 06:00, after that day's 05:00 bus has left
+        self.add_bus('TEST-006', 'Goa', 'Kochi', time(5, 0), time(15, 0), duration='10 hours')
+        legs = connection_index.plan('Delhi', 'Kochi', self.travel_date)[0]['legs']
+        self.assertEqual(legs[2]['date'], (self.travel_date + timedelta(days=3)).isoformat())
+        self.assertEqual(legs[2]['layover_minutes'], 23 * 60)
+
+    def test_timetable_follows_bus_changes(self):
+        self.plan()
+        self.to_mumbai.source = 'Agra'
+        self.to_mumbai.save()
+        self.assertEqual(self.plan(), [[self.bus.id]])
+        self.quick_change.delete()
+        self.assertEqual(self.plan(min_layover=15), [[self.bus.id]])
+
+    def test_api_reports_seats_per_leg(self):
+        booking = Booking.objects.create(
+            user=self.user, bus=self.to_mumbai, booking_date=self.travel_date, seats_booked=3,
+            total_price=Decimal('1500.00'), passenger_name='Test User', passenger_email='test@example.com',
+            passenger_phone='+91-9876543210',
+        )
+        apply_booking_change(booking)
+        response = self.api_client.get(reverse('api_journey_search'), {
+            'source': 'Delhi', 'destination': 'Mumbai', 'date': self.travel_date.isoformat(), 'max_transfers': 1,
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = response.data['results'][0]
+        self.assertEqual((first['transfers'], first['total_price'], first['available_seats']), (1, '1000.00', 37))
+        self.assertEqual([leg['available_seats'] for leg in first['legs']], [40, 37])
+        self.assertEqual([leg['layover_minutes'] for leg in first['legs']], [None, 60])
+
+        response = self.api_client.get(reverse('api_journey_search'), {'source': 'Delhi', 'destination': 'Mumbai'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_layovers_are_bounded(self):
+        response = self.api_client.get(reverse('api_journey_search'), {
+            'source': 'Delhi', 'destination': 'Mumbai', 'date': self.travel_date.isoformat(), 'min_layover': 24 * 60 + 1,
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Connections a huge layover would push years ahead are not offered
+        self.add_bus('TEST-005', 'Mumbai', 'Goa', time(22, 0), time(6, 0), duration='8 hours')
+        self.assertEqual(connection_index.plan('Delhi', 'Goa', self.travel_date, min_layover=10 ** 9), [])
+
+class AvailabilityCacheTest(BaseTestcase):
+    def test_second_lookup_is_a_cache_hit(self):
+        booking_date = self.booking.booking_date
+        self.assertEqual(get_available_seats(self.bus, booking_date), 40)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_available_seats(self.bus, booking_date), 40)
+        self.assertEqual(availability_cache.stats()['hits'], 1)
+        self.assertEqual(availability_cache.stats()['misses'], 1)
+
+    def test_booking_change_invalidates_on_commit(self):
+        booking_date = self.booking.booking_date
+        get_available_seats(self.bus, booking_date, include_held=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_booking_change(self.booking)
+        self.assertEqual(get_available_seats(self.bus, booking_date, include_held=True), 38)
+
+    def test_cache_errors_fall_back_to_database(self):
+        apply_booking_change(self.booking)
+        with mock.patch.object(cache, 'get_many', side_effect=ConnectionError('redis is down')):
+            seats = get_available_seats(self.bus, self.booking.booking_date, include_held=True)
+        self.assertEqual(seats, 38)
+        self.assertEqual(availability_cache.stats()['errors'], 1)
+
+    def test_stats_endpoint_requires_admin(self):
+        self.api_client.force_authenticate(user=self.user)
+        response = self.api_client.get(reverse('api_availability_cache_stats'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.api_client.get(reverse('api_availability_cache_stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_ratio', response.data)
+
 class BookBusViewTest(BaseTestcase):
     def test_create_booking(self):
         self.client.login(username='testuser', password='testpass123')
@@ -175,6 +1160,162 @@ class APIBusDetailTest(BaseTestcase):
                                        kwargs={'bus_id': self.bus.id})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
+class AsyncViewsTest(BaseTestcase):
+    def setUp(self):
+        super().setUp()
+        self.gateway = FakeGateway()
+        for name, value in [
+            ('async_transport', async_transport(self.gateway)),
+            ('_async_clients', weakref.WeakKeyDictionary()),
+            ('breaker', CircuitBreaker(3, 30)),
+        ]:
+            patcher = mock.patch(f'booking.payments.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def test_catalogue_matches_sync_api(self):
+        sync = self.api_client.get(reverse('api_bus_detail', kwargs={'pk': self.bus.id}))
+        response = self.client.get(reverse('async_bus_detail', kwargs={'pk': self.bus.id}))
+        self.assertEqual(response.json(), json.loads(sync.content))
+        self.assertEqual(self.client.get(reverse('async_bus_detail', kwargs={'pk': 999999})).status_code, 404)
+
+        params = {'source': 'del', 'date': self.booking.booking_date.isoformat()}
+        sync = self.api_client.get(reverse('api_bus_search'), params)
+        response = self.client.get(reverse('async_bus_search'), params)
+        self.assertEqual(response.json()['results'], json.loads(sync.content)['results'])
+        self.assertEqual(response.json()['results'][0]['available_seats'], 40)
+
+    def test_availability(self):
+        apply_booking_change(self.booking)
+        response = self.client.get(
+            reverse('async_bus_availability', kwargs={'pk': self.bus.id}),
+            {'date': self.booking.booking_date.isoformat()}
+        )
+        self.assertEqual(response.json()['available_seats'], 38)
+
+    def test_payment_order_created_once(self):
+        url = reverse('async_payment_order', kwargs={'pk': self.booking.id})
+        self.assertEqual(self.client.post(url).status_code, 401)
+        first = self.client.post(url, **self.auth).json()
+        second = self.client.post(url, **self.auth).json()
+        self.assertEqual(first['razorpay_order_id'], second['razorpay_order_id'])
+        self.assertEqual(first['amount'], 240000)
+        self.assertEqual(len(self.gateway.orders), 1)
+        self.assertEqual(Booking.objects.get(id=self.booking.id).order_id, first['razorpay_order_id'])
+
+    def test_payment_order_gateway_down(self):
+        self.gateway.fail_next = 10
+        response = self.client.post(reverse('async_payment_order', kwargs={'pk': self.booking.id}), **self.auth)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.gateway.calls, settings.RAZORPAY_RETRIES + 1)
+
+    async def test_slow_gateway_calls_overlap(self):
+        self.gateway.latency = 0.3
+        bookings = [self.booking] + [
+            await Booking.objects.acreate(
+                user=self.user, bus=self.bus, booking_date=self.booking.booking_date, seats_booked=1,
+                total_price=Decimal('1200.00'), passenger_name='Async', passenger_email='async@example.com',
+                passenger_phone='+91-9876543210'
+            ) for _ in range(4)
+        ]
+        client = AsyncClient()
+        started = timezone.now()
+        responses = await asyncio.gather(*[
+            client.post(reverse('async_payment_order', kwargs={'pk': booking.id}),
+                        headers={'Authorization': self.auth['HTTP_AUTHORIZATION']})
+            for booking in bookings
+        ])
+        self.assertEqual([response.status_code for response in responses], [200] * 5)
+        # One at a time this would take 1.5s
+        self.assertLess((timezone.now() - started).total_seconds(), 1.0)
+
+class FastBusSerializationTest(BaseTestcase):
+    def test_values_path_matches_bus_serializer(self):
+        Bus.objects.create(
+            bus_name='Night Rider', bus_number='NR001', source='Pune', destination='Goa',
+            total_seats=30, price=Decimal('999.5'), departure_time=time(22, 15, 30),
+            arrival_time=time(6, 0), journey_duration='7 hours 45 minutes'
+        )
+        buses = Bus.objects.order_by('id')
+        expected = BusSerializer(buses, many=True).data
+        self.assertEqual(BUS_VALUES.many(BUS_VALUES.values(buses)), [dict(bus) for bus in expected])
+
+    def test_fast_renderer_matches_json_renderer(self):
+        data = BusSerializer(Bus.objects.all(), many=True).data
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+    def test_bus_detail_uses_values_path(self):
+        response = self.api_client.get(reverse('api_bus_detail', kwargs={'pk': self.bus.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), BusSerializer(self.bus).data)
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_SIZE=1000)
+    def test_large_json_responses_are_compressed(self):
+        for i in range(5):
+            Bus.objects.create(
+                bus_name=f'Bus {i}', bus_number=f'B{i:03}', source='Mumbai', destination='Pune',
+                total_seats=40, price=Decimal('500.00'), departure_time=time(9, 0),
+                arrival_time=time(13, 0), journey_duration='4 hours'
+            )
+        self.api_client.force_authenticate(user=self.user)
+        response = self.api_client.get(reverse('api_bus_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['results']), 6)
+
+        response = self.api_client.get(reverse('api_bus_detail', kwargs={'pk': self.bus.id}),
+                                       HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+class ConditionalCatalogueTest(BaseTestcase):
+    def setUp(self):
+        super().setUp()
+        self.api_client.force_authenticate(user=self.user)
+
+    def test_bus_list_not_modified(self):
+        response = self.api_client.get(reverse('api_bus_list'))
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            response = self.api_client.get(reverse('api_bus_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.bus.price = Decimal('550.00')
+        self.bus.save()
+        response = self.api_client.get(reverse('api_bus_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_bus_list_falls_back_to_database_without_cache(self):
+        with mock.patch('booking.conditional.get_catalogue_version', return_value=None):
+            etag = self.api_client.get(reverse('api_bus_list'))['ETag']
+            response = self.api_client.get(reverse('api_bus_list'), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            Bus.objects.create(
+                bus_name='Night Rider', bus_number='NR001', source='Pune', destination='Goa',
+                total_seats=30, price=Decimal('999.50'), departure_time=time(22, 0),
+                arrival_time=time(6, 0), journey_duration='8 hours'
+            )
+            response = self.api_client.get(reverse('api_bus_list'), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_bus_detail_if_modified_since(self):
+        url = reverse('api_bus_detail', kwargs={'pk': self.bus.id})
+        response = self.api_client.get(url)
+        response = self.api_client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.api_client.get(reverse('api_bus_detail', kwargs={'pk': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_with_date_is_not_conditional(self):
+        response = self.api_client.get(reverse('api_bus_search'), {'source': 'Mumbai'})
+        self.assertTrue(response.has_header('ETag'))
+        response = self.api_client.get(reverse('api_bus_search'), {'source': 'Mumbai', 'date': '2025-01-15'})
+        self.assertFalse(response.has_header('ETag'))
+
 class APICreateBookingTest(BaseTestcase):
     def test_create_booking(self):
         self.api_client.force_authenticate(user=self.user)
@@ -190,14 +1331,382 @@ class APICreateBookingTest(BaseTestcase):
         
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         
+class SeatMapTest(BaseTestcase):
+    def setUp(self):
+        super().setUp()
+        self.api_client.force_authenticate(user=self.user)
+
+    def book(self, seats, booking_date='2025-03-01', **extra):
+        return self.api_client.post(reverse('api_create_booking'), {
+            'bus': self.bus.id, 'booking_date': booking_date, 'seats_booked': len(seats) or extra.pop('count'),
+            'passenger_name': 'Seat Picker', 'passenger_email': 'seat@example.com',
+            'passenger_phone': '+91-9876543210', **({'seat_numbers': seats} if seats else {}), **extra
+        }, format='json')
+
+    def seatmap(self, booking_date='2025-03-01', pk=None):
+        return self.api_client.get(reverse('api_bus_seatmap', kwargs={'pk': pk or self.bus.id}), {'date': booking_date})
+
+    def test_bitmap(self):
+        seat_map = SeatMap()
+        seat_map.take([1, 9, 40])
+        self.assertTrue(seat_map.is_taken(9))
+        self.assertFalse(seat_map.is_taken(10))
+        self.assertFalse(seat_map.is_taken(200))
+        self.assertEqual(seat_map.taken(), [1, 9, 40])
+        self.assertEqual(seat_map.to_bytes(), bytes([0x80, 0x80, 0, 0, 0x01]))
+        seat_map.release([9, 12])
+        self.assertEqual(seat_map.count(), 2)
+
+    def test_picked_seats_show_on_seat_map(self):
+        self.assertEqual(self.book([3, 4]).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.book([], count=2).status_code, status.HTTP_201_CREATED)
+        response = self.seatmap()
+        self.assertEqual(response.data['taken'], [3, 4])
+        self.assertEqual(response.data['available_seats'], 36)
+        self.assertEqual(response.data['unassigned_seats'], 2)
+        self.assertEqual(base64.b64decode(response.data['seat_map']), bytes([0x30, 0, 0, 0, 0]))
+
+    def test_taken_seats_cannot_be_claimed_again(self):
+        self.book([5, 6])
+        response = self.book([6, 7])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['seat_numbers'], [6])
+        response = self.book([41])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Booking.objects.filter(passenger_name='Seat Picker').count(), 1)
+        self.assertEqual(self.seatmap().data['taken'], [5, 6])
+
+    def test_count_bookings_limit_seat_picks(self):
+        self.book([], count=39)
+        response = self.book([1, 2])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['error'], 'Only 1 seats available')
+        self.assertEqual(self.book([1]).status_code, status.HTTP_201_CREATED)
+
+    def test_cancel_and_expiry_free_seats(self):
+        cancelled = self.book([1, 2]).data['booking']
+        expiring = Booking.objects.get(id=self.book([3]).data['booking']['id'])
+        self.api_client.post(reverse('api_cancel_booking', kwargs={'pk': cancelled['id']}))
+        Booking.objects.filter(id=expiring.id).update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+        expire_holds()
+        response = self.seatmap()
+        self.assertEqual(response.data['taken'], [])
+        self.assertEqual(response.data['available_seats'], 40)
+
+    def test_seat_map_without_bookings(self):
+        response = self.seatmap('2025-04-01')
+        self.assertEqual(response.data['taken'], [])
+        self.assertEqual(response.data['available_seats'], 40)
+        self.assertEqual(self.seatmap(pk=999999).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.seatmap('tomorrow').status_code, status.HTTP_400_BAD_REQUEST)
+
+class GroupBookingTest(BaseTestcase):
+    def setUp(self):
+        super().setUp()
+        self.other_bus = Bus.objects.create(
+            bus_number='TEST-002', bus_name='Group Express', source='Delhi', destination='Jaipur',
+            total_seats=10, price=Decimal('500.00'), departure_time=time(7, 0),
+            arrival_time=time(12, 0), journey_duration='5 hours'
+        )
+        self.api_client.force_authenticate(user=self.user)
+
+    def line(self, bus, seats=1, booking_date='2025-02-01', **extra):
+        return {
+            'bus': bus.id, 'booking_date': booking_date, 'seats_booked': seats,
+            'passenger_name': 'Group Passenger', 'passenger_email': 'group@example.com',
+            'passenger_phone': '+91-9876543210', **extra
+        }
+
+    def post(self, lines, **extra):
+        return self.api_client.post(reverse('api_create_group_booking'), {'bookings': lines, **extra}, format='json')
+
+    def test_books_all_lines(self):
+        response = self.post([self.line(self.bus, 2), self.line(self.other_bus, 3), self.line(self.bus, 1)])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created'] * 3)
+        references = [r['booking']['booking_reference'] for r in response.data['results']]
+        self.assertEqual(len(set(references)), 3)
+        self.assertEqual(response.data['results'][1]['booking']['total_price'], '1500.00')
+        self.assertEqual(SeatInventory.objects.get(bus=self.bus, date=date(2025, 2, 1)).seats_held, 3)
+        self.assertEqual(get_available_seats(self.other_bus, date(2025, 2, 1), include_held=True), 7)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        with CaptureQueriesContext(connection) as few:
+            self.post([self.line(self.bus)] * 2)
+        with CaptureQueriesContext(connection) as many:
+            response = self.post([
+                self.line(bus, booking_date=f'2025-03-{day:02}')
+                for bus in (self.bus, self.other_bus) for day in range(1, 21) for _ in range(5)
+            ])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # SQLite splits the booking INSERT into batches under its variable
+        # limit; everything else is one query regardless of size
+        others = lambda ctx: [q for q in ctx.captured_queries if not q['sql'].startswith('INSERT INTO "booking_booking"')]
+        self.assertEqual(len(others(few)), len(others(many)))
+        self.assertEqual(Booking.objects.filter(passenger_name='Group Passenger').count(), 202)
+
+    def test_nothing_booked_when_a_line_does_not_fit(self):
+        response = self.post([self.line(self.other_bus, 6), self.line(self.bus, 2), self.line(self.other_bus, 6)])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(
+            [r['status'] for r in response.data['results']], ['not_booked', 'not_booked', 'rejected']
+        )
+        self.assertEqual(response.data['results'][2]['error'], 'Only 4 seats available')
+        self.assertFalse(Booking.objects.filter(passenger_name='Group Passenger').exists())
+        self.assertEqual(get_available_seats(self.other_bus, date(2025, 2, 1), include_held=True), 10)
+
+    def test_allow_partial_books_lines_that_fit(self):
+        response = self.post([self.line(self.other_bus, 6), self.line(self.other_bus, 6), self.line(self.other_bus, 4)],
+                             allow_partial=True)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created', 'rejected', 'created'])
+        self.assertEqual(get_available_seats(self.other_bus, date(2025, 2, 1), include_held=True), 0)
+
+    def test_invalid_lines_are_reported_per_line(self):
+        response = self.post([self.line(self.bus), self.line(self.bus, seats=0)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['bookings'][0], {})
+        self.assertIn('seats_booked', response.data['bookings'][1])
+
+        response = self.post([self.line(self.bus), {**self.line(self.bus), 'bus': 999999}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['bookings'][1], {'bus': ['Bus not found']})
+        self.assertFalse(Booking.objects.filter(passenger_name='Group Passenger').exists())
+
 class APIMyBookingsTest(BaseTestcase):
     def test_get_my_bookings(self):
         self.api_client.force_authenticate(user=self.user)
-        response = self.api_client.get(reverse('api_my_bookings'))
+        response = self.api_client.get(reverse('api_my_bookings'), {'count': 'exact'})
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['count'], 1)
         
+class KeysetPaginationTest(BaseTestcase):
+    def setUp(self):
+        super().setUp()
+        for i in range(24):
+            Booking.objects.create(
+                user=self.user,
+                bus=self.bus,
+                booking_date=date.today(),
+                seats_booked=1,
+                total_price=Decimal('1200.00'),
+                passenger_name=f'Passenger {i}',
+                passenger_email='test@example.com',
+                passenger_phone='+91-9876543210'
+            )
+        # Many bookings share a timestamp, so the id tiebreaker matters
+        Booking.objects.filter(id__lte=self.booking.id + 12).update(booking_time=self.booking.booking_time)
+        self.api_client.force_authenticate(user=self.user)
+
+    def walk(self, url, key):
+        ids, urls = [], []
+        while url:
+            response = self.api_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data[key])
+            urls.append(url)
+            url = response.data['next']
+        return ids, urls, response
+
+    def test_my_bookings_pages_cover_every_booking_once(self):
+        ids, urls, last = self.walk(reverse('api_my_bookings'), 'bookings')
+        expected = list(Booking.objects.order_by('-booking_time', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(urls), 3)
+        self.assertNotIn('count', last.data)
+
+        previous = self.api_client.get(last.data['previous'])
+        self.assertEqual([item['id'] for item in previous.data['bookings']], expected[10:20])
+
+    def test_page_cost_does_not_depend_on_position(self):
+        _, urls, _ = self.walk(reverse('api_my_bookings'), 'bookings')
+        counts = []
+        for url in urls[:2]:
+            with CaptureQueriesContext(connection) as ctx:
+                self.api_client.get(url)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_approx_count(self):
+        response = self.api_client.get(reverse('api_my_bookings'), {'count': 'approx'})
+        self.assertIn('count', response.data)
+
+    def test_invalid_cursor(self):
+        response = self.api_client.get(reverse('api_my_bookings'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bus_list_is_keyset_paged(self):
+        for i in range(12):
+            Bus.objects.create(
+                bus_number=f'PAGE-{i:03d}',
+                bus_name=f'Page Express {i}',
+                source='Delhi',
+                destination='Jaipur',
+                total_seats=30,
+                price=Decimal('700.00'),
+                departure_time=time(i, 0),
+                arrival_time=time(i + 5, 0),
+                journey_duration='5 hours'
+            )
+        ids, urls, _ = self.walk(reverse('api_bus_list'), 'results')
+        expected = list(Bus.objects.order_by('departure_time', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(urls), 2)
+
+    def test_my_bookings_html_is_paged(self):
+        Booking.objects.update(payment_status='completed')
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(reverse('my_bookings'))
+        self.assertEqual(len(response.context['bookings']), 10)
+        self.assertContains(response, 'Next')
+        response = self.client.get(reverse('my_bookings'), {'cursor': response.context['page'].next_cursor})
+        self.assertEqual(len(response.context['bookings']), 10)
+
+class QueryBudgetTest(QueryBudgetMixin, BaseTestcase):
+    """Hits every named URL with 30 buses and 30 bookings in the database."""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(30):
+            bus = Bus.objects.create(
+                bus_number=f'BUDGET-{i:03d}',
+                bus_name=f'Budget Express {i}',
+                source='Delhi',
+                destination='Mumbai',
+                total_seats=40,
+                price=Decimal('800.00'),
+                departure_time=time(i % 24, 0),
+                arrival_time=time((i + 6) % 24, 0),
+                journey_duration='6 hours'
+            )
+            booking = Booking.objects.create(
+                user=self.user,
+                bus=bus,
+                booking_date=date.today(),
+                seats_booked=1,
+                total_price=Decimal('800.00'),
+                passenger_name=f'Passenger {i}',
+                passenger_email='test@example.com',
+                passenger_phone='+91-9876543210',
+                payment_status='completed' if i % 2 else 'pending',
+                order_id=f'order_budget_{i}'
+            )
+            apply_booking_change(booking)
+        apply_booking_change(self.booking)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.api_client.force_authenticate(user=self.user)
+        self.today = date.today().isoformat()
+
+    def requests(self):
+        booking_url = lambda name: reverse(name, kwargs={'booking_id': self.booking.id})
+        api_booking_url = lambda name: reverse(name, kwargs={'pk': self.booking.id})
+        booking_form = {
+            'seats_booked': 2,
+            'passenger_name': 'Budget User',
+            'passenger_phone': '+91-9876543210'
+        }
+        return {
+            'home': lambda: self.client.get(reverse('home')),
+            'signup': lambda: self.client.get(reverse('signup')),
+            'login': lambda: self.client.get(reverse('login')),
+            'logout': lambda: self.client.get(reverse('logout')),
+            'search_buses': lambda: self.client.get(reverse('search_buses'), {'source': 'Delhi', 'date': self.today}),
+            'book_bus': lambda: self.client.post(
+                reverse('book_bus', kwargs={'bus_id': self.bus.id}) + f'?date={self.today}', booking_form),
+            'booking_review': lambda: self.client.get(booking_url('booking_review')),
+            'modify_booking': lambda: self.client.post(booking_url('modify_booking'), booking_form),
+            'payment': lambda: self.client.get(reverse('payment', kwargs={'booking_id': self.booking.id})),
+            'payment_success': lambda: self.client.post(reverse('payment_success'), {'razorpay_order_id': 'x'}),
+            'payment_failed': lambda: self.client.get(reverse('payment_failed')),
+            'razorpay_webhook': self.deliver_webhook,
+            'booking_success': lambda: self.client.get(booking_url('booking_success')),
+            'my_bookings': lambda: self.client.get(reverse('my_bookings')),
+            'cancel_booking': lambda: self.client.post(booking_url('cancel_booking')),
+            'api_register': lambda: self.api_client.post(reverse('api_register'), {
+                'username': 'budgetuser', 'email': 'budget@example.com', 'password': 'budgetpass123'
+            }, format='json'),
+            'api_login': lambda: self.api_client.post(reverse('api_login'), {
+                'username': 'testuser', 'password': 'testpass123'
+            }, format='json'),
+            'api_refresh': lambda: self.api_client.post(reverse('api_refresh'), {
+                'refresh': str(RefreshToken.for_user(self.user))
+            }, format='json'),
+            'api_bus_list': lambda: self.api_client.get(reverse('api_bus_list')),
+            'api_bus_detail': lambda: self.api_client.get(reverse('api_bus_detail', kwargs={'pk': self.bus.id})),
+            'async_bus_detail': lambda: self.client.get(reverse('async_bus_detail', kwargs={'pk': self.bus.id})),
+            'async_bus_availability': lambda: self.client.get(
+                reverse('async_bus_availability', kwargs={'pk': self.bus.id}), {'date': self.today}),
+            'async_bus_search': lambda: self.client.get(reverse('async_bus_search'), {
+                'source': 'Delhi', 'date': self.today
+            }),
+            'async_payment_order': lambda: self.client.post(
+                reverse('async_payment_order', kwargs={'pk': self.booking.id}),
+                HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'),
+            'api_bus_seatmap': lambda: self.api_client.get(
+                reverse('api_bus_seatmap', kwargs={'pk': self.bus.id}), {'date': self.today}),
+            'api_bus_search': lambda: self.api_client.get(reverse('api_bus_search'), {
+                'source': 'Delhi', 'date': self.today
+            }),
+            'api_journey_search': lambda: self.api_client.get(reverse('api_journey_search'), {
+                'source': 'Delhi', 'destination': 'Mumbai', 'date': self.today
+            }),
+            'api_my_bookings': lambda: self.api_client.get(reverse('api_my_bookings')),
+            'api_create_booking': lambda: self.api_client.post(reverse('api_create_booking'), {
+                'bus': self.bus.id, 'booking_date': self.today, **booking_form,
+                'passenger_email': 'budget@example.com'
+            }, format='json'),
+            'api_create_group_booking': lambda: self.api_client.post(reverse('api_create_group_booking'), {
+                'bookings': [
+                    {'bus': self.bus.id, 'booking_date': self.today, **booking_form,
+                     'passenger_email': f'group{i}@example.com'}
+                    for i in range(10)
+                ]
+            }, format='json'),
+            'api_booking_detail': lambda: self.api_client.get(api_booking_url('api_booking_detail')),
+            'api_modify_booking': lambda: self.api_client.put(api_booking_url('api_modify_booking'), {
+                'bus': self.bus.id, 'booking_date': self.today, **booking_form,
+                'passenger_email': 'budget@example.com'
+            }, format='json'),
+            'api_cancel_booking': lambda: self.api_client.post(api_booking_url('api_cancel_booking')),
+            'api_route_autocomplete': lambda: self.api_client.get(reverse('api_route_autocomplete'), {'q': 'de'}),
+            'api_availability_cache_stats': lambda: self.api_client.get(reverse('api_availability_cache_stats')),
+            'metrics': self.scrape_metrics,
+        }
+
+    def scrape_metrics(self):
+        with self.settings(METRICS_TOKEN='budget'):
+            return self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer budget')
+
+    def deliver_webhook(self):
+        with self.settings(RAZORPAY_WEBHOOK_SECRET='whsec_budget'):
+            body, headers = FakeGateway().webhook('payment.captured', 'order_budget_0', 'pay_budget')
+            return self.client.post(reverse('razorpay_webhook'), body, content_type='application/json', **headers)
+
+    def test_every_url_declares_a_budget(self):
+        self.assertEqual(url_names() - set(collect_query_budgets()), set())
+        self.assertEqual(url_names() - set(self.requests()), set())
+
+    @mock.patch('booking.payments.razorpay_client', FakeRazorpayClient())
+    @mock.patch('booking.payments.async_transport', async_transport(FakeGateway()))
+    @mock.patch('booking.payments._async_clients', weakref.WeakKeyDictionary())
+    def test_urls_stay_within_budget(self):
+        for url_name, send in self.requests().items():
+            # Undo each request afterwards so every URL sees the same data
+            with transaction.atomic():
+                self.client.force_login(self.user)
+                with self.subTest(url_name=url_name):
+                    with self.assertQueryBudget(url_name):
+                        response = send()
+                    self.assertLess(response.status_code, 400, url_name)
+                transaction.set_rollback(True)
+
+    @query_budget('api_my_bookings')
+    def test_query_budget_decorator(self):
+        self.api_client.get(reverse('api_my_bookings'))
+
 class APIModifyBookingTest(BaseTestcase):
     def test_modify_booking(self):
         self.api_client.force_authenticate(user=self.user)
@@ -1,5 +1,6 @@
 from django.urls import path
 from . import views
+from .metrics import metrics_view
 
 urlpatterns = [
     path('', views.home_view, name='home'),
@@ -13,7 +14,30 @@ urlpatterns = [
     path('payment/<int:booking_id>/', views.payment_view, name='payment'),
     path('payment/success/', views.payment_success, name='payment_success'),
     path('payment/failed/', views.payment_failed, name='payment_failed'),
+    path('payment/webhook/', views.razorpay_webhook, name='razorpay_webhook'),
     path('booking/success/<int:booking_id>/', views.booking_success, name='booking_success'),
     path('my-bookings/', views.my_bookings, name='my_bookings'),
     path('cancel/<int:booking_id>/', views.cancel_booking, name='cancel_booking'),
-]
\ No newline at end of file
+    path('metrics', metrics_view, name='metrics'),
+]
+
+# Most queries a single request to each URL may run, enforced by
+# booking.testing in the test suite. Declare one for every new URL.
+QUERY_BUDGETS = {
+    'home': 5,
+    'signup': 4,
+    'login': 4,
+    'logout': 6,
+    'search_buses': 6,
+    'book_bus': 14,
+    'booking_review': 5,
+    'modify_booking': 10,
+    'payment': 6,
+    'payment_success': 12,
+    'payment_failed': 4,
+    'razorpay_webhook': 1,
+    'booking_success': 5,
+    'my_bookings': 5,
+    'cancel_booking': 11,
+    'metrics': 0,
+}
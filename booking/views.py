@@ -2,19 +2,29 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Sum
 from django.conf import settings
+from django.db import transaction
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.http import JsonResponse
+from django.utils import timezone
+from razorpay.errors import SignatureVerificationError
+import logging
 from datetime import datetime
-import razorpay
 import json
+from . import payments
 from .models import Bus, Booking
 from .forms import SignUpForm, BookingForm
-from .tasks import send_booking_confirmation_email
+from .inventory import apply_booking_change, get_available_seats, get_available_seats_many, release_booking
+from .seatmap import SeatsUnavailable, release_seats
+from .routes import filter_route
+from .pagination import InvalidCursor, keyset_paginate
+from .emails import queue_confirmation_emails
+from .tasks import create_payment_order, process_payment_events
 
-# Initialize Razorpay client
-razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+logger = logging.getLogger(__name__)
 
 def signup_view(request):
     if request.method == 'POST':
@@ -48,8 +58,11 @@ def logout_view(request):
 
 @login_required
 def home_view(request):
-    buses = Bus.objects.all()
-    return render(request, 'booking/home.html', {'buses': buses})
+    try:
+        buses = keyset_paginate(Bus.objects.all(), ('departure_time', 'id'), request.GET.get('cursor'))
+    except InvalidCursor:
+        return redirect('home')
+    return render(request, 'booking/home.html', {'buses': buses, 'page': buses})
 
 @login_required
 def search_buses(request):
@@ -57,25 +70,17 @@ def search_buses(request):
     source = request.GET.get('source', '')
     destination = request.GET.get('destination', '')
     
-    buses = Bus.objects.all()
-    if source:
-        buses = buses.filter(source__icontains=source)
-    if destination:
-        buses = buses.filter(destination__icontains=destination)
+    buses = filter_route(Bus.objects.all(), source, destination)
     
     results = []
     if date_str:
         search_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        buses = list(buses)
+        available = get_available_seats_many(buses, search_date, include_held=True)
         for bus in buses:
-            booked = Booking.objects.filter(
-                bus=bus, 
-                booking_date=search_date,
-                payment_status='completed'
-            ).aggregate(total=Sum('seats_booked'))['total'] or 0
-            available = bus.total_seats - booked
             results.append({
                 'bus': bus,
-                'available_seats': available,
+                'available_seats': available[bus.id],
                 'date': search_date
             })
     
@@ -97,12 +102,7 @@ def book_bus(request, bus_id):
     
     booking_date = datetime.strptime(date_str, '%Y-%m-%d').date()
     
-    booked = Booking.objects.filter(
-        bus=bus, 
-        booking_date=booking_date,
-        payment_status='completed'
-    ).aggregate(total=Sum('seats_booked'))['total'] or 0
-    available_seats = bus.total_seats - booked
+    available_seats = get_available_seats(bus, booking_date, include_held=True)
     
     if request.method == 'POST':
         form = BookingForm(request.POST)
@@ -116,12 +116,28 @@ def book_bus(request, bus_id):
                 booking.bus = bus
                 booking.booking_date = booking_date
                 booking.total_price = bus.price * seats
-                booking.save()
-                
-                # Store booking ID in session for payment
-                request.session['pending_booking_id'] = booking.id
-                
-                return redirect('payment', booking_id=booking.id)
+                booking.start_hold()
+                def prepare_order():
+                    # Have the Razorpay order ready by the time the payment
+                    # page loads; the page creates it itself if this fails
+                    try:
+                        create_payment_order.delay(booking.id)
+                    except Exception as e:
+                        logger.warning('Could not queue payment order for booking %s: %s', booking.id, e)
+                try:
+                    with transaction.atomic():
+                        booking.save()
+                        apply_booking_change(booking)
+                        transaction.on_commit(prepare_order)
+                except SeatsUnavailable as e:
+                    # Someone else took the seats since the page loaded
+                    messages.error(request, str(e))
+                    available_seats = get_available_seats(bus, booking_date, include_held=True)
+                else:
+                    # Store booking ID in session for payment
+                    request.session['pending_booking_id'] = booking.id
+
+                    return redirect('payment', booking_id=booking.id)
     else:
         form = BookingForm(initial={'passenger_email': request.user.email})
     
@@ -134,67 +150,86 @@ def book_bus(request, bus_id):
     
 @login_required
 def booking_review(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    booking = get_object_or_404(Booking.objects.select_related('bus'), id=booking_id, user=request.user)
     
     if booking.payment_status != 'pending':
         messages.info(request, 'booking cannot be modified')
         return redirect('my_bookings')
     
-    booked = Booking.objects.filter(bus=booking.bus, booking_date=booking.booking_date, payment_status__in=['pending','completed']).exclude(id=booking.id).aggregate(total=Sum('seats_booked'))['total'] or 0
-    available_seats = booking.bus.total_seats - booked
+    # This booking's own seats are part of seats_held, so add them back
+    available_seats = get_available_seats(booking.bus, booking.booking_date, include_held=True) + booking.seats_booked
     
     return render(request, 'booking/booking_review.html', {'booking': booking, 'available_seats': available_seats})
 
 @login_required
 def modify_booking(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    booking = get_object_or_404(Booking.objects.select_related('bus'), id=booking_id, user=request.user)
     if not booking.can_modify():
         messages.error(request, 'booking cannot be modified')
         return redirect('my_bookings')
     
-    booked = Booking.objects.filter(bus=booking.bus, booking_date=booking.booking_date, payment_status__in=['pending','completed']).exclude(id=booking_id).aggregate(total=Sum('seats_booked'))['total'] or 0
-    available_seats = booking.bus.total_seats - booked
+    # This booking's own seats are part of seats_held, so add them back
+    old_seats = booking.seats_booked
+    available_seats = get_available_seats(booking.bus, booking.booking_date, include_held=True) + old_seats
     
     if request.method == 'POST':
         form = BookingForm(request.POST, instance=booking)
         if form.is_valid():
             seats = form.cleaned_data['seats_booked']
-            if seats > available_seats + booking.seats_booked:
-                messages.error(request, f'only {available_seats + booking.seats_booked} seats are available')
+            if seats > available_seats:
+                messages.error(request, f'only {available_seats} seats are available')
             else:
                 booking = form.save(commit=False)
                 booking.total_price = booking.bus.price * seats
-                booking.save()
-                messages.success(request, 'booking updated successfully')
-                return redirect('booking_review', booking_id=booking.id)
+                try:
+                    with transaction.atomic():
+                        # Locked, and re-read, so a payment or the hold
+                        # sweeper cannot change it under us
+                        current = Booking.objects.select_for_update().values(
+                            'payment_status', 'seats_booked'
+                        ).get(pk=booking.pk)
+                        if current['payment_status'] != 'pending':
+                            messages.error(request, 'booking cannot be modified')
+                            return redirect('my_bookings')
+                        old_seats = current['seats_booked']
+                        if seats != old_seats:
+                            # Picked seats no longer match the count
+                            release_seats(booking.bus_id, booking.booking_date, booking.seat_numbers)
+                            booking.seat_numbers = []
+                        booking.save()
+                        apply_booking_change(booking, 'pending', old_seats)
+                except SeatsUnavailable as e:
+                    messages.error(request, str(e))
+                else:
+                    messages.success(request, 'booking updated successfully')
+                    return redirect('booking_review', booking_id=booking.id)
     else:
         form = BookingForm(instance=booking)
-    return render(request, 'booking/modify_booking.html', {'booking': booking,'form': form, 'available_seats': available_seats + booking.seats_booked})
+    return render(request, 'booking/modify_booking.html', {'booking': booking,'form': form, 'available_seats': available_seats})
 
 @login_required
 def payment_view(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    booking = get_object_or_404(Booking.objects.select_related('bus'), id=booking_id, user=request.user)
     
     if booking.payment_status == 'completed':
         messages.info(request, 'This booking is already paid')
         return redirect('my_bookings')
+    if booking.payment_status == 'expired':
+        messages.error(request, 'The seat hold for this booking has expired, please book again')
+        return redirect('home')
     
-    # Create Razorpay order
-    amount = int(booking.total_price * 100)  # Convert to paise
-    razorpay_order = razorpay_client.order.create({
-        'amount': amount,
-        'currency': 'INR',
-        'payment_capture': 1
-    })
-    
-    booking.order_id = razorpay_order['id']
-    booking.save()
+    # Reuses the order created after booking unless the amount changed
+    try:
+        order_id = payments.ensure_order(booking)
+    except payments.PaymentGatewayError:
+        messages.error(request, 'Payments are unavailable right now, please try again in a minute')
+        return redirect('booking_review', booking_id=booking.id)
     
     context = {
         'booking': booking,
         'razorpay_key_id': settings.RAZORPAY_KEY_ID,
-        'razorpay_order_id': razorpay_order['id'],
-        'amount': amount,
+        'razorpay_order_id': order_id,
+        'amount': payments.order_amount(booking),
     }
     
     return render(request, 'booking/payment.html', context)
@@ -209,36 +244,78 @@ def payment_success(request):
             signature = request.POST.get('razorpay_signature')
             
             # Verify payment signature
-            params_dict = {
-                'razorpay_order_id': order_id,
-                'razorpay_payment_id': payment_id,
-                'razorpay_signature': signature
-            }
-            
-            razorpay_client.utility.verify_payment_signature(params_dict)
+            payments.verify_payment_signature(order_id, payment_id, signature)
             
-            # Update booking
-            booking = Booking.objects.get(order_id=order_id)
-            booking.payment_status = 'completed'
-            booking.payment_id = payment_id
-            booking.payment_method = 'Razorpay'
-            booking.save()
+            # Update booking. The row lock keeps the hold sweeper from
+            # expiring it while it is being paid for; a booking that expired
+            # before the payment came in takes its seats again. One that was
+            # cancelled or failed stays that way.
+            with transaction.atomic():
+                booking = Booking.objects.select_for_update(of=('self',)).select_related('bus').get(order_id=order_id)
+                old_status = booking.payment_status
+                if old_status not in ('cancelled', 'failed'):
+                    booking.payment_status = 'completed'
+                booking.payment_id = payment_id
+                booking.payment_method = 'Razorpay'
+                booking.save()
+                apply_booking_change(booking, old_status, booking.seats_booked)
+
+            if booking.payment_status != 'completed':
+                logger.warning('Refund needed, paid for a %s booking: %s', old_status, payment_id)
+                messages.error(request, f'This booking was {old_status} before the payment came in. Your payment will be refunded.')
+                return redirect('payment_failed')
             
-            # Send confirmation email asynchronously
-            send_booking_confirmation_email.delay(booking.id)
+            # The completed booking is now in the confirmation email queue
+            if old_status != 'completed':
+                queue_confirmation_emails()
             
             messages.success(request, 'Payment successful! Booking confirmed.')
             return redirect('booking_success', booking_id=booking.id)
             
+        except SeatsUnavailable:
+            # Paid after the hold expired, and the seats have gone since.
+            # Keep the payment id so it can be refunded.
+            Booking.objects.filter(order_id=order_id).exclude(payment_status='completed').update(
+                payment_status='failed', payment_id=payment_id, payment_method='Razorpay', modified_at=timezone.now()
+            )
+            logger.warning('Refund needed, paid after the hold expired and sold out: %s', payment_id)
+            messages.error(request, 'Your seat hold expired and the bus has sold out since. Your payment will be refunded.')
+            return redirect('payment_failed')
         except Exception as e:
             messages.error(request, f'Payment verification failed: {str(e)}')
             return redirect('payment_failed')
     
     return redirect('home')
 
+@csrf_exempt
+@require_POST
+def razorpay_webhook(request):
+    # Only verify and store the event here; process_payment_events applies
+    # it, so a burst of webhooks never waits on booking updates.
+    try:
+        payments.record_payment_event(
+            request.body,
+            request.headers.get('X-Razorpay-Signature'),
+            request.headers.get('X-Razorpay-Event-Id'),
+        )
+    except ImproperlyConfigured as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    except (SignatureVerificationError, ValueError):
+        return JsonResponse({'error': 'Invalid webhook'}, status=400)
+
+    def kick_consumer():
+        # At most one extra task per second; beat covers anything missed
+        try:
+            if cache.add('payment_events:kick', 1, timeout=1):
+                process_payment_events.delay()
+        except Exception as e:
+            logger.warning('Could not queue payment event processing: %s', e)
+    transaction.on_commit(kick_consumer)
+    return JsonResponse({'status': 'ok'})
+
 @login_required
 def booking_success(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    booking = get_object_or_404(Booking.objects.select_related('bus'), id=booking_id, user=request.user)
     return render(request, 'booking/booking_success.html', {'booking': booking})
 
 @login_required
@@ -250,15 +327,29 @@ def my_bookings(request):
     bookings = Booking.objects.filter(
         user=request.user,
         payment_status='completed'
-    ).order_by('-booking_time')
-    return render(request, 'booking/my_bookings.html', {'bookings': bookings})
+    ).select_related('bus')
+    try:
+        bookings = keyset_paginate(bookings, ('-booking_time', '-id'), request.GET.get('cursor'))
+    except InvalidCursor:
+        return redirect('my_bookings')
+    return render(request, 'booking/my_bookings.html', {'bookings': bookings, 'page': bookings})
 
 @login_required
 def cancel_booking(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    booking = get_object_or_404(Booking.objects.select_related('bus'), id=booking_id, user=request.user)
     if booking.payment_status == 'completed':
         messages.warning(request, 'Cannot cancel confirmed booking. Please contact support.')
     else:
-        booking.delete()
-        messages.success(request, 'Booking cancelled successfully!')
+        with transaction.atomic():
+            # Re-read under a lock: a payment may have completed it meanwhile
+            booking = Booking.objects.select_for_update(of=('self',)).select_related('bus').filter(
+                pk=booking.pk
+            ).exclude(payment_status='completed').first()
+            if booking:
+                release_booking(booking)
+                booking.delete()
+        if booking:
+            messages.success(request, 'Booking cancelled successfully!')
+        else:
+            messages.warning(request, 'Cannot cancel confirmed booking. Please contact support.')
     return redirect('my_bookings')
\ No newline at end of file
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,8 +46,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'booking.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'booking.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'booking.replicas.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -60,7 +64,11 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',],
     'DEFAULT_PERMISSSION_CLASSES':[
         'rest_framework.permissions.IsAuthenticated',],
-    'DEFAULT_PAGINATION_CLASS':'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_RENDERER_CLASSES':[
+        'booking.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PAGINATION_CLASS':'booking.pagination.KeysetPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS':[
         'rest_framework.filters.SearchFilter',
@@ -127,9 +135,55 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT', default='5432'),
+        # Reuse each worker thread's connection for this many seconds (0 closes it
+        # after every request), checking it still works before reusing it
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'connect_timeout': config('DB_CONNECT_TIMEOUT', default=5, cast=int)},
     }
 }
 
+# How application processes hold database connections:
+#   persistent  one connection per worker thread, kept for DB_CONN_MAX_AGE
+#   pool        a psycopg 3 connection pool per process (psycopg-pool, in
+#               requirements.txt); use this under ASGI, where persistent
+#               connections are not reused
+#   pgbouncer   connect through PgBouncer in transaction pooling mode
+DB_POOL_MODE = config('DB_POOL_MODE', default='persistent')
+if DB_POOL_MODE == 'pool':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+        'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),
+        'max_idle': config('DB_POOL_MAX_IDLE', default=300, cast=float),
+    }
+elif DB_POOL_MODE == 'pgbouncer':
+    # Consecutive transactions may run on different server connections, so
+    # cursors cannot outlive a transaction (QuerySet.iterator() uses them)
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+elif DB_POOL_MODE != 'persistent':
+    raise ImproperlyConfigured(f'DB_POOL_MODE must be persistent, pool or pgbouncer, not {DB_POOL_MODE!r}')
+
+# Read replicas, as comma-separated host[:port] of streaming replicas of the
+# primary. Catalogue and availability reads go to them (booking.replicas).
+for index, address in enumerate(filter(None, (a.strip() for a in config('DB_REPLICAS', default='').split(',')))):
+    host, _, port = address.partition(':')
+    DATABASES[f'replica{index + 1}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['booking.replicas.ReplicaRouter']
+# A replica further behind than this many seconds is taken out of rotation
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=5, cast=float)
+REPLICA_LAG_CHECK_INTERVAL = config('REPLICA_LAG_CHECK_INTERVAL', default=2, cast=float)
+# After a request writes, the client reads from the primary for this long
+PRIMARY_PIN_SECONDS = config('PRIMARY_PIN_SECONDS', default=10, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -176,14 +230,132 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_URL', default=config('REDIS_URL')),
+        'OPTIONS': {
+            # Fail fast so a Redis outage falls back to the database quickly
+            'socket_connect_timeout': config('CACHE_SOCKET_TIMEOUT', default=0.25, cast=float),
+            'socket_timeout': config('CACHE_SOCKET_TIMEOUT', default=0.25, cast=float),
+        },
+    }
+}
+
+# Seconds a cached seat count for a bus and date stays valid
+AVAILABILITY_CACHE_TTL = config('AVAILABILITY_CACHE_TTL', default=60, cast=int)
+# Seconds to bypass the cache after a Redis error
+AVAILABILITY_CACHE_RETRY_AFTER = config('AVAILABILITY_CACHE_RETRY_AFTER', default=30, cast=int)
+
+# Upper bound on the age of the in-memory city autocomplete index when the
+# cache is unavailable to announce catalogue changes
+ROUTE_INDEX_MAX_AGE = config('ROUTE_INDEX_MAX_AGE', default=300, cast=int)
+
+# Shortest time (minutes) the journey planner leaves to change buses
+JOURNEY_MIN_LAYOVER = config('JOURNEY_MIN_LAYOVER', default=30, cast=int)
+
+# Confirmation emails: messages per SMTP connection, sends per recipient
+# domain per minute, attempts before giving up, first retry delay (seconds,
+# doubled per attempt), how long a worker may hold a claimed batch, and how
+# often (seconds) beat checks the queue
+EMAIL_BATCH_SIZE = config('EMAIL_BATCH_SIZE', default=100, cast=int)
+EMAIL_DOMAIN_RATE_LIMIT = config('EMAIL_DOMAIN_RATE_LIMIT', default=300, cast=int)
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BACKOFF = 30
+EMAIL_CLAIM_TIMEOUT = 300
+EMAIL_POLL_INTERVAL = config('EMAIL_POLL_INTERVAL', default=10, cast=int)
+
+# Razorpay webhooks are applied in batches of this size, at least every
+# PAYMENT_EVENTS_POLL_INTERVAL seconds
+PAYMENT_EVENTS_BATCH_SIZE = config('PAYMENT_EVENTS_BATCH_SIZE', default=500, cast=int)
+PAYMENT_EVENTS_POLL_INTERVAL = config('PAYMENT_EVENTS_POLL_INTERVAL', default=5, cast=int)
+
+# Seconds a pending booking holds its seats while the customer pays, and how
+# often (seconds) and in what batch size the sweeper expires lapsed holds
+SEAT_HOLD_TTL = config('SEAT_HOLD_TTL', default=900, cast=int)
+SEAT_HOLD_SWEEP_INTERVAL = config('SEAT_HOLD_SWEEP_INTERVAL', default=60, cast=int)
+SEAT_HOLD_SWEEP_BATCH_SIZE = config('SEAT_HOLD_SWEEP_BATCH_SIZE', default=1000, cast=int)
+
+# Class that generates booking references, and this host's number (0-255)
+# in them; give every application host its own to rule out collisions
+# between hosts. Unset, every process uses a random node instead.
+BOOKING_REFERENCE_GENERATOR = 'booking.references.TimeOrderedReferenceGenerator'
+BOOKING_REFERENCE_HOST_ID = config('BOOKING_REFERENCE_HOST_ID', default=None, cast=lambda v: None if v in (None, '') else int(v))
+
+# Most passenger lines one group booking request may contain
+GROUP_BOOKING_MAX_LINES = config('GROUP_BOOKING_MAX_LINES', default=500, cast=int)
+
+# Metrics at /metrics (booking.metrics). Scrapers send "Authorization: Bearer
+# <METRICS_TOKEN>"; with no token the endpoint only exists when DEBUG is on.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_PUBLISH_INTERVAL = config('METRICS_PUBLISH_INTERVAL', default=15, cast=int)
+METRICS_MAX_PROCESSES = config('METRICS_MAX_PROCESSES', default=64, cast=int)
+
+# API JSON responses at least this many bytes are sent brotli or gzip
+# compressed, whichever the client accepts
+RESPONSE_COMPRESSION_MIN_SIZE = config('RESPONSE_COMPRESSION_MIN_SIZE', default=1024, cast=int)
+RESPONSE_BROTLI_QUALITY = 5
+RESPONSE_GZIP_LEVEL = 6
+
 CELERY_BROKER_URL = config('REDIS_URL')
 CELERY_RESULT_BACKEND = config('REDIS_URL')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Kolkata'
+# Run tasks inline instead of queueing them, e.g. for load tests without workers
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+
+# One queue per kind of work, so a backlog of emails never delays payments.
+# docker-compose runs a worker per queue with its own pool and concurrency.
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = {
+    'booking.tasks.send_confirmation_emails': {'queue': 'email'},
+    'booking.tasks.send_booking_confirmation_email': {'queue': 'email'},
+    'booking.tasks.create_payment_order': {'queue': 'payments'},
+    'booking.tasks.process_payment_events': {'queue': 'payments'},
+    'booking.tasks.expire_seat_holds': {'queue': 'maintenance'},
+}
+# Nothing reads task results; tasks that need one must opt in with
+# ignore_result=False
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_RESULT_EXPIRES = 3600
+# Tasks are idempotent, so acknowledge them only once they finish and
+# redeliver them if the worker dies. Each worker process reserves one task
+# at a time, so a slow task does not hold others back.
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
+# Do not keep a web request waiting long on an unreachable broker; the beat
+# schedule picks up anything that could not be queued
+CELERY_TASK_PUBLISH_RETRY_POLICY = {
+    'max_retries': 2,
+    'interval_start': 0,
+    'interval_step': 0.2,
+    'interval_max': 0.5,
+}
+CELERY_BEAT_SCHEDULE = {
+    # Each run expires after one interval, so runs queued behind a slow
+    # worker are dropped instead of piling up
+    'expire-seat-holds': {
+        'task': 'booking.tasks.expire_seat_holds',
+        'schedule': SEAT_HOLD_SWEEP_INTERVAL,
+        'options': {'expires': SEAT_HOLD_SWEEP_INTERVAL},
+    },
+    'process-payment-events': {
+        'task': 'booking.tasks.process_payment_events',
+        'schedule': PAYMENT_EVENTS_POLL_INTERVAL,
+        'options': {'expires': PAYMENT_EVENTS_POLL_INTERVAL},
+    },
+    'send-confirmation-emails': {
+        'task': 'booking.tasks.send_confirmation_emails',
+        'schedule': EMAIL_POLL_INTERVAL,
+        'options': {'expires': EMAIL_POLL_INTERVAL},
+    },
+}
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = config('EMAIL_HOST')
 EMAIL_PORT = config('EMAIL_PORT', cast=int)
 EMAIL_USE_TLS = config('EMAIL_USE_TLS', cast=bool)
@@ -192,4 +364,16 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
 
 RAZORPAY_KEY_ID = config('RAZORPAY_KEY_ID')
-RAZORPAY_KEY_SECRET = config('RAZORPAY_KEY_SECRET')
\ No newline at end of file
+RAZORPAY_KEY_SECRET = config('RAZORPAY_KEY_SECRET')
+
+# Razorpay gateway calls: API base URL (point it at `manage.py fake_razorpay`
+# to work offline), per-call timeout and retries, the circuit breaker, and
+# how long (seconds) a created order is reused for the same amount
+RAZORPAY_WEBHOOK_SECRET = config('RAZORPAY_WEBHOOK_SECRET', default='')
+RAZORPAY_BASE_URL = config('RAZORPAY_BASE_URL', default='https://api.razorpay.com')
+RAZORPAY_TIMEOUT = config('RAZORPAY_TIMEOUT', default=5, cast=float)
+RAZORPAY_RETRIES = config('RAZORPAY_RETRIES', default=2, cast=int)
+RAZORPAY_RETRY_BACKOFF = 0.2
+RAZORPAY_BREAKER_THRESHOLD = 5
+RAZORPAY_BREAKER_RESET_TIMEOUT = 30
+RAZORPAY_ORDER_MAX_AGE = config('RAZORPAY_ORDER_MAX_AGE', default=86400, cast=int)
@@ -20,5 +20,6 @@ from django.urls import path, include
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('booking.urls')),
+    path('api/async/', include('booking.async_urls')),
     path('api/', include('booking.api_urls')),
 ]